@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Concurrency governor benchmark
+
+Runs many concurrent callers against an in-process stand-in provider that
+accepts only --capacity requests at a time: beyond that it answers 429, and
+latency climbs as it nears capacity. Callers go through the real
+ProviderResilience path (retries, breaker) once without a concurrency
+limit and once with the adaptive governor (per-worker backend, starting
+at a limit of 4), then report throughput, upstream 429s, failed calls, latency
+and how the governor's limit moved.
+
+Usage (from backend/):
+    python -m benchmarks.bench_governor --callers 64 --capacity 12 --duration 20
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import statistics
+import time
+
+# Governor and retry settings are read at import
+os.environ['GOVERNOR_BACKEND'] = 'local'
+os.environ['PROVIDER_CONCURRENCY'] = 'bench_governed=4:1:64'
+os.environ.setdefault('PROVIDER_RETRY_BASE_SECONDS', '0.2')
+os.environ.setdefault('GOVERNOR_DECREASE_COOLDOWN_SECONDS', '1')
+
+from services.concurrency_governor import get_governor  # noqa: E402
+from services.resilience import ProviderError, ProviderResilience, http_status_error  # noqa: E402
+
+
+class StandInProvider:
+    def __init__(self, capacity: int, latency: float):
+        self.capacity = capacity
+        self.latency = latency
+        self.in_flight = 0
+        self.requests = 0
+        self.rejected = 0
+
+    async def request(self):
+        self.requests += 1
+        self.in_flight += 1
+        try:
+            if self.in_flight > self.capacity:
+                self.rejected += 1
+                await asyncio.sleep(0.01)
+                raise http_status_error(429, 'rate limited')
+            # Queueing inside the provider: slower as it fills up
+            load = self.in_flight / self.capacity
+            await asyncio.sleep(self.latency * random.uniform(0.8, 1.2) * (1 + 3 * max(0.0, load - 0.75)))
+        finally:
+            self.in_flight -= 1
+
+
+async def run(name: str, args) -> dict:
+    provider = StandInProvider(args.capacity, args.latency)
+    resilience = ProviderResilience(name)
+    governor = get_governor(name)
+    latencies, failures, limits = [], 0, []
+    deadline = time.monotonic() + args.duration
+
+    async def caller():
+        nonlocal failures
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                await resilience.call(provider.request)
+                latencies.append(time.perf_counter() - start)
+            except ProviderError:
+                failures += 1
+                # A job that lost its image moves on to the next scene
+                await asyncio.sleep(args.latency)
+
+    async def sample():
+        while time.monotonic() < deadline:
+            limits.append(governor.limit if governor else float('nan'))
+            await asyncio.sleep(0.25)
+
+    await asyncio.gather(sample(), *(caller() for _ in range(args.callers)))
+    return {
+        'ok': len(latencies),
+        'failed': failures,
+        'upstream': provider.requests,
+        'rejected': provider.rejected,
+        'p50': statistics.median(latencies) if latencies else 0.0,
+        'p95': sorted(latencies)[int(len(latencies) * 0.95)] if latencies else 0.0,
+        'limits': limits,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--callers', type=int, default=64)
+    parser.add_argument('--capacity', type=int, default=12)
+    parser.add_argument('--latency', type=float, default=0.2, help='uncontended provider latency, seconds')
+    parser.add_argument('--duration', type=float, default=20)
+    args = parser.parse_args()
+    # Every 429 retry logs a warning
+    logging.disable(logging.WARNING)
+
+    print(f"{args.callers} callers, provider capacity {args.capacity}, {args.duration:.0f}s per run")
+    print(f"{'run':<12}{'ok/s':>8}{'failed':>8}{'upstream':>10}{'429s':>8}{'p50 s':>8}{'p95 s':>8}   limit")
+    for name in ('bench_ungoverned', 'bench_governed'):
+        result = asyncio.run(run(name, args))
+        limits = [limit for limit in result['limits'] if limit == limit]
+        trace = (f"{min(limits):.1f}..{max(limits):.1f}, last 5s mean {statistics.mean(limits[-20:]):.1f}"
+                 if limits else 'none')
+        print(f"{name[6:]:<12}{result['ok'] / args.duration:>8.1f}{result['failed']:>8}{result['upstream']:>10}"
+              f"{result['rejected']:>8}{result['p50']:>8.2f}{result['p95']:>8.2f}   {trace}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Job scheduler fairness simulation
+
+Replays seeded workloads through services.job_scheduler.JobScheduler on a
+virtual clock (no sleeping; job runtimes are drawn, not executed) and
+through a plain FIFO queue for comparison, then reports queue wait per plan
+and checks the properties the scheduler is meant to have:
+
+  free-burst   one free account queues 300 jobs at once while paid users keep
+               submitting; paid jobs should wait about as long as they
+               would without the burst, not behind it
+  monopoly     one free account queues 100 jobs, then 20 other free users
+               submit one each; they should not wait behind all 100
+  saturation   paid traffic alone exceeds capacity; free jobs still start
+               (aging), and busy plans share slots roughly by job_weight
+
+Usage (from backend/):
+    python -m benchmarks.bench_job_scheduler --slots 4 --seed 1
+"""
+import argparse
+import heapq
+import math
+import random
+import statistics
+from collections import defaultdict, deque
+
+from config.subscription_plans import get_job_weight
+from services.job_scheduler import JOB_AGING_SECONDS, JobScheduler, Ticket
+
+PLANS = ('enterprise', 'professional', 'starter', 'free')
+
+
+class FifoScheduler:
+    """What happens without the scheduler: first come, first served"""
+
+    def __init__(self, slots: int, clock):
+        self.slots = slots
+        self.clock = clock
+        self.running = 0
+        self._queue = deque()
+
+    def enqueue(self, ticket):
+        self._queue.append(ticket)
+        return self._dispatch()
+
+    def finish(self, ticket):
+        self.running -= 1
+        return self._dispatch()
+
+    def _dispatch(self):
+        started = []
+        while self.running < self.slots and self._queue:
+            ticket = self._queue.popleft()
+            ticket.started_at = self.clock()
+            self.running += 1
+            started.append(ticket)
+        return started
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def simulate(make_scheduler, arrivals: list, mean_runtime: float, seed: int) -> list:
+    """arrivals: (time, plan, user); returns finished (ticket, runtime) pairs"""
+    rng = random.Random(seed)
+    clock = Clock()
+    scheduler = make_scheduler(clock)
+    events, seq = [], 0
+    for at, plan, user in arrivals:
+        events.append((at, seq, 'arrive', (plan, user)))
+        seq += 1
+    heapq.heapify(events)
+    runtime = {}
+    done = []
+
+    def started(tickets):
+        nonlocal seq
+        for ticket in tickets:
+            duration = rng.expovariate(1 / mean_runtime)
+            runtime[id(ticket)] = duration
+            heapq.heappush(events, (clock.now + duration, seq, 'finish', ticket))
+            seq += 1
+
+    while events:
+        at, _, kind, payload = heapq.heappop(events)
+        clock.now = at
+        if kind == 'arrive':
+            plan, user = payload
+            started(scheduler.enqueue(Ticket(plan, user, now=at)))
+        else:
+            done.append((payload, runtime[id(payload)]))
+            started(scheduler.finish(payload))
+    return done
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, math.ceil(q * len(ordered)) - 1)]
+
+
+def report(name: str, done: list, group=lambda t: t.plan, groups=PLANS):
+    waits = defaultdict(list)
+    for ticket, _ in done:
+        waits[group(ticket)].append(ticket.wait_seconds)
+    print(f"  {name:<22}" + ''.join(
+        f"{g[:12]:>14}" + f"{statistics.median(waits[g]) if waits[g] else 0:>7.0f}/{percentile(waits[g], 0.95):<6.0f}"
+        for g in groups
+    ))
+    return waits
+
+
+def check(label: str, ok: bool, detail: str):
+    print(f"  [{'ok' if ok else 'FAIL'}] {label}: {detail}")
+    return ok
+
+
+def poisson(rng, rate_per_second: float, until: float):
+    t = rng.expovariate(rate_per_second)
+    while t < until:
+        yield t
+        t += rng.expovariate(rate_per_second)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--slots', type=int, default=4)
+    parser.add_argument('--runtime', type=float, default=60, help='mean job runtime, seconds')
+    parser.add_argument('--aging', type=float, default=JOB_AGING_SECONDS)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    fair = lambda clock: JobScheduler(args.slots, args.aging, clock)
+    fifo = lambda clock: FifoScheduler(args.slots, clock)
+    results = []
+    print(f"{args.slots} slots, mean runtime {args.runtime:.0f}s; waits shown as median/p95 seconds")
+
+    # free-burst: capacity is slots/runtime jobs per second; paid users use about half of it
+    print("\nfree-burst")
+    capacity = args.slots / args.runtime
+    arrivals = [(0.0, 'free', 'burst-user') for _ in range(300)]
+    for plan in ('enterprise', 'professional', 'starter'):
+        arrivals += [(t, plan, f"{plan}-{rng.randrange(5)}") for t in poisson(rng, capacity / 6, 3600)]
+    waits = {}
+    paid_only = [arrival for arrival in arrivals if arrival[1] != 'free']
+    for name, make, workload in (('fifo', fifo, arrivals), ('scheduler', fair, arrivals),
+                                 ('no free burst', fair, paid_only)):
+        waits[name] = report(name, simulate(make, workload, args.runtime, args.seed))
+    # Running jobs are not preempted, so with every slot busy a paid job still
+    # waits for one to finish; what it must not do is wait behind the burst
+    for plan in ('enterprise', 'professional'):
+        median, fifo_median = statistics.median(waits['scheduler'][plan]), statistics.median(waits['fifo'][plan])
+        results.append(check(f"{plan} median wait under one mean runtime", median <= args.runtime,
+                             f"{median:.0f}s, fifo {fifo_median:.0f}s, {statistics.median(waits['no free burst'][plan]):.0f}s without the burst"))
+
+    # monopoly: one account's queue must not delay everybody else's single jobs
+    print("\nmonopoly")
+    arrivals = [(0.0, 'free', 'monopolist') for _ in range(100)]
+    arrivals += [(10.0 + n, 'free', f"user-{n}") for n in range(20)]
+    group = lambda t: 'monopolist' if t.user_id == 'monopolist' else 'others'
+    for name, make in (('fifo', fifo), ('scheduler', fair)):
+        waits[name] = report(name, simulate(make, arrivals, args.runtime, args.seed), group, ('monopolist', 'others'))
+    others, monopolist = max(waits['scheduler']['others']), statistics.median(waits['scheduler']['monopolist'])
+    results.append(check("other users' worst wait below the monopolist's median", others < monopolist,
+                         f"{others:.0f}s vs {monopolist:.0f}s (fifo worst {max(waits['fifo']['others']):.0f}s)"))
+
+    # saturation: paid demand alone is 150% of capacity, free jobs trickle in
+    print("\nsaturation")
+    arrivals = []
+    for plan, share in (('enterprise', 0.5), ('professional', 0.5), ('starter', 0.5)):
+        arrivals += [(t, plan, f"{plan}-{rng.randrange(10)}") for t in poisson(rng, capacity * share, 7200)]
+    arrivals += [(t, 'free', f"free-{rng.randrange(50)}") for t in poisson(rng, capacity * 0.1, 7200)]
+    for name, make in (('fifo', fifo), ('no aging', lambda clock: JobScheduler(args.slots, float('inf'), clock)),
+                       ('scheduler', fair)):
+        # Only the contended period; afterwards every backlog drains unopposed
+        done = [(t, runtime) for t, runtime in simulate(make, arrivals, args.runtime, args.seed) if t.started_at <= 7200]
+        waits[name] = report(name, done)
+        slot_time = defaultdict(float)
+        for ticket, runtime in done:
+            slot_time[ticket.plan] += runtime
+        shares = {plan: slot_time[plan] / sum(slot_time.values()) for plan in PLANS}
+    print('  slot share: ' + ', '.join(f"{plan} {shares[plan]:.0%} (weight {get_job_weight(plan)})" for plan in PLANS))
+    results.append(check("busy plans share slots in weight order",
+                         shares['enterprise'] > shares['professional'] > shares['starter'],
+                         ', '.join(f"{plan} {shares[plan]:.0%}" for plan in PLANS[:3])))
+    free_p95, unaged_p95 = percentile(waits['scheduler']['free'], 0.95), percentile(waits['no aging']['free'], 0.95)
+    results.append(check("aging shortens free waits under saturation", free_p95 < unaged_p95,
+                         f"free p95 {free_p95:.0f}s, without aging {unaged_p95:.0f}s"))
+
+    print(f"\n{sum(results)} of {len(results)} checks passed")
+    raise SystemExit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Keyword extraction benchmark
+
+Builds synthetic scripts (seeded, so runs are comparable) and times
+services.keywords.extract_queries over the whole corpus in one batch,
+the same function called scene by scene, and the previous first-five-words
+heuristic. Every scene has a planted subject phrase, written once or twice
+in the middle of filler sentences; the hit rate is the share of scenes
+whose top query contains it, a proxy for how often the first search finds
+relevant footage.
+
+Usage (from backend/):
+    python -m benchmarks.bench_keywords --scenes 1000 --repeat 5
+"""
+import argparse
+import random
+import statistics
+import time
+
+from services.keywords import extract_queries
+
+FILLER_WORDS = """
+story moment light people world time place life water city morning evening journey family street window road sky
+music hands friends river mountain garden house table forest market heart colour sound silence memory idea dream
+""".split()
+SUBJECT_NOUNS = """
+lighthouse glacier bakery violin tractor submarine volcano orchard telescope windmill cathedral kayak beehive
+vineyard skyscraper canyon lantern waterfall harbour locomotive greenhouse desert caravan observatory marathon
+""".split()
+SUBJECT_ADJECTIVES = "ancient golden frozen bustling misty crimson quiet towering rusty vibrant".split()
+FUNCTION_WORDS = "the a and of to in is that it with as for on was this we our you at by from they".split()
+
+
+def legacy_extract_keywords(text: str) -> str:
+    """The extractor this replaced: first five words minus a short stop list"""
+    words = text.split()[:5]
+    stop_words = {'a', 'an', 'the', 'is', 'are', 'was', 'were', 'in', 'on', 'at', 'to', 'for'}
+    keywords = [word for word in words if word.lower() not in stop_words]
+    return ' '.join(keywords[:3])
+
+
+def sentence(rng: random.Random, words: int) -> str:
+    out = []
+    for _ in range(words):
+        # Zipf-ish: a few filler words dominate, as narration tends to
+        pool = FUNCTION_WORDS if rng.random() < 0.5 else FILLER_WORDS[:rng.randint(3, len(FILLER_WORDS))]
+        out.append(rng.choice(pool))
+    return ' '.join(out).capitalize() + '.'
+
+
+def build_corpus(scenes: int, seed: int) -> tuple:
+    rng = random.Random(seed)
+    texts, subjects = [], []
+    for n in range(scenes):
+        subject = f"{rng.choice(SUBJECT_ADJECTIVES)} {rng.choice(SUBJECT_NOUNS)}"
+        parts = [sentence(rng, rng.randint(6, 12)) for _ in range(rng.randint(2, 4))]
+        for _ in range(rng.randint(1, 2)):
+            parts.insert(rng.randint(1, len(parts)), f"The {subject} stands out.")
+        texts.append(f"Scene {n + 1}: " + ' '.join(parts))
+        subjects.append(subject.split()[1])
+    return texts, subjects
+
+
+def timed(fn, repeat: int) -> tuple:
+    durations, result = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenes', type=int, default=1000)
+    parser.add_argument('--corpora', type=int, default=3, help='independent corpora (seeds) to run')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'corpus':<8}{'method':<22}{'median ms':>11}{'us/scene':>10}{'hit rate':>10}{'distinct':>10}{'terms':>7}")
+    for seed in range(args.corpora):
+        texts, subjects = build_corpus(args.scenes, seed)
+        methods = {
+            'batch (one corpus)': lambda: [q[0] if q else '' for q in extract_queries(texts, max_queries=1)],
+            'per scene': lambda: [(extract_queries([t], max_queries=1)[0] or [''])[0] for t in texts],
+            'legacy first words': lambda: [legacy_extract_keywords(t) for t in texts],
+        }
+        for name, fn in methods.items():
+            seconds, queries = timed(fn, args.repeat)
+            hits = sum(subject in query.lower().split() for subject, query in zip(subjects, queries))
+            terms = statistics.mean(len(q.split()) for q in queries)
+            print(f"{seed:<8}{name:<22}{seconds * 1000:>11.1f}{seconds / len(texts) * 1e6:>10.1f}"
+                  f"{hits / len(texts):>10.1%}{len(set(queries)):>10}{terms:>7.2f}")
+
+
+if __name__ == '__main__':
+    main()
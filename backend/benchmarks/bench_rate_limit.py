@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Rate limit check cost
+
+Times GCRALimiter.check on its own and the whole RateLimitMiddleware
+decision (credential parsing, cached plan lookup, GCRA, response headers)
+around a no-op ASGI app, over a population of users and anonymous
+addresses. Credentials are pre-resolved, as they are after a user's first
+request, so no database is needed.
+
+Usage (from backend/):
+    python -m benchmarks.bench_rate_limit --requests 200000 --users 5000
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from config.subscription_plans import SUBSCRIPTION_PLANS
+from utils import rate_limit
+
+
+async def noop_app(scope, receive, send):
+    await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def noop_send(message):
+    pass
+
+
+def build_scopes(requests: int, users: int, anonymous_share: float, seed: int) -> list:
+    rng = random.Random(seed)
+    plans = list(SUBSCRIPTION_PLANS)
+    now = time.time()
+    tokens = [f"token-{n:08d}" for n in range(users)]
+    for n, token in enumerate(tokens):
+        rate_limit._identities[token] = (now + 3600, f"user:{n}", plans[n % len(plans)])
+
+    scopes = []
+    for _ in range(requests):
+        headers = [(b'host', b'api.example.com'), (b'accept', b'application/json'), (b'user-agent', b'bench')]
+        if rng.random() >= anonymous_share:
+            headers.append((b'authorization', f"Bearer {rng.choice(tokens)}".encode()))
+        scopes.append({
+            'type': 'http', 'method': 'GET', 'path': '/api/video/projects', 'headers': headers,
+            'client': (f"10.0.{rng.randrange(256)}.{rng.randrange(256)}", 50000),
+        })
+    return scopes
+
+
+async def run_middleware(scopes: list) -> tuple:
+    middleware = rate_limit.RateLimitMiddleware(noop_app, rate_limit.GCRALimiter())
+    baseline_start = time.perf_counter()
+    for scope in scopes:
+        await noop_app(scope, None, noop_send)
+    baseline = time.perf_counter() - baseline_start
+
+    limited = 0
+
+    async def counting_send(message):
+        nonlocal limited
+        if message['type'] == 'http.response.start' and message['status'] == 429:
+            limited += 1
+
+    start = time.perf_counter()
+    for scope in scopes:
+        await middleware(scope, None, counting_send)
+    return time.perf_counter() - start - baseline, limited
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200000)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--anonymous-share', type=float, default=0.2)
+    args = parser.parse_args()
+
+    limiter = rate_limit.GCRALimiter()
+    policy = rate_limit.POLICIES['free']
+    keys = [f"user:{n}" for n in range(args.users)]
+    now = time.time()
+    start = time.perf_counter()
+    for n in range(args.requests):
+        limiter.check(keys[n % len(keys)], policy, now)
+    gcra = time.perf_counter() - start
+
+    scopes = build_scopes(args.requests, args.users, args.anonymous_share, seed=0)
+    middleware, limited = asyncio.run(run_middleware(scopes))
+
+    print(f"{'check':<28}{'us/request':>12}")
+    print(f"{'GCRA only':<28}{gcra / args.requests * 1e6:>12.2f}")
+    print(f"{'middleware (over no-op app)':<28}{middleware / args.requests * 1e6:>12.2f}")
+    print(f"{limited} of {args.requests} requests limited ({limited / args.requests:.1%})")
+
+
+if __name__ == '__main__':
+    main()
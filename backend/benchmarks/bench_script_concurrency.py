@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Script-generation concurrency benchmark
+
+Starts the provider stand-ins (benchmarks/stand_ins.py) and, inside one
+event loop as a single worker would, runs `--in-flight` generate_script()
+calls at a time against their chat endpoint. It reports wall time,
+per-call latency and the worst event-loop lag seen by a heartbeat task.
+
+With the async client the wall time for a batch stays close to one call's
+latency and the loop keeps ticking; `--compare-sync` repeats the run with
+the old pattern (the synchronous SDK called from the coroutine), where
+calls serialise and the loop is blocked for each one in turn.
+
+Usage (from backend/):
+    python -m benchmarks.bench_script_concurrency --in-flight 50 --calls 200 --chat median=1,p99=2
+    python -m benchmarks.bench_script_concurrency --in-flight 10 --calls 10 --compare-sync
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(1, round(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+async def wait_until_ready(url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(timeout=2) as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(url)).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} did not become ready within {timeout}s")
+
+
+async def heartbeat(lags: list, pending: dict, interval: float = 0.01):
+    while True:
+        pending['expected'] = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, time.perf_counter() - pending['expected']))
+
+
+def sync_generate_script(client, prompt: str):
+    """The pre-async call pattern, for comparison"""
+    async def generate():
+        response = client.chat.completions.create(
+            model="gpt-4",
+            messages=[{"role": "user", "content": f"Create a video script about: {prompt}"}],
+            max_tokens=1500
+        )
+        return {'success': True, 'script': response.choices[0].message.content}
+    return generate()
+
+
+async def run(label: str, generate, calls: int, in_flight: int) -> dict:
+    semaphore = asyncio.Semaphore(in_flight)
+    latencies, failures, lags, pending = [], [], [], {}
+
+    async def one(n: int):
+        async with semaphore:
+            start = time.perf_counter()
+            result = await generate(f"benchmark topic {n}")
+            latencies.append(time.perf_counter() - start)
+            if not result['success']:
+                failures.append(result.get('error'))
+
+    beat = asyncio.create_task(heartbeat(lags, pending))
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    await asyncio.gather(*(one(n) for n in range(calls)))
+    elapsed = time.perf_counter() - start
+    # A beat that is still overdue was held up by the last calls
+    lags.append(max(0.0, time.perf_counter() - pending['expected']))
+    beat.cancel()
+
+    latencies.sort()
+    return {
+        'label': label,
+        'elapsed_s': elapsed,
+        'throughput': calls / elapsed,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'max_lag_ms': max(lags, default=0.0) * 1000,
+        'failures': len(failures),
+        'first_error': failures[0] if failures else None
+    }
+
+
+def print_result(result: dict, calls: int, in_flight: int):
+    print(f"{result['label']:<6} {calls} calls, {in_flight} in flight: {result['elapsed_s']:.2f}s "
+          f"({result['throughput']:.1f} scripts/s)  latency p50 {result['p50_ms']:.0f} ms  "
+          f"p99 {result['p99_ms']:.0f} ms  max loop lag {result['max_lag_ms']:.0f} ms  failures {result['failures']}")
+    if result['first_error']:
+        print(f"       first error: {result['first_error']}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=200)
+    parser.add_argument('--in-flight', type=int, default=50, help='generate_script() calls running at once')
+    parser.add_argument('--chat', default='median=1,p99=2', help='stand-in chat completions profile')
+    parser.add_argument('--compare-sync', action='store_true', help='also run the synchronous client for comparison')
+    args = parser.parse_args()
+
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}/llm"
+    stand_ins = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.stand_ins', '--port', str(port), '--chat', args.chat],
+        cwd=BACKEND_DIR
+    )
+    try:
+        await wait_until_ready(f"http://127.0.0.1:{port}/health")
+
+        # Module settings are read at import, so point it at the stand-ins first
+        os.environ['OPENAI_BASE_URL'] = base_url
+        os.environ['OPENAI_API_KEY'] = 'stand-in'
+        os.environ.setdefault('OPENAI_MAX_CONNECTIONS', str(max(args.in_flight, 1)))
+        from services import video_ai_service
+        # Done by the start-up warm-up in the app; keep the SDK import out of the timings
+        video_ai_service.get_openai_client()
+
+        result = await run('async', video_ai_service.generate_script, args.calls, args.in_flight)
+        await video_ai_service.close_openai_client()
+        print_result(result, args.calls, args.in_flight)
+
+        if args.compare_sync:
+            from openai import OpenAI
+            sync_client = OpenAI(api_key='stand-in', base_url=base_url)
+            result = await run('sync', lambda prompt: sync_generate_script(sync_client, prompt), args.calls, args.in_flight)
+            sync_client.close()
+            print_result(result, args.calls, args.in_flight)
+    finally:
+        stand_ins.terminate()
+        try:
+            stand_ins.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            stand_ins.kill()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
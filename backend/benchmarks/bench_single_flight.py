@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Single-flight coalescing benchmark
+
+Starts the provider stand-ins (benchmarks/stand_ins.py) and replays project
+submissions through AIVideoService as the generation job does: one script
+call, then an image per scene. A share of the submissions (--duplicates) is
+sent again within --resubmit-within seconds of the original, the way double
+clicks, client retries and second tabs arrive. Runs once with identical
+in-flight calls coalesced and once with every call going upstream, and
+reports upstream chat and image requests, submissions served and latency.
+
+Job-level coalescing (claim_job) needs MongoDB and is not exercised here;
+it stops the duplicate before any of these calls are made.
+
+Usage (from backend/):
+    python -m benchmarks.bench_single_flight --submissions 40 --duplicates 0.3
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.bench_script_concurrency import BACKEND_DIR, free_port, wait_until_ready
+
+
+class PassThrough:
+    """No coalescing: every call goes upstream"""
+
+    def __len__(self):
+        return 0
+
+    async def do(self, key, fn):
+        return await fn()
+
+
+async def run(label: str, service, submissions: list) -> dict:
+    from services import ai_video_service
+    if label == 'off':
+        ai_video_service._script_calls = ai_video_service._image_calls = PassThrough()
+    counts = {'chat': 0, 'image': 0}
+    generate_scenes, request_image = service._generate_scenes, service._request_image
+
+    async def counted_scenes(prompt):
+        counts['chat'] += 1
+        return await generate_scenes(prompt)
+
+    async def counted_image(image_prompt):
+        counts['image'] += 1
+        return await request_image(image_prompt)
+
+    service._generate_scenes, service._request_image = counted_scenes, counted_image
+    latencies, failures = [], 0
+
+    async def submit(at: float, text: str):
+        nonlocal failures
+        await asyncio.sleep(at)
+        start = time.perf_counter()
+        try:
+            scenes = await service.generate_script_scenes(text, num_scenes=3)
+            for scene in scenes:
+                # The stand-in writes the same scenes for every project
+                await service.generate_image_for_scene(f"{scene['image_prompt']}, {text}")
+            latencies.append(time.perf_counter() - start)
+        except Exception:
+            failures += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(submit(at, text) for at, text in submissions))
+    elapsed = time.perf_counter() - start
+    service._generate_scenes, service._request_image = generate_scenes, request_image
+    return {'label': label, 'elapsed': elapsed, 'served': len(latencies), 'failed': failures,
+            'p50': statistics.median(latencies) if latencies else 0.0, **counts}
+
+
+def workload(count: int, duplicates: float, within: float, spread: float, seed: int) -> list:
+    rng = random.Random(seed)
+    submissions = []
+    for n in range(count):
+        at = rng.uniform(0, spread)
+        text = f"Benchmark project {n}: a short history of topic {n}"
+        submissions.append((at, text))
+        if rng.random() < duplicates:
+            submissions.append((at + rng.uniform(0.05, within), text))
+    return submissions
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--submissions', type=int, default=40, help='distinct projects submitted')
+    parser.add_argument('--duplicates', type=float, default=0.3, help='share of projects submitted twice')
+    parser.add_argument('--resubmit-within', type=float, default=3, help='seconds between a submission and its duplicate')
+    parser.add_argument('--spread', type=float, default=10, help='seconds over which projects arrive')
+    parser.add_argument('--chat', default='median=2,p99=4', help='stand-in chat completions profile')
+    parser.add_argument('--image', default='median=3,p99=6', help='stand-in image generations profile')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    port = free_port()
+    stand_ins = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.stand_ins', '--port', str(port), '--chat', args.chat,
+         '--image', args.image, '--image-mode', 'url'],
+        cwd=BACKEND_DIR
+    )
+    try:
+        await wait_until_ready(f"http://127.0.0.1:{port}/health")
+
+        # Module settings are read at import, so point it at the stand-ins first
+        os.environ['EMERGENT_CHAT_URL'] = f"http://127.0.0.1:{port}/llm/chat/completions"
+        os.environ['EMERGENT_IMAGE_URL'] = f"http://127.0.0.1:{port}/llm/images/generations"
+        os.environ['EMERGENT_LLM_KEY'] = 'stand-in'
+        os.environ['GOVERNOR_BACKEND'] = 'local'
+        os.environ.setdefault('PROVIDER_CONCURRENCY', 'emergent_image=64:1:64,emergent_chat=64:1:64')
+        from services.ai_video_service import AIVideoService
+
+        submissions = workload(args.submissions, args.duplicates, args.resubmit_within, args.spread, args.seed)
+        print(f"{len(submissions)} submissions of {args.submissions} projects "
+              f"({len(submissions) - args.submissions} duplicates within {args.resubmit_within:.0f}s)")
+        print(f"{'coalescing':<12}{'chat':>6}{'images':>8}{'served':>8}{'failed':>8}{'p50 s':>8}{'wall s':>8}")
+        for label in ('on', 'off'):
+            result = await run(label, AIVideoService(), submissions)
+            print(f"{label:<12}{result['chat']:>6}{result['image']:>8}{result['served']:>8}{result['failed']:>8}"
+                  f"{result['p50']:>8.2f}{result['elapsed']:>8.1f}")
+    finally:
+        stand_ins.terminate()
+        try:
+            stand_ins.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            stand_ins.kill()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
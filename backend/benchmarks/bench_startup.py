@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Worker cold-start benchmark
+
+1. Import-time profile: runs `python -X importtime -c "import server"` and
+   lists the packages that cost the most, by their own (exclusive) import time.
+2. Start-up: launches `uvicorn server:app` repeatedly and measures the time
+   until the first successful response plus the worker's RSS right after
+   that and again after --settle seconds. The SDK warm-up runs before the
+   server accepts connections, so it counts towards the time to first
+   response; --no-warmup shows the start-up cost without it.
+
+The app's requirements must be installed. MongoDB is only needed for the
+warm-settled numbers to be realistic: Motor connects lazily and index
+creation runs in the background, so the server starts without it.
+
+Usage (from backend/):
+    python -m benchmarks.bench_startup --runs 5
+    python -m benchmarks.bench_startup --runs 5 --no-warmup
+"""
+import argparse
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORTTIME_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \| *(\S+)')
+
+
+def app_env(extra: dict = None) -> dict:
+    env = dict(os.environ)
+    env.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+    env.setdefault('DB_NAME', 'bench_startup')
+    env.update(extra or {})
+    return env
+
+
+def import_profile(top: int):
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import server'],
+        cwd=BACKEND_DIR, env=app_env(), capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        print(result.stderr[-2000:])
+        raise SystemExit("import server failed")
+
+    packages = {}
+    total_us = 0
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, name = int(match.group(1)), int(match.group(2)), match.group(3)
+        if name == 'server':
+            total_us = cumulative_us
+        # Self time summed per top-level package gives an exclusive cost per package
+        package = name.split('.')[0]
+        packages[package] = packages.get(package, 0) + self_us
+
+    print(f"import server: {total_us / 1000:.0f} ms total")
+    print(f"{'package':<32}{'self ms':>10}")
+    for package, us in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]:
+        print(f"{package:<32}{us / 1000:>10.1f}")
+
+
+def rss_mb(pid: int):
+    """Resident set size of a process and its children (uvicorn may fork)"""
+    total_kb = 0
+    pids = [pid]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            pids += [int(p) for p in f.read().split()]
+        for p in pids:
+            with open(f"/proc/{p}/status") as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total_kb += int(line.split()[1])
+    except OSError:
+        return None
+    return total_kb / 1024
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def one_start(warmup: bool, settle: float, timeout: float = 60) -> dict:
+    port = free_port()
+    env = app_env({'STARTUP_WARMUP': 'true' if warmup else 'false', 'LOG_LEVEL': 'WARNING'})
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'server:app', '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning'],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        with httpx.Client(timeout=1) as client:
+            while True:
+                if time.perf_counter() - start > timeout:
+                    raise RuntimeError("server did not start")
+                if process.poll() is not None:
+                    raise RuntimeError(f"server exited with {process.returncode}")
+                try:
+                    if client.get(f"http://127.0.0.1:{port}/api/").status_code == 200:
+                        break
+                except httpx.TransportError:
+                    time.sleep(0.01)
+        ready = time.perf_counter() - start
+        rss_ready = rss_mb(process.pid)
+        time.sleep(settle)
+        rss_settled = rss_mb(process.pid)
+        return {'ready_s': ready, 'rss_ready_mb': rss_ready, 'rss_settled_mb': rss_settled}
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=20, help='packages to list in the import profile')
+    parser.add_argument('--settle', type=float, default=5, help='seconds to wait before the second RSS sample')
+    parser.add_argument('--no-warmup', action='store_true', help='disable the start-up SDK warm-up')
+    parser.add_argument('--skip-profile', action='store_true')
+    args = parser.parse_args()
+
+    if not args.skip_profile:
+        import_profile(args.top)
+        print()
+
+    results = [one_start(not args.no_warmup, args.settle) for _ in range(args.runs)]
+
+    def median(key):
+        values = [r[key] for r in results if r[key] is not None]
+        return statistics.median(values) if values else float('nan')
+
+    print(f"start-up over {args.runs} runs (warm-up {'off' if args.no_warmup else 'on'}):")
+    print(f"  time to first request  median {median('ready_s') * 1000:.0f} ms  "
+          f"min {min(r['ready_s'] for r in results) * 1000:.0f} ms")
+    print(f"  RSS at first request   median {median('rss_ready_mb'):.1f} MB")
+    print(f"  RSS after {args.settle:.0f}s          median {median('rss_settled_mb'):.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Benchmark the /static media layer against Starlette's StaticFiles
+
+Serves the same directory through both apps in-process and measures
+requests/second for a cold GET, a browser revalidation (If-None-Match) and a
+1 MB Range request at fixed concurrency.
+
+Usage (from backend/):
+    python -m benchmarks.bench_static_media --requests 2000 --concurrency 32
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import uuid
+
+import httpx
+from starlette.applications import Starlette
+from starlette.routing import Mount
+from starlette.staticfiles import StaticFiles
+
+from utils.media_files import MediaFiles
+
+
+def build_app(static_app) -> Starlette:
+    return Starlette(routes=[Mount('/static', app=static_app)])
+
+
+async def run_scenario(app, path: str, headers: dict, total: int, concurrency: int):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        queue = asyncio.Queue()
+        for _ in range(total):
+            queue.put_nowait(None)
+        statuses = {}
+        transferred = 0
+
+        async def worker():
+            nonlocal transferred
+            while not queue.empty():
+                queue.get_nowait()
+                response = await client.get(path, headers=headers)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                transferred += len(response.content)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return total / elapsed, statuses, transferred
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--size-kb', type=int, default=2048, help='size of the generated test image')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.makedirs(os.path.join(directory, 'images'))
+        name = f"images/{uuid.uuid4()}.png"
+        with open(os.path.join(directory, name), 'wb') as f:
+            f.write(os.urandom(args.size_kb * 1024))
+        path = f"/static/{name}"
+
+        apps = {
+            'StaticFiles': build_app(StaticFiles(directory=directory)),
+            'MediaFiles': build_app(MediaFiles(directory=directory)),
+        }
+
+        for label, app in apps.items():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+                first = await client.get(path)
+            etag = first.headers.get('etag')
+            print(f"\n{label}: cache-control={first.headers.get('cache-control')!r} etag={etag}")
+
+            scenarios = {
+                'full GET': {},
+                'revalidate (If-None-Match)': {'If-None-Match': etag},
+                'Range 1MB': {'Range': 'bytes=0-1048575'},
+            }
+            for scenario, headers in scenarios.items():
+                rps, statuses, transferred = await run_scenario(app, path, headers, args.requests, args.concurrency)
+                print(f"  {scenario:<28} {rps:>9.0f} req/s  statuses={statuses}  bytes={transferred}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Worker scaling benchmark for the production launcher
+
+For each worker count, starts `python -m launcher --workers N` and drives
+GET /api/ (the full middleware stack, no database) from several client
+processes for a fixed time, then reports requests per second and the
+speed-up over one worker. With enough cores for both the workers and the
+load generators the speed-up should track N; on a box where the clients
+share the cores, run them from another host with --target instead.
+
+--reload-during sends SIGHUP to the launcher half-way through each run;
+a rolling reload should cost no failed requests.
+
+Usage (from backend/):
+    python -m benchmarks.bench_workers --workers 1,2,4,8 --duration 15
+    python -m benchmarks.bench_workers --workers 4 --reload-during
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_until_ready(url: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    with httpx.Client(timeout=2) as client:
+        while time.monotonic() < deadline:
+            try:
+                if client.get(url).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not become ready within {timeout}s")
+
+
+async def drive(url: str, connections: int, duration: float) -> tuple:
+    ok = failed = 0
+    deadline = time.monotonic() + duration
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+    async with httpx.AsyncClient(timeout=10, limits=limits) as client:
+        async def loop():
+            nonlocal ok, failed
+            while time.monotonic() < deadline:
+                try:
+                    response = await client.get(url)
+                    if response.status_code == 200:
+                        ok += 1
+                    else:
+                        failed += 1
+                except httpx.HTTPError:
+                    failed += 1
+        await asyncio.gather(*(loop() for _ in range(connections)))
+    return ok, failed
+
+
+def client_process(url: str, connections: int, duration: float, results):
+    results.put(asyncio.run(drive(url, connections, duration)))
+
+
+def run_load(url: str, clients: int, connections: int, duration: float, on_halfway=None) -> tuple:
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=client_process, args=(url, connections, duration, results))
+        for _ in range(clients)
+    ]
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+    if on_halfway:
+        time.sleep(duration / 2)
+        on_halfway()
+    totals = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - start
+    return sum(t[0] for t in totals), sum(t[1] for t in totals), elapsed
+
+
+def start_launcher(workers: int, port: int) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        STARTUP_WARMUP='false',
+        LOG_LEVEL='WARNING',
+        TRACING_EXPORTER=os.getenv('TRACING_EXPORTER', 'none'),
+    )
+    env.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+    env.setdefault('DB_NAME', 'bench_workers')
+    return subprocess.Popen(
+        [sys.executable, '-m', 'launcher', '--workers', str(workers), '--host', '127.0.0.1', '--port', str(port)],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', default=None, help='comma-separated worker counts (default: 1,2,4.. up to CPUs)')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--clients', type=int, default=None, help='load generator processes (default: CPUs)')
+    parser.add_argument('--connections', type=int, default=32, help='connections per client process')
+    parser.add_argument('--target', help='base URL of a launcher started elsewhere (single run)')
+    parser.add_argument('--reload-during', action='store_true', help='send SIGHUP half-way through each run')
+    args = parser.parse_args()
+
+    cpus = os.cpu_count() or 1
+    clients = args.clients or max(1, cpus)
+    if args.workers:
+        counts = [int(n) for n in args.workers.split(',')]
+    else:
+        counts, n = [], 1
+        while n <= cpus:
+            counts.append(n)
+            n *= 2
+
+    if args.target:
+        ok, failed, elapsed = run_load(f"{args.target.rstrip('/')}/api/", clients, args.connections, args.duration)
+        print(f"{args.target}: {ok / elapsed:.0f} req/s, {failed} failed")
+        return
+
+    print(f"{cpus} CPUs, {clients} client processes x {args.connections} connections, {args.duration:.0f}s per run")
+    print(f"{'workers':>8}{'req/s':>10}{'speed-up':>10}{'per worker':>12}{'failed':>8}")
+    baseline = None
+    for workers in counts:
+        port = free_port()
+        launcher = start_launcher(workers, port)
+        try:
+            wait_until_ready(f"http://127.0.0.1:{port}/api/")
+            # Let every worker come up, not just the first one to answer
+            time.sleep(1 + workers * 0.2)
+            reload = (lambda: launcher.send_signal(signal.SIGHUP)) if args.reload_during else None
+            ok, failed, elapsed = run_load(f"http://127.0.0.1:{port}/api/", clients, args.connections, args.duration, reload)
+        finally:
+            launcher.send_signal(signal.SIGTERM)
+            try:
+                launcher.wait(timeout=40)
+            except subprocess.TimeoutExpired:
+                launcher.kill()
+        rate = ok / elapsed
+        baseline = baseline or rate
+        print(f"{workers:>8}{rate:>10.0f}{rate / baseline:>10.2f}{rate / baseline / workers:>12.0%}{failed:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+Offline load test for the video generation API
+
+Starts the provider stand-ins (benchmarks/stand_ins.py) and the app under
+uvicorn against a throwaway MongoDB database, signs users in through the
+stand-in OAuth flow, then runs virtual users that each loop:
+
+    POST /api/video/generate -> poll GET /api/video/projects/{id} until the
+    job is completed or failed, listing GET /api/video/projects every few polls
+
+and reports throughput and p50/p95/p99 latency per endpoint plus job
+completion times. Nothing leaves the machine; a MongoDB server is required.
+
+Usage (from backend/):
+    python -m benchmarks.load_test --users 20 --concurrency 20 --jobs 200 \\
+        --chat median=2,p99=6 --image median=6,p99=15,error_rate=0.02
+
+    # against an app you started yourself (stand-in URLs already configured)
+    python -m benchmarks.load_test --target http://127.0.0.1:8001 --no-spawn-stand-ins
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import httpx
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from benchmarks.stand_ins import add_profile_arguments
+
+TERMINAL_STATUSES = {'completed', 'failed'}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, round(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class Recorder:
+    """Latencies and status codes per operation"""
+
+    def __init__(self):
+        self.latencies = {}
+        self.statuses = {}
+
+    def record(self, operation: str, seconds: float, status):
+        self.latencies.setdefault(operation, []).append(seconds)
+        counts = self.statuses.setdefault(operation, {})
+        counts[status] = counts.get(status, 0) + 1
+
+    def summary(self, elapsed: float) -> dict:
+        result = {}
+        for operation, values in self.latencies.items():
+            values = sorted(values)
+            result[operation] = {
+                'count': len(values),
+                'throughput_per_s': round(len(values) / elapsed, 2) if elapsed else 0,
+                'p50_ms': round(percentile(values, 50) * 1000, 1),
+                'p95_ms': round(percentile(values, 95) * 1000, 1),
+                'p99_ms': round(percentile(values, 99) * 1000, 1),
+                'max_ms': round(values[-1] * 1000, 1),
+                'statuses': self.statuses[operation]
+            }
+        return result
+
+
+async def wait_until_ready(url: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(timeout=2) as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(url)).status_code < 500:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.25)
+    raise RuntimeError(f"{url} did not become ready within {timeout}s")
+
+
+async def timed(recorder: Recorder, operation: str, request):
+    start = time.perf_counter()
+    try:
+        response = await request
+    except httpx.HTTPError as e:
+        recorder.record(operation, time.perf_counter() - start, type(e).__name__)
+        return None
+    recorder.record(operation, time.perf_counter() - start, response.status_code)
+    return response
+
+
+async def sign_in_users(client: httpx.AsyncClient, count: int, run_id: str, recorder: Recorder) -> list:
+    """Sign users in through the stand-in OAuth flow and return their session tokens"""
+    tokens = []
+    for n in range(count):
+        response = await timed(recorder, 'auth_google_session', client.post(
+            '/api/auth/google/session', headers={'X-Session-ID': f"loadtest-{run_id}-{n}"}
+        ))
+        if response is None or response.status_code != 200:
+            raise RuntimeError(f"Sign-in failed: {response.text if response is not None else 'no response'}")
+        tokens.append(response.cookies['session_token'])
+    return tokens
+
+
+async def virtual_user(client: httpx.AsyncClient, token: str, jobs: asyncio.Queue, recorder: Recorder,
+                       completions: list, args):
+    headers = {'Authorization': f"Bearer {token}"}
+    while True:
+        try:
+            job_number = jobs.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+
+        started = time.perf_counter()
+        response = await timed(recorder, 'generate', client.post(
+            '/api/video/generate',
+            headers=headers,
+            json={'title': f"Load test {job_number}", 'input_text': args.input_text}
+        ))
+        if response is None or response.status_code not in (200, 201, 202):
+            completions.append({'status': 'rejected', 'seconds': time.perf_counter() - started})
+            continue
+        project_id = response.json()['id']
+
+        polls = 0
+        status = None
+        while time.perf_counter() - started < args.job_timeout:
+            await asyncio.sleep(args.poll_interval)
+            polls += 1
+            response = await timed(recorder, 'poll', client.get(f"/api/video/projects/{project_id}", headers=headers))
+            if polls % args.list_every == 0:
+                await timed(recorder, 'list', client.get('/api/video/projects', headers=headers))
+            if response is not None and response.status_code == 200:
+                status = response.json()['status']
+                if status in TERMINAL_STATUSES:
+                    break
+        completions.append({
+            'status': status if status in TERMINAL_STATUSES else 'timed_out',
+            'seconds': time.perf_counter() - started
+        })
+
+
+def completion_summary(completions: list) -> dict:
+    by_status = {}
+    for job in completions:
+        by_status[job['status']] = by_status.get(job['status'], 0) + 1
+    done = sorted(job['seconds'] for job in completions if job['status'] == 'completed')
+    return {
+        'jobs': len(completions),
+        'by_status': by_status,
+        'completed_p50_s': round(percentile(done, 50), 2),
+        'completed_p95_s': round(percentile(done, 95), 2),
+        'completed_p99_s': round(percentile(done, 99), 2),
+    }
+
+
+def spawn(argv: list, env: dict) -> subprocess.Popen:
+    return subprocess.Popen(argv, env=env, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def print_report(report: dict):
+    print(f"\nRun {report['run_id']}: {report['elapsed_s']}s, concurrency {report['concurrency']}")
+    print(f"{'operation':<22}{'count':>8}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  statuses")
+    for operation, stats in report['operations'].items():
+        print(f"{operation:<22}{stats['count']:>8}{stats['throughput_per_s']:>9}{stats['p50_ms']:>10}"
+              f"{stats['p95_ms']:>10}{stats['p99_ms']:>10}  {stats['statuses']}")
+    jobs = report['jobs']
+    print(f"\njobs: {jobs['jobs']} {jobs['by_status']}")
+    print(f"completion time p50 {jobs['completed_p50_s']}s  p95 {jobs['completed_p95_s']}s  p99 {jobs['completed_p99_s']}s")
+    if report.get('stand_in_requests'):
+        print(f"stand-in requests: {report['stand_in_requests']}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target', help='base URL of an already running app (skips starting one)')
+    parser.add_argument('--app-workers', type=int, default=1, help='uvicorn workers for the spawned app')
+    parser.add_argument('--no-spawn-stand-ins', action='store_true', help='use stand-ins that are already running')
+    parser.add_argument('--stand-in-url', help='base URL of running stand-ins (with --no-spawn-stand-ins)')
+    parser.add_argument('--mongo-url', default=os.getenv('MONGO_URL', 'mongodb://localhost:27017'))
+    parser.add_argument('--db-name', help='database for the run (default: a fresh loadtest_<id>)')
+    parser.add_argument('--keep-db', action='store_true', help='do not drop the run database afterwards')
+    parser.add_argument('--plan', default='enterprise', help='plan given to load-test users so limits do not interfere')
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, default=10, help='virtual users running at once')
+    parser.add_argument('--jobs', type=int, default=50, help='total generation jobs')
+    parser.add_argument('--poll-interval', type=float, default=1.0)
+    parser.add_argument('--list-every', type=int, default=5, help='list projects every N polls')
+    parser.add_argument('--job-timeout', type=float, default=600)
+    parser.add_argument('--input-text', default='A short story about a lighthouse keeper who befriends a storm.')
+    parser.add_argument('--json', help='also write the report to this file')
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    run_id = uuid.uuid4().hex[:8]
+    db_name = args.db_name or f"loadtest_{run_id}"
+    processes = []
+    stand_in_url = args.stand_in_url
+
+    try:
+        if not args.no_spawn_stand_ins:
+            port = free_port()
+            stand_in_url = f"http://127.0.0.1:{port}"
+            processes.append(spawn([
+                sys.executable, '-m', 'benchmarks.stand_ins', '--port', str(port),
+                '--chat', args.chat, '--image', args.image, '--tts', args.tts, '--pexels', args.pexels, '--auth', args.auth,
+                '--image-mode', args.image_mode, '--image-size', str(args.image_size)
+            ], dict(os.environ)))
+            await wait_until_ready(f"{stand_in_url}/health")
+
+        target = args.target
+        if not target:
+            port = free_port()
+            target = f"http://127.0.0.1:{port}"
+            env = dict(
+                os.environ,
+                MONGO_URL=args.mongo_url,
+                DB_NAME=db_name,
+                BACKEND_URL=target,
+                EMERGENT_LLM_KEY='stand-in',
+                EMERGENT_CHAT_URL=f"{stand_in_url}/llm/chat/completions",
+                EMERGENT_IMAGE_URL=f"{stand_in_url}/llm/images/generations",
+                EMERGENT_AUTH_URL=stand_in_url,
+                OPENAI_BASE_URL=f"{stand_in_url}/llm",
+                OPENAI_API_KEY='stand-in',
+                PEXELS_API_BASE=f"{stand_in_url}/pexels",
+                PEXELS_API_KEY='stand-in',
+                STORAGE_LOCAL_ROOT=tempfile.mkdtemp(prefix='loadtest-static-'),
+            )
+            if args.app_workers > 1:
+                env['PROMETHEUS_MULTIPROC_DIR'] = tempfile.mkdtemp(prefix='loadtest-prom-')
+            processes.append(spawn([
+                sys.executable, '-m', 'uvicorn', 'server:app', '--host', '127.0.0.1', '--port', str(port),
+                '--workers', str(args.app_workers), '--log-level', 'warning'
+            ], env))
+            await wait_until_ready(f"{target}/api/")
+
+        recorder = Recorder()
+        limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency * 2)
+        async with httpx.AsyncClient(base_url=target, timeout=60, limits=limits) as client:
+            tokens = await sign_in_users(client, args.users, run_id, recorder)
+
+            mongo = AsyncIOMotorClient(args.mongo_url)
+            await mongo[db_name].users.update_many(
+                {'email': {'$regex': '^loadtest-'}}, {'$set': {'subscription_plan': args.plan}}
+            )
+
+            jobs = asyncio.Queue()
+            for n in range(args.jobs):
+                jobs.put_nowait(n)
+            completions = []
+
+            start = time.perf_counter()
+            await asyncio.gather(*(
+                virtual_user(client, tokens[n % len(tokens)], jobs, recorder, completions, args)
+                for n in range(args.concurrency)
+            ))
+            elapsed = time.perf_counter() - start
+
+        stand_in_requests = None
+        if stand_in_url:
+            async with httpx.AsyncClient(timeout=5) as stand_in_client:
+                stand_in_requests = (await stand_in_client.get(f"{stand_in_url}/health")).json()['requests']
+
+        report = {
+            'run_id': run_id,
+            'elapsed_s': round(elapsed, 2),
+            'concurrency': args.concurrency,
+            'operations': recorder.summary(elapsed),
+            'jobs': completion_summary(completions),
+            'stand_in_requests': stand_in_requests
+        }
+        print_report(report)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(report, f, indent=2)
+
+        if not args.keep_db and not args.target:
+            await mongo.drop_database(db_name)
+        mongo.close()
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
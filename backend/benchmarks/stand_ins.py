@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Local stand-ins for the paid upstream providers, for offline load tests
+
+Serves OpenAI-compatible chat completions, image generations (as the
+Emergent LLM proxy does) and text-to-speech, Pexels video/photo search and the Emergent OAuth
+session-data endpoint. Each provider has its own latency and error profile:
+
+    median=1.5,p99=6,error_rate=0.02,error_status=503,timeout_rate=0.001
+
+Latency is log-normal with the given median and p99 (seconds). A failing
+request returns error_status after its latency; a "timeout" hangs for
+hang_seconds so the caller's own timeout fires.
+
+Usage (from backend/):
+    python -m benchmarks.stand_ins --port 9100 --chat median=2,p99=6 --image median=8,p99=20,error_rate=0.05
+
+Point the app at it with:
+    EMERGENT_CHAT_URL=http://127.0.0.1:9100/llm/chat/completions
+    EMERGENT_IMAGE_URL=http://127.0.0.1:9100/llm/images/generations
+    PEXELS_API_BASE=http://127.0.0.1:9100/pexels PEXELS_API_KEY=stand-in
+    EMERGENT_AUTH_URL=http://127.0.0.1:9100
+    OPENAI_BASE_URL=http://127.0.0.1:9100/llm OPENAI_API_KEY=stand-in
+"""
+import argparse
+import asyncio
+import base64
+import io
+import json
+import math
+import random
+import re
+import uuid
+from dataclasses import dataclass, fields
+
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+
+# z-score of the 99th percentile of a standard normal distribution
+Z_99 = 2.326
+
+
+@dataclass
+class ProviderProfile:
+    median: float = 0.05
+    p99: float = 0.2
+    error_rate: float = 0.0
+    error_status: int = 503
+    timeout_rate: float = 0.0
+    hang_seconds: float = 300.0
+
+    @classmethod
+    def parse(cls, spec: str) -> 'ProviderProfile':
+        """Build a profile from 'key=value,key=value'"""
+        profile = cls()
+        types = {f.name: f.type for f in fields(cls)}
+        for item in filter(None, (spec or '').split(',')):
+            key, _, value = item.partition('=')
+            key = key.strip()
+            if key not in types:
+                raise ValueError(f"Unknown profile setting: {key}")
+            setattr(profile, key, int(value) if types[key] in (int, 'int') else float(value))
+        return profile
+
+    def sample_latency(self) -> float:
+        if self.median <= 0:
+            return 0.0
+        sigma = max(math.log(max(self.p99, self.median) / self.median) / Z_99, 1e-6)
+        return random.lognormvariate(math.log(self.median), sigma)
+
+    async def respond(self, build):
+        """Wait the sampled latency, then return an error or build()"""
+        roll = random.random()
+        if roll < self.timeout_rate:
+            await asyncio.sleep(self.hang_seconds)
+        await asyncio.sleep(self.sample_latency())
+        if roll < self.timeout_rate + self.error_rate:
+            return JSONResponse({'error': {'message': 'stand-in injected failure'}}, status_code=self.error_status)
+        return build()
+
+
+def _sample_png(size: int) -> bytes:
+    """A noisy PNG so the rendition pipeline does realistic work"""
+    from PIL import Image
+    img = Image.effect_noise((size, size), 64).convert('RGB')
+    buffer = io.BytesIO()
+    img.save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def _scenes_for(prompt: str) -> list:
+    match = re.search(r'into (\d+) engaging video scenes', prompt)
+    count = int(match.group(1)) if match else 5
+    return [
+        {
+            'scene_number': n,
+            'description': f"Stand-in scene {n}",
+            'narration': f"Narration for stand-in scene {n}.",
+            'image_prompt': f"A detailed illustration for stand-in scene {n}",
+            'duration': 5
+        }
+        for n in range(1, count + 1)
+    ]
+
+
+def build_app(profiles: dict, image_mode: str = 'b64', image_size: int = 512) -> FastAPI:
+    app = FastAPI(title='Provider stand-ins')
+    png = _sample_png(image_size)
+    png_b64 = base64.b64encode(png).decode()
+    stats = {name: 0 for name in profiles}
+
+    @app.get('/health')
+    async def health():
+        return {'status': 'ok', 'requests': stats}
+
+    @app.post('/llm/chat/completions')
+    async def chat_completions(request: Request):
+        stats['chat'] += 1
+        body = await request.json()
+        prompt = next((m['content'] for m in reversed(body.get('messages', [])) if m.get('role') == 'user'), '')
+        content = '```json\n' + json.dumps(_scenes_for(prompt)) + '\n```'
+        return await profiles['chat'].respond(lambda: {
+            'id': f"chatcmpl-{uuid.uuid4().hex}",
+            'object': 'chat.completion',
+            'model': body.get('model', 'gpt-4o'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': len(prompt) // 4, 'completion_tokens': len(content) // 4}
+        })
+
+    @app.post('/llm/images/generations')
+    async def image_generations(request: Request):
+        stats['image'] += 1
+        base_url = str(request.base_url).rstrip('/')
+
+        def build():
+            if image_mode == 'url':
+                return {'data': [{'url': f"{base_url}/files/{uuid.uuid4()}.png"}]}
+            return {'data': [{'b64_json': png_b64}]}
+        return await profiles['image'].respond(build)
+
+    @app.post('/llm/audio/speech')
+    async def speech(request: Request):
+        stats['tts'] += 1
+        body = await request.json()
+        # Roughly the size of a 64 kbit/s MP3 of the text read aloud
+        audio = b'\xff\xfb' * (len(body.get('input', '')) * 60)
+        return await profiles['tts'].respond(lambda: Response(audio, media_type='audio/mpeg'))
+
+    @app.get('/files/{name}')
+    async def hosted_image(name: str):
+        return Response(png, media_type='image/png')
+
+    def pexels_headers():
+        return {'X-Ratelimit-Limit': '20000', 'X-Ratelimit-Remaining': '19999', 'X-Ratelimit-Reset': '3600'}
+
+    @app.get('/pexels/videos/search')
+    async def pexels_videos(query: str = '', per_page: int = 5):
+        stats['pexels'] += 1
+        return await profiles['pexels'].respond(lambda: JSONResponse({
+            'page': 1,
+            'per_page': per_page,
+            'total_results': per_page,
+            'videos': [
+                {
+                    'id': n,
+                    'image': f"https://stand-in.local/pexels/{query}/{n}.jpg",
+                    'video_files': [{'link': f"https://stand-in.local/pexels/{query}/{n}.mp4", 'quality': 'hd'}]
+                }
+                for n in range(per_page)
+            ]
+        }, headers=pexels_headers()))
+
+    @app.get('/pexels/v1/search')
+    async def pexels_photos(query: str = '', per_page: int = 5):
+        stats['pexels'] += 1
+        return await profiles['pexels'].respond(lambda: JSONResponse({
+            'page': 1,
+            'per_page': per_page,
+            'photos': [
+                {'id': n, 'src': {'original': f"https://stand-in.local/pexels/{query}/{n}.jpg"}}
+                for n in range(per_page)
+            ]
+        }, headers=pexels_headers()))
+
+    @app.get('/auth/v1/env/oauth/session-data')
+    async def oauth_session(request: Request):
+        stats['auth'] += 1
+        session_id = request.headers.get('X-Session-ID', '')
+        if not session_id:
+            return JSONResponse({'detail': 'Session ID required'}, status_code=401)
+        # Stable identity per session id so repeated logins map to one user
+        user_key = uuid.uuid5(uuid.NAMESPACE_URL, session_id)
+        return await profiles['auth'].respond(lambda: {
+            'id': str(user_key),
+            'email': f"loadtest-{user_key.hex[:12]}@example.com",
+            'name': f"Load Test {user_key.hex[:6]}",
+            'picture': None,
+            'session_token': uuid.uuid4().hex
+        })
+
+    return app
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--chat', default='median=2,p99=6', help='chat completions profile')
+    parser.add_argument('--image', default='median=6,p99=15', help='image generations profile')
+    parser.add_argument('--tts', default='median=1.5,p99=4', help='text-to-speech profile')
+    parser.add_argument('--pexels', default='median=0.15,p99=0.6', help='Pexels search profile')
+    parser.add_argument('--auth', default='median=0.05,p99=0.2', help='OAuth session-data profile')
+    parser.add_argument('--image-mode', choices=['b64', 'url'], default='b64',
+                        help='return images inline (like gpt-image-1) or as hosted URLs')
+    parser.add_argument('--image-size', type=int, default=512, help='edge length of the returned PNG')
+
+
+def profiles_from_args(args) -> dict:
+    return {name: ProviderProfile.parse(getattr(args, name)) for name in ('chat', 'image', 'tts', 'pexels', 'auth')}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9100)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    app = build_app(profiles_from_args(args), image_mode=args.image_mode, image_size=args.image_size)
+    uvicorn.run(app, host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
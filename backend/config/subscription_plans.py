@@ -8,6 +8,9 @@ SUBSCRIPTION_PLANS = {
         'name': 'Starter',
         'video_limit': 5,  # videos per month
         'max_duration': 60,  # seconds (1 minute)
+        'storage_quota_mb': 5120,  # 5 GB of stored media
+        'rate_limit': {'requests_per_minute': 120, 'burst': 40},  # API requests
+        'job_weight': 2,  # share of generation workers when queued
         'features': {
             'text_to_video': True,
             'ai_voiceover': True,
@@ -24,6 +27,9 @@ SUBSCRIPTION_PLANS = {
         'name': 'Professional',
         'video_limit': 15,  # videos per month
         'max_duration': 300,  # seconds (5 minutes)
+        'storage_quota_mb': 51200,  # 50 GB of stored media
+        'rate_limit': {'requests_per_minute': 300, 'burst': 80},  # API requests
+        'job_weight': 4,  # share of generation workers when queued
         'features': {
             'text_to_video': True,
             'ai_voiceover': True,
@@ -41,6 +47,9 @@ SUBSCRIPTION_PLANS = {
         'name': 'Enterprise',
         'video_limit': 20,  # videos per month
         'max_duration': 1800,  # seconds (30 minutes)
+        'storage_quota_mb': 512000,  # 500 GB of stored media
+        'rate_limit': {'requests_per_minute': 600, 'burst': 150},  # API requests
+        'job_weight': 8,  # share of generation workers when queued
         'features': {
             'text_to_video': True,
             'ai_voiceover': True,
@@ -61,6 +70,9 @@ SUBSCRIPTION_PLANS = {
         'name': 'Free',
         'video_limit': 2,  # videos per month
         'max_duration': 30,  # seconds (30 seconds)
+        'storage_quota_mb': 500,  # 500 MB of stored media
+        'rate_limit': {'requests_per_minute': 60, 'burst': 20},  # API requests
+        'job_weight': 1,  # share of generation workers when queued
         'features': {
             'text_to_video': True,
             'ai_voiceover': False,
@@ -129,6 +141,19 @@ def check_duration_limit(plan_name, duration_seconds):
     
     return is_valid, max_duration
 
+def get_storage_quota_bytes(plan_name):
+    """
+    Get the storage quota for a plan in bytes
+    
+    Args:
+        plan_name (str): User's subscription plan
+    
+    Returns:
+        int: Quota in bytes (the free plan's quota for unknown plans)
+    """
+    plan = get_plan_limits(plan_name) or SUBSCRIPTION_PLANS['free']
+    return plan['storage_quota_mb'] * 1024 * 1024
+
 def get_plan_features(plan_name):
     """
     Get features for a specific plan
@@ -144,3 +169,30 @@ def get_plan_features(plan_name):
         return {}
     
     return plan.get('features', {})
+
+def get_rate_limit(plan_name):
+    """
+    Get the API request rate limit for a plan
+    
+    Args:
+        plan_name (str): User's subscription plan
+    
+    Returns:
+        tuple: (int: requests_per_minute, int: burst), the free plan's for unknown plans
+    """
+    plan = get_plan_limits(plan_name or 'free') or SUBSCRIPTION_PLANS['free']
+    limit = plan['rate_limit']
+    return limit['requests_per_minute'], limit['burst']
+
+def get_job_weight(plan_name):
+    """
+    Get a plan's scheduling weight for queued generation jobs
+    
+    Args:
+        plan_name (str): User's subscription plan
+    
+    Returns:
+        int: Relative share of job slots (the free plan's for unknown plans)
+    """
+    plan = get_plan_limits(plan_name or 'free') or SUBSCRIPTION_PLANS['free']
+    return plan['job_weight']
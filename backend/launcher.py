@@ -0,0 +1,456 @@
+#!/usr/bin/env python3
+"""
+Production launcher: a small pre-fork supervisor for `server:app`
+
+The master process loads .env and the read-only configuration, binds the
+listening socket and forks the workers. It never imports the app, so every
+per-process resource (Motor clients, HTTP pools, executors, the tracing
+exporter, the logging thread) is created inside a worker after the fork.
+Each worker runs uvicorn with uvloop and httptools on the shared socket and
+reports readiness and a heartbeat to the master over a pipe.
+
+    python -m launcher --host 127.0.0.1 --port 8001
+
+Worker count is WEB_CONCURRENCY if set, otherwise the smaller of the usable
+CPUs (affinity and cgroup quota) and what fits in memory at WORKER_MEMORY_MB
+each after WORKER_MEMORY_RESERVE_MB.
+
+Signals to the master:
+    SIGHUP           rolling reload: start a new worker, wait until it is
+                     serving, gracefully stop one old worker, repeat
+    SIGTERM/SIGINT   graceful shutdown of all workers
+
+A worker that dies is replaced; one that stops sending heartbeats for
+WORKER_HEARTBEAT_TIMEOUT_SECONDS (its event loop is stuck) is killed and
+replaced, and one above WORKER_MAX_RSS_MB is recycled like a reload.
+Modules in PRELOAD_MODULES are inherited from the master, so changes to them
+need a full restart rather than a reload.
+"""
+import argparse
+import errno
+import json
+import logging
+import math
+import os
+import select
+import signal
+import socket
+import sys
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+WEB_CONCURRENCY = int(os.getenv('WEB_CONCURRENCY', 0))
+WORKER_MEMORY_MB = int(os.getenv('WORKER_MEMORY_MB', 350))
+WORKER_MEMORY_RESERVE_MB = int(os.getenv('WORKER_MEMORY_RESERVE_MB', 512))
+WORKER_MAX_RSS_MB = int(os.getenv('WORKER_MAX_RSS_MB', 0))
+WORKER_GRACEFUL_TIMEOUT_SECONDS = float(os.getenv('WORKER_GRACEFUL_TIMEOUT_SECONDS', 30))
+WORKER_READY_TIMEOUT_SECONDS = float(os.getenv('WORKER_READY_TIMEOUT_SECONDS', 60))
+WORKER_HEARTBEAT_SECONDS = float(os.getenv('WORKER_HEARTBEAT_SECONDS', 1))
+WORKER_HEARTBEAT_TIMEOUT_SECONDS = float(os.getenv('WORKER_HEARTBEAT_TIMEOUT_SECONDS', 60))
+WORKER_BACKLOG = int(os.getenv('WORKER_BACKLOG', 2048))
+WORKER_KEEPALIVE_SECONDS = int(os.getenv('WORKER_KEEPALIVE_SECONDS', 5))
+WORKER_ACCESS_LOG = os.getenv('WORKER_ACCESS_LOG', 'false').lower() == 'true'
+FORWARDED_ALLOW_IPS = os.getenv('FORWARDED_ALLOW_IPS', '127.0.0.1')
+PROMETHEUS_MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+
+# Read-only modules imported once in the master and shared copy-on-write;
+# nothing here may open connections or start threads at import
+PRELOAD_MODULES = ('config.subscription_plans', 'fastapi', 'pydantic', 'starlette.routing')
+
+# A worker that dies sooner than this after starting counts as a crash loop
+MIN_UPTIME_SECONDS = 5
+MAX_RESPAWN_DELAY_SECONDS = 30
+
+logger = logging.getLogger('launcher')
+
+
+def usable_cpus() -> int:
+    """CPUs this process may run on, honouring affinity and a cgroup v2 CPU quota"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        quota, period = Path('/sys/fs/cgroup/cpu.max').read_text().split()
+        if quota != 'max':
+            cpus = min(cpus, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+def usable_memory_mb() -> int:
+    """Memory available to this container: the cgroup v2 limit, else total RAM"""
+    limit = None
+    try:
+        value = Path('/sys/fs/cgroup/memory.max').read_text().strip()
+        if value != 'max':
+            limit = int(value) // (1024 * 1024)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemTotal:'):
+                    total = int(line.split()[1]) // 1024
+                    return min(total, limit) if limit else total
+    except OSError:
+        pass
+    return limit or WORKER_MEMORY_MB + WORKER_MEMORY_RESERVE_MB
+
+
+def default_worker_count() -> int:
+    if WEB_CONCURRENCY > 0:
+        return WEB_CONCURRENCY
+    by_memory = (usable_memory_mb() - WORKER_MEMORY_RESERVE_MB) // WORKER_MEMORY_MB
+    return max(1, min(usable_cpus(), by_memory))
+
+
+def rss_mb(pid: int) -> float:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(WORKER_BACKLOG)
+    sock.set_inheritable(True)
+    return sock
+
+
+def prepare_multiproc_dir():
+    """Workers share prometheus samples through this directory; stale files from a previous run are removed"""
+    global PROMETHEUS_MULTIPROC_DIR
+    if not PROMETHEUS_MULTIPROC_DIR:
+        PROMETHEUS_MULTIPROC_DIR = os.path.join('/tmp', f"videoai-prometheus-{os.getpid()}")
+        os.environ['PROMETHEUS_MULTIPROC_DIR'] = PROMETHEUS_MULTIPROC_DIR
+    os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+    for name in os.listdir(PROMETHEUS_MULTIPROC_DIR):
+        if name.endswith('.db'):
+            os.unlink(os.path.join(PROMETHEUS_MULTIPROC_DIR, name))
+
+
+def run_worker(sock: socket.socket, notify_fd: int, args) -> int:
+    """Body of a forked worker; returns the exit code"""
+    import uvicorn
+
+    try:
+        import uvloop  # noqa: F401
+        loop = 'uvloop'
+    except ImportError:
+        loop = 'asyncio'
+    try:
+        import httptools  # noqa: F401
+        http = 'httptools'
+    except ImportError:
+        http = 'h11'
+
+    # Never block the event loop on a full pipe if the master falls behind
+    os.set_blocking(notify_fd, False)
+
+    async def notify():
+        try:
+            os.write(notify_fd, b'.')
+        except OSError:
+            pass
+
+    config = uvicorn.Config(
+        args.app,
+        loop=loop,
+        http=http,
+        lifespan='on',
+        # server.py sets up logging itself (utils.logging_config)
+        log_config=None,
+        access_log=WORKER_ACCESS_LOG,
+        proxy_headers=True,
+        forwarded_allow_ips=FORWARDED_ALLOW_IPS,
+        timeout_keep_alive=WORKER_KEEPALIVE_SECONDS,
+        timeout_graceful_shutdown=int(WORKER_GRACEFUL_TIMEOUT_SECONDS),
+        # Called from the event loop once serving, then every interval
+        callback_notify=notify,
+        timeout_notify=WORKER_HEARTBEAT_SECONDS,
+    )
+    if loop == 'asyncio' or http == 'h11':
+        logger.warning("uvloop/httptools not installed; worker %d uses %s and %s", os.getpid(), loop, http)
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+    return 0 if server.started else 3
+
+
+class Worker:
+    def __init__(self, pid: int, notify_fd: int):
+        self.pid = pid
+        self.notify_fd = notify_fd
+        self.started_at = time.monotonic()
+        self.last_beat = self.started_at
+        self.ready = False
+        # Set once the master has asked it to stop
+        self.retiring_since = None
+
+
+class Supervisor:
+    def __init__(self, args, sock: socket.socket):
+        self.args = args
+        self.sock = sock
+        self.target = args.workers
+        self.workers = {}
+        self.shutting_down = False
+        self.reload_pending = []
+        self.replacement = None
+        self.respawn_delay = 0.0
+        self.next_spawn_at = 0.0
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_w, False)
+
+    # --- signals -------------------------------------------------------
+    def install_signals(self):
+        signal.set_wakeup_fd(self._wakeup_w)
+        signal.signal(signal.SIGHUP, lambda *_: self.request_reload())
+        signal.signal(signal.SIGTERM, lambda *_: self.request_shutdown())
+        signal.signal(signal.SIGINT, lambda *_: self.request_shutdown())
+        # Handler (not SIG_IGN) so the wakeup fd is written when a worker exits
+        signal.signal(signal.SIGCHLD, lambda *_: None)
+
+    def request_reload(self):
+        if self.shutting_down:
+            return
+        old = [w.pid for w in self.workers.values() if w.retiring_since is None and w is not self.replacement]
+        logger.info("Rolling reload of %d workers", len(old))
+        self.reload_pending = old
+
+    def request_shutdown(self):
+        if not self.shutting_down:
+            logger.info("Shutting down %d workers", len(self.workers))
+        self.shutting_down = True
+        for worker in self.workers.values():
+            self.retire(worker)
+
+    # --- workers -------------------------------------------------------
+    def spawn(self) -> Worker:
+        notify_r, notify_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                signal.set_wakeup_fd(-1)
+                for sig in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+                    signal.signal(sig, signal.SIG_DFL)
+                os.close(notify_r)
+                os.close(self._wakeup_r)
+                os.close(self._wakeup_w)
+                for worker in self.workers.values():
+                    os.close(worker.notify_fd)
+                code = run_worker(self.sock, notify_w, self.args)
+            except BaseException:
+                logger.exception("Worker %d crashed", os.getpid())
+            finally:
+                logging.shutdown()
+                os._exit(code)
+
+        os.close(notify_w)
+        os.set_blocking(notify_r, False)
+        worker = Worker(pid, notify_r)
+        self.workers[pid] = worker
+        logger.info("Started worker %d", pid)
+        return worker
+
+    def retire(self, worker: Worker, sig: int = signal.SIGTERM):
+        if worker.retiring_since is None:
+            worker.retiring_since = time.monotonic()
+        try:
+            os.kill(worker.pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            worker = self.workers.pop(pid, None)
+            if worker is None:
+                continue
+            os.close(worker.notify_fd)
+            self.mark_dead(pid)
+            code = os.waitstatus_to_exitcode(status)
+            if worker is self.replacement:
+                self.replacement = None
+                if not self.shutting_down:
+                    logger.error("Replacement worker %d exited with %s before serving; reload aborted", pid, code)
+                    self.reload_pending = []
+            if worker.retiring_since is not None:
+                logger.info("Worker %d stopped (%s)", pid, code)
+            else:
+                logger.error("Worker %d exited unexpectedly with %s", pid, code)
+                if time.monotonic() - worker.started_at < MIN_UPTIME_SECONDS:
+                    self.respawn_delay = min(MAX_RESPAWN_DELAY_SECONDS, max(1.0, self.respawn_delay * 2))
+                    self.next_spawn_at = time.monotonic() + self.respawn_delay
+
+    def mark_dead(self, pid: int):
+        """Drop the live-gauge samples of an exited worker; a graceful exit also does this itself"""
+        try:
+            from prometheus_client import multiprocess
+            multiprocess.mark_process_dead(pid, PROMETHEUS_MULTIPROC_DIR)
+        except Exception as e:
+            logger.warning("Could not clean up metrics of worker %d: %s", pid, e)
+
+    def read_heartbeats(self, readable: list):
+        now = time.monotonic()
+        for worker in list(self.workers.values()):
+            if worker.notify_fd not in readable:
+                continue
+            try:
+                data = os.read(worker.notify_fd, 1024)
+            except BlockingIOError:
+                continue
+            if not data:
+                continue
+            worker.last_beat = now
+            if not worker.ready:
+                worker.ready = True
+                self.respawn_delay = 0.0
+                logger.info("Worker %d ready in %.1fs", worker.pid, now - worker.started_at)
+
+    def check_health(self):
+        now = time.monotonic()
+        for worker in list(self.workers.values()):
+            if worker.retiring_since is not None:
+                # Past the graceful window; uvicorn should have exited by now
+                if now - worker.retiring_since > WORKER_GRACEFUL_TIMEOUT_SECONDS + 5:
+                    logger.error("Worker %d did not stop in time; killing it", worker.pid)
+                    self.retire(worker, signal.SIGKILL)
+                continue
+            if not worker.ready:
+                if now - worker.started_at > WORKER_READY_TIMEOUT_SECONDS:
+                    logger.error("Worker %d not ready after %.0fs; killing it", worker.pid, WORKER_READY_TIMEOUT_SECONDS)
+                    self.retire(worker, signal.SIGKILL)
+                continue
+            if now - worker.last_beat > WORKER_HEARTBEAT_TIMEOUT_SECONDS:
+                logger.error("Worker %d missed heartbeats for %.0fs (event loop stuck); killing it",
+                             worker.pid, now - worker.last_beat)
+                self.retire(worker, signal.SIGKILL)
+            elif WORKER_MAX_RSS_MB and worker.pid not in self.reload_pending and rss_mb(worker.pid) > WORKER_MAX_RSS_MB:
+                logger.warning("Worker %d above %d MB RSS; recycling it", worker.pid, WORKER_MAX_RSS_MB)
+                self.reload_pending.append(worker.pid)
+
+    def step_reload(self):
+        """Replace one old worker at a time, never dropping below the target count"""
+        if not self.reload_pending or self.shutting_down:
+            return
+        if self.replacement is None:
+            self.replacement = self.spawn()
+            return
+        if not self.replacement.ready:
+            return
+        while self.reload_pending:
+            old = self.workers.get(self.reload_pending.pop(0))
+            if old is not None and old.retiring_since is None:
+                logger.info("Worker %d replaces %d", self.replacement.pid, old.pid)
+                self.retire(old)
+                break
+        self.replacement = None
+
+    def maintain(self):
+        """Start workers until the target count is serving (ignoring ones on their way out)"""
+        if self.shutting_down or time.monotonic() < self.next_spawn_at:
+            return
+        active = [w for w in self.workers.values() if w.retiring_since is None]
+        # During a reload the replacement is the extra worker
+        target = self.target + (1 if self.replacement is not None else 0)
+        for _ in range(target - len(active)):
+            self.spawn()
+
+    def run(self) -> int:
+        self.install_signals()
+        logger.info("Master %d starting %d workers on %s:%d", os.getpid(), self.target, self.args.host, self.args.port)
+        while True:
+            self.reap()
+            if self.shutting_down and not self.workers:
+                logger.info("All workers stopped")
+                return 0
+            self.maintain()
+            self.step_reload()
+            self.check_health()
+
+            fds = [self._wakeup_r] + [w.notify_fd for w in self.workers.values()]
+            try:
+                readable, _, _ = select.select(fds, [], [], 0.5)
+            except InterruptedError:
+                continue
+            except OSError as e:
+                # A worker's pipe closed between reap() and select()
+                if e.errno == errno.EBADF:
+                    continue
+                raise
+            if self._wakeup_r in readable:
+                try:
+                    os.read(self._wakeup_r, 1024)
+                except BlockingIOError:
+                    pass
+            self.read_heartbeats(readable)
+
+
+class _JsonLineFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {'ts': self.formatTime(record), 'level': record.levelname, 'logger': record.name,
+                 'message': record.getMessage(), 'pid': record.process}
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+def setup_master_logging():
+    """
+    Plain stream logging for the master
+
+    utils.logging_config is not used here: it starts a thread, which must not
+    exist at fork, and anything the master imports is frozen into every worker.
+    """
+    handler = logging.StreamHandler(sys.stdout)
+    if os.getenv('LOG_FORMAT', 'json').lower() == 'json':
+        handler.setFormatter(_JsonLineFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    logging.getLogger().handlers = [handler]
+    logging.getLogger().setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default=os.getenv('HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('PORT', 8001)))
+    parser.add_argument('--workers', type=int, default=None, help='default: sized from CPUs and memory')
+    parser.add_argument('--app', default='server:app')
+    args = parser.parse_args()
+    args.workers = args.workers or default_worker_count()
+
+    # Before anything imports prometheus_client, which picks its storage at import
+    prepare_multiproc_dir()
+    setup_master_logging()
+    sys.path.insert(0, str(ROOT_DIR))
+    for module in PRELOAD_MODULES:
+        __import__(module)
+
+    sock = bind_socket(args.host, args.port)
+    sys.exit(Supervisor(args, sock).run())
+
+
+if __name__ == '__main__':
+    main()
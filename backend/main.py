@@ -1,8 +1,11 @@
 from fastapi import FastAPI
+import asyncio
 from fastapi.middleware.cors import CORSMiddleware
 import os
 from dotenv import load_dotenv
 from routes import stripe_routes
+from utils.stripe_client import shutdown_stripe_executor
+from services import stripe_events
 
 load_dotenv()
 
@@ -28,6 +31,23 @@ async def root():
 async def health_check():
     return {"status": "healthy", "service": "VideoAI"}
 
+_stripe_consumer_stop = asyncio.Event()
+_stripe_consumer_task = None
+
+@app.on_event("startup")
+async def start_stripe_event_consumer():
+    global _stripe_consumer_task
+    await stripe_events.ensure_indexes()
+    _stripe_consumer_task = asyncio.create_task(stripe_events.run_consumer(_stripe_consumer_stop))
+
+@app.on_event("shutdown")
+async def shutdown_stripe_client():
+    _stripe_consumer_stop.set()
+    if _stripe_consumer_task:
+        _stripe_consumer_task.cancel()
+    shutdown_stripe_executor()
+    stripe_events.client.close()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
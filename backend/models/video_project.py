@@ -17,6 +17,9 @@ class Scene(BaseModel):
     description: str
     narration: str
     image_url: Optional[str] = None
+    image_id: Optional[str] = None
+    preview_url: Optional[str] = None  # Medium rendition chosen by the media endpoint
+    image_error: Optional[str] = None
     image_prompt: str
     duration: int = 5  # Duration in seconds
 
@@ -54,3 +57,4 @@ class VideoProjectResponse(BaseModel):
     created_at: datetime
     updated_at: datetime
     error_message: Optional[str] = None
+    coalesced: bool = False  # The project of an identical submission already in flight
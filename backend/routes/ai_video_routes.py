@@ -1,15 +1,30 @@
-from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks
+from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks, Request
+from fastapi.responses import RedirectResponse
 from typing import List
 import os
+import time
 from datetime import datetime
 from motor.motor_asyncio import AsyncIOMotorClient
 from models.video_project import VideoProject, VideoProjectCreate, VideoProjectResponse, VideoStatus, Scene
 from services.ai_video_service import AIVideoService
+from services.image_derivatives import load_manifest, forget_manifest, choose_rendition, media_url, regenerate_derivatives
+from services.image_ingest import schedule_project_ingestion
+from services.resilience import provider_states
+from services.concurrency_governor import governor_states
+from services.job_scheduler import scheduler as job_scheduler
+from services import stock_footage
+from services.storage import STORAGE_BACKEND, get_storage
+from services.storage.quota import set_storage_owner, check_quota, get_usage, find_original, touch, delete_project_media, StorageQuotaExceeded
+from utils import metrics, single_flight, tracing
 from utils.auth import get_current_user_from_token
-from config.subscription_plans import check_video_limit, check_duration_limit, get_plan_limits
+from routes.debug_routes import require_debug_token
+from config.subscription_plans import check_video_limit, check_duration_limit, get_plan_limits, get_storage_quota_bytes
+from utils.logging_config import bind_job
+import logging
 import uuid
 
 router = APIRouter(prefix="/api/video", tags=["video"])
+logger = logging.getLogger(__name__)
 
 # MongoDB connection
 MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
@@ -19,6 +34,28 @@ db = client[DB_NAME]
 
 ai_video_service = AIVideoService()
 
+async def ensure_indexes():
+    await single_flight.ensure_job_indexes(db.video_projects)
+
+def coalesced_response(existing: dict) -> VideoProjectResponse:
+    """The in-flight project an identical submission was attached to"""
+    metrics.inc('generation_requests_coalesced_total', {'endpoint': 'video_projects'})
+    logger.info("Identical submission attached to in-flight project %s", existing["_id"])
+    return VideoProjectResponse(
+        id=existing["_id"],
+        user_id=existing["user_id"],
+        title=existing["title"],
+        status=existing["status"],
+        scenes=[Scene(**s) for s in existing.get("scenes", [])],
+        video_url=existing.get("video_url"),
+        thumbnail_url=existing.get("thumbnail_url"),
+        duration=existing.get("duration", 0),
+        created_at=existing["created_at"],
+        updated_at=existing["updated_at"],
+        error_message=existing.get("error_message"),
+        coalesced=True
+    )
+
 @router.post("/generate", response_model=VideoProjectResponse)
 async def create_video_project(
     project: VideoProjectCreate,
@@ -28,6 +65,10 @@ async def create_video_project(
     """
     Create a new video project and start AI generation
     Checks subscription limits before creating
+    
+    A submission identical to one of the user's in-flight projects (same
+    title and input text, up to whitespace) returns that project, marked
+    coalesced, instead of starting another
     """
     try:
         # Get user's subscription plan
@@ -37,6 +78,13 @@ async def create_video_project(
         
         subscription_plan = user.get('subscription_plan', 'free')
         
+        # Double clicks, retries and second tabs attach to the running job
+        # (checked before the limits, which that job has already passed)
+        request_key = single_flight.request_key(current_user["id"], title=project.title, input_text=project.input_text)
+        existing = await single_flight.find_job(db.video_projects, request_key)
+        if existing:
+            return coalesced_response(existing)
+        
         # Count videos created this month
         from datetime import datetime
         current_month_start = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
@@ -54,6 +102,12 @@ async def create_video_project(
                 detail=f"Video limit reached. Your {subscription_plan.title()} plan allows {plan_info['video_limit']} videos per month. Upgrade to create more videos."
             )
         
+        # Check storage quota before starting a job that will store images
+        try:
+            await check_quota({'user_id': current_user['id'], 'plan': subscription_plan}, 0)
+        except StorageQuotaExceeded as e:
+            raise HTTPException(status_code=403, detail=f"{e}. Delete old projects or upgrade your plan.")
+        
         # Create project ID
         project_id = str(uuid.uuid4())
         
@@ -72,14 +126,20 @@ async def create_video_project(
             "videos_remaining": remaining - 1,
             "created_at": datetime.now(),
             "updated_at": datetime.now(),
-            "error_message": None
+            "error_message": None,
+            "trace_id": tracing.current_trace_id()
         }
         
-        # Insert into database
-        await db.video_projects.insert_one(video_project)
+        # Insert into database, unless an identical submission got there first
+        existing = await single_flight.claim_job(db.video_projects, video_project, request_key)
+        if existing:
+            return coalesced_response(existing)
         
         # Start background task for video generation
-        background_tasks.add_task(generate_video_background, project_id, project.input_text, subscription_plan)
+        background_tasks.add_task(
+            generate_video_background, project_id, project.input_text, subscription_plan, current_user["id"],
+            tracing.current_carrier()
+        )
         
         return VideoProjectResponse(
             id=project_id,
@@ -98,16 +158,33 @@ async def create_video_project(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to create video project: {str(e)}")
 
-async def generate_video_background(project_id: str, input_text: str, subscription_plan: str = 'free'):
+async def generate_video_background(project_id: str, input_text: str, subscription_plan: str = 'free', user_id: str = None, trace_parent: dict = None):
     """
     Background task to generate video scenes and images
     Enforces duration limits based on subscription plan
+    Runs in a span continuing trace_parent, the trace of the request that created the job
+    Waits for a job slot first; paid plans are scheduled ahead of free ones
     """
+    bind_job(project_id)
+    with tracing.span("video.generate_job", {'video.project_id': project_id, 'video.plan': subscription_plan}, parent=trace_parent):
+        async with job_scheduler.slot(subscription_plan, user_id, project_id):
+            await _generate_video(project_id, input_text, subscription_plan, user_id)
+
+async def _generate_video(project_id: str, input_text: str, subscription_plan: str, user_id: str):
+    # Attribute every stored image (and derivative) to this user and project
+    set_storage_owner(user_id, project_id, subscription_plan)
+    
     # Create async MongoDB client for background task
     bg_client = AsyncIOMotorClient(MONGO_URL)
     bg_db = bg_client[DB_NAME]
+    job_started = time.perf_counter()
+    outcome = VideoStatus.FAILED
     
     try:
+        # Fail fast instead of paying for a script while the image provider is down
+        if not ai_video_service.image_provider_available():
+            raise RuntimeError("Image generation is temporarily unavailable. Please try again in a few minutes.")
+        
         # Get plan limits
         plan_limits = get_plan_limits(subscription_plan)
         max_duration = plan_limits['max_duration'] if plan_limits else 60
@@ -124,7 +201,9 @@ async def generate_video_background(project_id: str, input_text: str, subscripti
             {"$set": {"status": VideoStatus.GENERATING_SCRIPT, "updated_at": datetime.now()}}
         )
         
-        scenes = await ai_video_service.generate_script_scenes(input_text)
+        with tracing.span('video.stage.script'), \
+                metrics.timer('video_pipeline_stage_duration_seconds', {'stage': 'script'}, metrics.LONG_BUCKETS):
+            scenes = await ai_video_service.generate_script_scenes(input_text)
         
         # Save scenes to database
         await bg_db.video_projects.update_one(
@@ -138,30 +217,51 @@ async def generate_video_background(project_id: str, input_text: str, subscripti
             {"$set": {"status": VideoStatus.GENERATING_IMAGES, "updated_at": datetime.now()}}
         )
         
-        scenes_with_images = await ai_video_service.generate_all_scene_images(scenes)
+        with tracing.span('video.stage.images', {'video.scenes': len(scenes)}), \
+                metrics.timer('video_pipeline_stage_duration_seconds', {'stage': 'images'}, metrics.LONG_BUCKETS):
+            scenes_with_images = await ai_video_service.generate_all_scene_images(scenes)
+        
+        failed_scenes = [s['scene_number'] for s in scenes_with_images if not s.get('image_url')]
         
         # Calculate total duration
         total_duration = sum(scene.get('duration', 5) for scene in scenes_with_images)
         
-        # Set thumbnail as first scene image
-        thumbnail_url = scenes_with_images[0].get('image_url') if scenes_with_images else None
+        # Set thumbnail as first scene image, using its thumbnail rendition when available
+        thumbnail_url = None
+        if scenes_with_images:
+            first_scene = scenes_with_images[0]
+            if first_scene.get('image_id'):
+                thumbnail_url = media_url(first_scene['image_id'], 'thumb')
+            else:
+                thumbnail_url = first_scene.get('image_url')
         
-        # Update project with completed status
-        await bg_db.video_projects.update_one(
-            {"_id": project_id},
-            {
-                "$set": {
-                    "status": VideoStatus.COMPLETED,
-                    "scenes": scenes_with_images,
-                    "duration": total_duration,
-                    "thumbnail_url": thumbnail_url,
-                    "updated_at": datetime.now()
+        # Update project with completed status, or failed if any scene has no image
+        with tracing.span('video.stage.save'), \
+                metrics.timer('video_pipeline_stage_duration_seconds', {'stage': 'save'}, metrics.LONG_BUCKETS):
+            await bg_db.video_projects.update_one(
+                {"_id": project_id},
+                {
+                    "$set": {
+                        "status": VideoStatus.FAILED if failed_scenes else VideoStatus.COMPLETED,
+                        "error_message": f"Image generation failed for scene(s) {', '.join(map(str, failed_scenes))}" if failed_scenes else None,
+                        "scenes": scenes_with_images,
+                        "duration": total_duration,
+                        "thumbnail_url": thumbnail_url,
+                        "updated_at": datetime.now()
+                    },
+                    "$unset": single_flight.RELEASE_JOB_KEY
                 }
-            }
-        )
+            )
+        
+        if not failed_scenes:
+            outcome = VideoStatus.COMPLETED
+        
+        # Copy any provider-hosted images into our storage in the background
+        schedule_project_ingestion(db, project_id)
         
     except Exception as e:
-        print(f"Error in background video generation: {e}")
+        logger.error("Background video generation failed: %s", e)
+        tracing.record_exception(e)
         await bg_db.video_projects.update_one(
             {"_id": project_id},
             {
@@ -169,12 +269,87 @@ async def generate_video_background(project_id: str, input_text: str, subscripti
                     "status": VideoStatus.FAILED,
                     "error_message": str(e),
                     "updated_at": datetime.now()
-                }
+                },
+                "$unset": single_flight.RELEASE_JOB_KEY
             }
         )
     finally:
+        metrics.observe('video_job_duration_seconds', time.perf_counter() - job_started,
+                        {'outcome': outcome.value}, metrics.LONG_BUCKETS)
         bg_client.close()
 
+@router.get("/provider-health")
+async def get_provider_health(request: Request):
+    """
+    Circuit breaker state, retry counters and concurrency limits for upstream AI providers
+    Operators only: needs DEBUG_API_TOKEN, like the /api/debug endpoints
+    """
+    require_debug_token(request)
+    return {
+        "providers": provider_states(),
+        "concurrency": governor_states(),
+        "pexels_rate_limit": stock_footage.ratelimit_state(),
+        "metrics": metrics.snapshot("provider_")
+    }
+
+@router.get("/job-queue")
+async def get_job_queue(request: Request):
+    """
+    Generation job slots, queue depth and queue wait per plan
+    Reports the worker process that handles the request
+    Operators only: needs DEBUG_API_TOKEN, like the /api/debug endpoints
+    """
+    require_debug_token(request)
+    return {
+        "scheduler": job_scheduler.stats(),
+        "metrics": metrics.snapshot("generation_job")
+    }
+
+async def rebuild_renditions(image_id: str, original: dict):
+    """Regenerate evicted renditions, charging them to the original's owner"""
+    set_storage_owner(original.get('user_id'), original.get('project_id'))
+    try:
+        await regenerate_derivatives(image_id, original['_id'])
+    except Exception as e:
+        logger.error("Failed to rebuild renditions for %s: %s", image_id, e)
+
+@router.get("/media/{image_id}")
+async def get_media(image_id: str, request: Request, background_tasks: BackgroundTasks, size: str = None, w: int = None):
+    """
+    Redirect to the best rendition of a stored image
+    Picks by requested size name (thumb, medium, original) or minimum width,
+    and serves WebP to clients whose Accept header allows it
+    """
+    manifest = await load_manifest(image_id)
+    if manifest:
+        rendition = choose_rendition(manifest, size=size, width=w, accept=request.headers.get('accept', ''))
+        # Local renditions can be evicted by any worker, after this one cached the manifest
+        if STORAGE_BACKEND == 'local' and rendition.get('key') and await get_storage().stat(rendition['key']) is None:
+            forget_manifest(image_id)
+            manifest = None
+    if not manifest:
+        # Renditions may have been evicted; serve the original while they are rebuilt
+        original = await find_original(image_id)
+        if not original:
+            raise HTTPException(status_code=404, detail="Image not found")
+        background_tasks.add_task(rebuild_renditions, image_id, original)
+        return RedirectResponse(
+            get_storage().public_url(original['_id']),
+            status_code=302,
+            headers={'Cache-Control': 'no-cache'}
+        )
+    
+    if rendition.get('key'):
+        touch(rendition['key'])
+    return RedirectResponse(
+        rendition['url'],
+        status_code=302,
+        headers={
+            'Vary': 'Accept',
+            'Cache-Control': 'public, max-age=86400'
+        }
+    )
+
 @router.get("/projects", response_model=List[VideoProjectResponse])
 async def get_user_projects(current_user: dict = Depends(get_current_user_from_token)):
     """
@@ -242,6 +417,9 @@ async def delete_project(project_id: str, current_user: dict = Depends(get_curre
         if result.deleted_count == 0:
             raise HTTPException(status_code=404, detail="Project not found")
         
+        # Free the project's stored images and their derivatives
+        await delete_project_media(get_storage(), project_id)
+        
         return {"message": "Project deleted successfully"}
     except HTTPException:
         raise
@@ -286,6 +464,8 @@ async def get_subscription_info(current_user: dict = Depends(get_current_user_fr
             'max_duration_seconds': plan_limits['max_duration'],
             'max_duration_minutes': plan_limits['max_duration'] / 60,
             'features': plan_limits['features'],
+            'storage_used_bytes': await get_usage(current_user['id']),
+            'storage_quota_bytes': get_storage_quota_bytes(subscription_plan),
             'usage_percentage': (videos_this_month / plan_limits['video_limit']) * 100 if plan_limits['video_limit'] > 0 else 0
         }
     except HTTPException:
@@ -6,14 +6,18 @@ from datetime import datetime, timezone, timedelta
 from utils.auth import hash_password, verify_password, create_access_token, decode_access_token
 from utils.email import send_password_reset_email, send_password_changed_notification
 import httpx
+import logging
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
 
+EMERGENT_AUTH_URL = os.getenv('EMERGENT_AUTH_URL', 'https://demobackend.emergentagent.com')
+
 # Pydantic models
 class UserRegister(BaseModel):
     email: EmailStr
@@ -52,25 +56,15 @@ async def get_current_user(authorization: str = Header(None)):
 async def register(user_data: UserRegister):
     """Register a new user"""
     try:
-        print(f"🔍 Registration attempt - Received user_data: {user_data}")
-        print(f"📧 Email: {user_data.email}")
-        print(f"👤 Name: {user_data.name}")
-        print(f"🔒 Password length: {len(user_data.password)}")
-        
         # Check if user already exists
-        print(f"🔍 Checking if user exists with email: {user_data.email}")
         existing_user = await db.users.find_one({'email': user_data.email})
         
         if existing_user:
-            print(f"❌ User already exists: {existing_user}")
+            logger.info("Registration rejected: email already registered")
             raise HTTPException(status_code=400, detail='Email already registered')
         
-        print("✅ User doesn't exist, proceeding with registration")
-        
         # Create new user
-        print("🔒 Hashing password...")
         hashed_password = hash_password(user_data.password)
-        print("✅ Password hashed successfully")
         
         new_user = {
             'email': user_data.email,
@@ -82,14 +76,11 @@ async def register(user_data: UserRegister):
             'updated_at': datetime.utcnow().isoformat()
         }
         
-        print(f"💾 Inserting new user into database: {new_user}")
         result = await db.users.insert_one(new_user)
-        print(f"✅ User inserted with ID: {result.inserted_id}")
+        logger.info("User registered", extra={'user_id': str(result.inserted_id)})
         
         # Create access token
-        print("🎫 Creating access token...")
         access_token = create_access_token(data={'sub': user_data.email})
-        print("✅ Access token created successfully")
         
         response_data = {
             'access_token': access_token,
@@ -102,17 +93,12 @@ async def register(user_data: UserRegister):
             }
         }
         
-        print(f"🎉 Registration successful, returning: {response_data}")
         return response_data
         
     except HTTPException as e:
-        print(f"❌ HTTP Exception during registration: {e.detail}")
         raise e
     except Exception as e:
-        print(f"💥 Unexpected error during registration: {str(e)}")
-        print(f"Error type: {type(e)}")
-        import traceback
-        print(f"Traceback: {traceback.format_exc()}")
+        logger.exception("Registration failed")
         raise HTTPException(status_code=500, detail=f'Registration failed: {str(e)}')
 
 @router.post('/login')
@@ -167,7 +153,7 @@ async def process_google_session(request: Request, response: Response):
         # Call Emergent Auth API to get user data
         async with httpx.AsyncClient() as client:
             auth_response = await client.get(
-                'https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data',
+                f'{EMERGENT_AUTH_URL}/auth/v1/env/oauth/session-data',
                 headers={'X-Session-ID': session_id},
                 timeout=10.0
             )
@@ -357,7 +343,7 @@ async def forgot_password(request: ForgotPasswordRequest):
                 user_name=user.get('name')
             )
         except Exception as email_error:
-            print(f"Failed to send email: {email_error}")
+            logger.error("Failed to send password reset email: %s", email_error)
             # Continue anyway - don't reveal email sending failure
         
         return {
@@ -433,7 +419,7 @@ async def reset_password(request: ResetPasswordRequest):
                 user_name=user.get('name') if user else None
             )
         except Exception as email_error:
-            print(f"Failed to send confirmation email: {email_error}")
+            logger.error("Failed to send password change confirmation email: %s", email_error)
             # Continue anyway - password was changed successfully
         
         return {
@@ -0,0 +1,47 @@
+from fastapi import APIRouter, HTTPException, Request
+from pydantic import BaseModel
+from typing import Optional
+import os
+from utils.loop_monitor import monitor
+
+router = APIRouter(prefix="/api/debug", tags=["debug"])
+
+# Debug endpoints are off unless a token is configured
+DEBUG_API_TOKEN = os.getenv("DEBUG_API_TOKEN")
+
+class LoopMonitorSettings(BaseModel):
+    enabled: Optional[bool] = None
+    threshold_ms: Optional[float] = None
+    interval_ms: Optional[float] = None
+    reset: bool = False
+
+def require_debug_token(request: Request):
+    if not DEBUG_API_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if request.headers.get("authorization") != f"Bearer {DEBUG_API_TOKEN}":
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+@router.get("/loop-monitor")
+async def get_loop_monitor(request: Request, limit: int = 20):
+    """
+    Event-loop lag and the code paths that blocked the loop longest
+    Reports this worker process only
+    """
+    require_debug_token(request)
+    return monitor.report(limit)
+
+@router.post("/loop-monitor")
+async def update_loop_monitor(settings: LoopMonitorSettings, request: Request):
+    """
+    Switch the loop monitor on or off, change its threshold, or clear its counters
+    Applies to the worker process that handles the request
+    """
+    require_debug_token(request)
+    monitor.configure(threshold_ms=settings.threshold_ms, interval_ms=settings.interval_ms)
+    if settings.reset:
+        monitor.reset()
+    if settings.enabled is True:
+        monitor.start()
+    elif settings.enabled is False:
+        monitor.stop()
+    return monitor.report(0)
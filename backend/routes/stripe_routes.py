@@ -1,14 +1,17 @@
 from fastapi import APIRouter, HTTPException, Request
 import stripe
 import os
+import json
 from dotenv import load_dotenv
+from utils import metrics
+from utils.stripe_client import call_stripe, STRIPE_METRICS_ENABLED
+from services.stripe_events import enqueue_event
+import logging
 
 load_dotenv()
 
 router = APIRouter()
-
-# Initialize Stripe
-stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
+logger = logging.getLogger(__name__)
 
 # Pricing configuration
 PRICING_PLANS = {
@@ -55,7 +58,9 @@ async def create_checkout_session(request: Request):
         frontend_url = os.getenv('FRONTEND_URL', 'http://localhost:3000')
         
         # Create Checkout Session
-        checkout_session = stripe.checkout.Session.create(
+        checkout_session = await call_stripe(
+            'checkout.session.create',
+            stripe.checkout.Session.create,
             payment_method_types=['card'],
             line_items=[
                 {
@@ -70,6 +75,12 @@ async def create_checkout_session(request: Request):
             metadata={
                 'plan': plan_type,
                 'billing': billing_period
+            },
+            subscription_data={
+                'metadata': {
+                    'plan': plan_type,
+                    'billing': billing_period
+                }
             }
         )
         
@@ -80,7 +91,7 @@ async def create_checkout_session(request: Request):
         }
     
     except Exception as e:
-        print(f"Stripe Error: {str(e)}")
+        logger.error("Stripe error: %s", e)
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.post('/create-payment-intent')
@@ -98,7 +109,9 @@ async def create_payment_intent(request: Request):
         amount = plan_config['price']
         
         # Create PaymentIntent
-        intent = stripe.PaymentIntent.create(
+        intent = await call_stripe(
+            'payment_intent.create',
+            stripe.PaymentIntent.create,
             amount=amount,
             currency='usd',
             metadata={
@@ -116,7 +129,7 @@ async def create_payment_intent(request: Request):
         }
     
     except Exception as e:
-        print(f"Stripe Error: {str(e)}")
+        logger.error("Stripe error: %s", e)
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.post('/webhook')
@@ -135,22 +148,13 @@ async def stripe_webhook(request: Request):
     except Exception as e:
         raise HTTPException(status_code=400, detail='Invalid signature')
     
-    # Handle the event
-    if event['type'] == 'checkout.session.completed':
-        session = event['data']['object']
-        # Handle successful subscription
-        print(f"Subscription successful for session: {session['id']}")
-        # TODO: Update user subscription status in database
-        
-    elif event['type'] == 'payment_intent.succeeded':
-        payment_intent = event['data']['object']
-        print(f"PaymentIntent successful: {payment_intent['id']}")
-        # TODO: Handle one-time payment success
-        
-    elif event['type'] == 'customer.subscription.deleted':
-        subscription = event['data']['object']
-        print(f"Subscription cancelled: {subscription['id']}")
-        # TODO: Update user subscription status
+    # Store the event and acknowledge at once; the background consumer
+    # in services.stripe_events applies it to the user's subscription
+    try:
+        await enqueue_event(json.loads(payload))
+    except Exception as e:
+        logger.error("Failed to store Stripe event %s: %s", event['id'], e)
+        raise HTTPException(status_code=500, detail='Failed to store event')
     
     return {'success': True}
 
@@ -158,7 +162,7 @@ async def stripe_webhook(request: Request):
 async def get_subscription(subscription_id: str):
     """Get subscription details"""
     try:
-        subscription = stripe.Subscription.retrieve(subscription_id)
+        subscription = await call_stripe('subscription.retrieve', stripe.Subscription.retrieve, subscription_id)
         return {
             'subscription': subscription,
             'success': True
@@ -173,11 +177,21 @@ async def cancel_subscription(request: Request):
         data = await request.json()
         subscription_id = data.get('subscription_id')
         
-        subscription = stripe.Subscription.delete(subscription_id)
+        subscription = await call_stripe('subscription.delete', stripe.Subscription.delete, subscription_id)
         
         return {
             'subscription': subscription,
             'success': True
         }
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get('/metrics')
+async def get_stripe_metrics():
+    """Return Stripe call counts and latencies for this worker"""
+    if not STRIPE_METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail='Stripe metrics are disabled')
+    return {
+        'metrics': metrics.snapshot('stripe_'),
+        'success': True
+    }
@@ -1,19 +1,48 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, ReturnDocument
+import asyncio
+import logging
 import os
-from datetime import datetime
+import time
+import uuid
+from datetime import datetime, timedelta
 from bson import ObjectId
-from services.video_ai_service import generate_script, search_stock_footage, generate_voiceover
+from bson.errors import InvalidId
+from services.video_ai_service import generate_script, generate_voiceover
+from services.stock_footage import search_many
+from services.keywords import extract_keywords, extract_queries
+from services.job_scheduler import scheduler as job_scheduler
+from services.storage import get_storage
+from services.storage.quota import set_storage_owner, delete_project_media
 from routes.auth_routes import get_current_user
+from utils import metrics, single_flight, tracing
+from utils.logging_config import bind_job
 
-router = APIRouter()
+router = APIRouter(prefix="/api/videos")
+
+logger = logging.getLogger(__name__)
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
 
+# A running (or queued) job renews its lease in the videos document; a job
+# whose lease lapsed lost its worker (restart, recycle, crash) and is requeued
+VIDEO_JOB_LEASE_SECONDS = float(os.getenv('VIDEO_JOB_LEASE_SECONDS', 120))
+VIDEO_JOB_SWEEP_SECONDS = float(os.getenv('VIDEO_JOB_SWEEP_SECONDS', 30))
+VIDEO_JOB_MAX_RUNS = int(os.getenv('VIDEO_JOB_MAX_RUNS', 3))
+
+# Requeued jobs, held so they are not garbage collected mid-run
+_requeued_jobs = set()
+
+async def ensure_indexes():
+    await single_flight.ensure_job_indexes(db.videos)
+    await db.videos.create_index([('status', ASCENDING), ('locked_until', ASCENDING)])
+
 # Pydantic models
 class VideoGenerationRequest(BaseModel):
     prompt: str
@@ -25,6 +54,22 @@ class ScriptGenerationRequest(BaseModel):
     prompt: str
     video_length: str = "short"
 
+class SceneUpdateRequest(BaseModel):
+    text: str
+
+async def scene_voiceover(texts: list, voice: str, video_id: str):
+    """Narrate each scene (cached per scene) and return the video's stored voiceover, or None on failure"""
+    voiceover_result = await generate_voiceover(texts, voice, video_id)
+    if not voiceover_result['success']:
+        return None
+    return {
+        'filename': voiceover_result['filename'],
+        'key': voiceover_result['key'],
+        'url': voiceover_result['url'],
+        'voice': voiceover_result['voice'],
+        'segments': [segment['key'] for segment in voiceover_result['segments']]
+    }
+
 @router.post('/generate-script')
 async def create_script(request: ScriptGenerationRequest, current_user = Depends(get_current_user)):
     """Generate AI script from prompt"""
@@ -44,26 +89,244 @@ async def create_script(request: ScriptGenerationRequest, current_user = Depends
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.post('/generate-video')
-async def create_video(request: VideoGenerationRequest, current_user = Depends(get_current_user)):
-    """Generate complete video from prompt"""
+JOB_TERMINAL_STATUSES = ('completed', 'failed')
+
+def accepted_response(job_id: str, status: str, coalesced: bool = False) -> JSONResponse:
+    return JSONResponse(
+        status_code=202,
+        headers={'Location': f"{router.prefix}/jobs/{job_id}"},
+        content={
+            'success': True,
+            'job_id': job_id,
+            'video_id': job_id,
+            'status': status,
+            'coalesced': coalesced,
+            'status_url': f"{router.prefix}/jobs/{job_id}",
+            'result_url': f"{router.prefix}/jobs/{job_id}/result"
+        }
+    )
+
+def coalesced_response(existing: dict) -> JSONResponse:
+    """The in-flight job an identical submission was attached to"""
+    job_id = str(existing['_id'])
+    metrics.inc('generation_requests_coalesced_total', {'endpoint': 'videos'})
+    logger.info("Identical submission attached to in-flight video job %s", job_id)
+    return accepted_response(job_id, existing.get('status'), coalesced=True)
+
+@router.post('/generate-video', status_code=202)
+async def create_video(request: VideoGenerationRequest, background_tasks: BackgroundTasks, current_user = Depends(get_current_user)):
+    """
+    Queue complete video generation from a prompt
+    
+    Returns 202 with a job id straight away; poll GET /jobs/{job_id} and
+    fetch GET /jobs/{job_id}/result once the status is completed. Submitting
+    the same prompt and options while that job is in flight returns the same
+    job (with coalesced true) instead of starting another.
+    """
+    try:
+        user_id = str(current_user['_id'])
+        request_key = single_flight.request_key(
+            user_id, prompt=request.prompt, video_length=request.video_length,
+            voice=request.voice, include_voiceover=request.include_voiceover
+        )
+        existing = await single_flight.find_job(db.videos, request_key)
+        if existing:
+            return coalesced_response(existing)
+        
+        now = datetime.utcnow().isoformat()
+        lease_token = uuid.uuid4().hex
+        video_data = {
+            'user_id': user_id,
+            'title': request.prompt[:100],
+            'prompt': request.prompt,
+            'script': None,
+            'scenes': [],
+            'voiceover': None,
+            'video_length': request.video_length,
+            'status': 'pending',
+            'error': None,
+            'created_at': now,
+            'updated_at': now,
+            'views': 0,
+            'trace_id': tracing.current_trace_id(),
+            # Enough to run the job again on another worker
+            'voice': request.voice,
+            'include_voiceover': request.include_voiceover,
+            'subscription_plan': current_user.get('subscription_plan', 'free'),
+            'runs': 1,
+            'lease_owner': lease_token,
+            'locked_until': datetime.utcnow() + timedelta(seconds=VIDEO_JOB_LEASE_SECONDS)
+        }
+        
+        existing = await single_flight.claim_job(db.videos, video_data, request_key)
+        if existing:
+            return coalesced_response(existing)
+        job_id = str(video_data['_id'])
+        
+        background_tasks.add_task(
+            run_video_job, job_id, request, current_user['_id'], tracing.current_carrier(),
+            current_user.get('subscription_plan', 'free'), lease_token
+        )
+        
+        return accepted_response(job_id, 'pending')
+    
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def run_video_job(job_id: str, request: VideoGenerationRequest, user_id, trace_parent: dict = None,
+                        subscription_plan: str = 'free', lease_token: str = None):
+    """
+    Background task for /generate-video: script, stock footage, voiceover
+    Runs in a span continuing trace_parent, the trace of the request that queued the job,
+    once the job scheduler gives it a slot (status stays pending until then)
+    Holds the job's lease meanwhile; gives up if another worker took the job over
+    """
+    bind_job(job_id)
+    # Attribute narration segments and the track to this user and video, within the plan quota
+    set_storage_owner(str(user_id), job_id, subscription_plan)
+    heartbeat = asyncio.create_task(_hold_lease(job_id, lease_token, asyncio.current_task()))
+    try:
+        with tracing.span("video.stock_job", {'video.id': job_id, 'video.plan': subscription_plan}, parent=trace_parent):
+            async with job_scheduler.slot(subscription_plan, str(user_id), job_id):
+                await _run_video_job(job_id, request, user_id)
+    except asyncio.CancelledError:
+        if heartbeat.done() and not heartbeat.cancelled():
+            # Stopped by _hold_lease: the job is running elsewhere now
+            return
+        # Shutting down: hand the job to another worker now rather than when the lease lapses
+        await asyncio.shield(_release_lease(job_id, lease_token))
+        raise
+    finally:
+        heartbeat.cancel()
+
+async def _hold_lease(job_id: str, lease_token: str, job_task: asyncio.Task):
+    while True:
+        await asyncio.sleep(VIDEO_JOB_LEASE_SECONDS / 3)
+        try:
+            result = await db.videos.update_one(
+                {'_id': ObjectId(job_id), 'lease_owner': lease_token},
+                {'$set': {'locked_until': datetime.utcnow() + timedelta(seconds=VIDEO_JOB_LEASE_SECONDS)}}
+            )
+        except Exception as e:
+            logger.warning("Could not renew the lease of video job %s: %s", job_id, e)
+            continue
+        if result.matched_count == 0:
+            logger.warning("Video job %s was taken over by another worker; stopping here", job_id)
+            job_task.cancel()
+            return
+
+async def _release_lease(job_id: str, lease_token: str):
+    try:
+        await db.videos.update_one(
+            {'_id': ObjectId(job_id), 'lease_owner': lease_token, 'status': {'$nin': list(JOB_TERMINAL_STATUSES)}},
+            {'$set': {'locked_until': datetime.utcnow()}}
+        )
+    except Exception as e:
+        logger.warning("Could not release the lease of video job %s: %s", job_id, e)
+
+async def _claim_stale_job():
+    """Take over the oldest unfinished job whose worker stopped renewing its lease"""
+    now = datetime.utcnow()
+    return await db.videos.find_one_and_update(
+        {
+            'status': {'$nin': list(JOB_TERMINAL_STATUSES)},
+            '$or': [
+                {'locked_until': {'$lt': now}},
+                # Queued before jobs had leases
+                {'locked_until': {'$exists': False},
+                 'updated_at': {'$lt': (now - timedelta(seconds=VIDEO_JOB_LEASE_SECONDS)).isoformat()}}
+            ]
+        },
+        {
+            '$set': {
+                'status': 'pending',
+                'lease_owner': uuid.uuid4().hex,
+                'locked_until': now + timedelta(seconds=VIDEO_JOB_LEASE_SECONDS),
+                'updated_at': now.isoformat()
+            },
+            '$inc': {'runs': 1}
+        },
+        sort=[('created_at', ASCENDING)],
+        return_document=ReturnDocument.AFTER
+    )
+
+def _requeue(doc: dict):
+    job_id = str(doc['_id'])
+    if doc.get('runs', 1) > VIDEO_JOB_MAX_RUNS:
+        logger.error("Video job %s was interrupted %d times; giving up", job_id, doc['runs'] - 1)
+        return asyncio.ensure_future(_set_job_status(job_id, 'failed', {'error': 'Video generation was interrupted. Please try again.'}))
+    logger.info("Requeuing video job %s (run %d) after its worker stopped", job_id, doc.get('runs', 1))
+    request = VideoGenerationRequest(
+        prompt=doc['prompt'],
+        video_length=doc.get('video_length', 'short'),
+        voice=doc.get('voice', 'alloy'),
+        include_voiceover=doc.get('include_voiceover', True)
+    )
+    user_id = ObjectId(doc['user_id']) if ObjectId.is_valid(doc['user_id']) else doc['user_id']
+    metrics.inc('video_jobs_requeued_total')
+    return asyncio.ensure_future(run_video_job(
+        job_id, request, user_id, None, doc.get('subscription_plan', 'free'), doc['lease_owner']
+    ))
+
+async def run_job_sweeper(stop: asyncio.Event):
+    """
+    Requeue jobs left unfinished by a worker that went away, at start-up and
+    every VIDEO_JOB_SWEEP_SECONDS; they restart from the script step
+    """
+    while not stop.is_set():
+        try:
+            while (doc := await _claim_stale_job()) is not None:
+                task = _requeue(doc)
+                _requeued_jobs.add(task)
+                task.add_done_callback(_requeued_jobs.discard)
+        except Exception as e:
+            logger.error("Video job sweep failed: %s", e)
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=VIDEO_JOB_SWEEP_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+async def _set_job_status(job_id: str, status: str, fields: dict = None):
+    update = {'$set': {'status': status, 'updated_at': datetime.utcnow().isoformat(), **(fields or {})}}
+    if status in JOB_TERMINAL_STATUSES:
+        # Identical submissions start a new job from now on, and the sweeper leaves it alone
+        update['$unset'] = {**single_flight.RELEASE_JOB_KEY, 'locked_until': '', 'lease_owner': ''}
+    await db.videos.update_one({'_id': ObjectId(job_id)}, update)
+
+async def _run_video_job(job_id: str, request: VideoGenerationRequest, user_id):
+    job_started = time.perf_counter()
+    outcome = 'failed'
     try:
         # Step 1: Generate script
+        await _set_job_status(job_id, 'generating_script')
         script_result = await generate_script(request.prompt, request.video_length)
         
         if not script_result['success']:
-            raise HTTPException(status_code=500, detail='Script generation failed')
+            raise RuntimeError('Script generation failed')
         
         script_text = script_result['script']
         scenes = script_result['scenes']
+        prompt_query = extract_keywords(request.prompt)
+        
+        # Step 2: Find stock footage for each scene, all searches at once,
+        # using ranked keyword queries scored across the whole script
+        await _set_job_status(job_id, 'finding_footage', {'script': script_text})
+        queries = extract_queries([scene['text'] for scene in scenes], max_queries=2)
+        # A stop-word-only scene (and prompt) has no query; it gets no footage
+        # rather than an empty search
+        scene_queries = [q[0] if q else prompt_query for q in queries]
+        searchable = [i for i, query in enumerate(scene_queries) if query]
+        scene_footage = [[] for _ in scenes]
+        for i, footage in zip(searchable, await search_many([scene_queries[i] for i in searchable], count=1)):
+            scene_footage[i] = footage
+        # Second-best query only for scenes the first one found nothing for
+        retry = [i for i, footage in enumerate(scene_footage) if not footage and len(queries[i]) > 1]
+        if retry:
+            for i, footage in zip(retry, await search_many([queries[i][1] for i in retry], count=1)):
+                scene_footage[i] = footage
         
-        # Step 2: Find stock footage for each scene
         video_scenes = []
-        for i, scene in enumerate(scenes):
-            # Extract keywords from scene text for better search
-            keywords = extract_keywords(scene['text'])
-            footage = await search_stock_footage(keywords, count=1)
-            
+        for i, (scene, footage) in enumerate(zip(scenes, scene_footage)):
             video_scenes.append({
                 'scene_number': i + 1,
                 'text': scene['text'],
@@ -73,47 +336,76 @@ async def create_video(request: VideoGenerationRequest, current_user = Depends(g
         
         # Step 3: Generate voiceover if requested
         voiceover_data = None
-        if request.include_voiceover:
-            voiceover_result = await generate_voiceover(script_text, request.voice)
-            if voiceover_result['success']:
-                voiceover_data = {
-                    'filename': voiceover_result['filename'],
-                    'path': voiceover_result['audio_path']
-                }
-        
-        # Step 4: Save video to database
-        video_data = {
-            'user_id': str(current_user['_id']),
-            'title': request.prompt[:100],
-            'prompt': request.prompt,
-            'script': script_text,
-            'scenes': video_scenes,
-            'voiceover': voiceover_data,
-            'video_length': request.video_length,
-            'status': 'completed',
-            'created_at': datetime.utcnow().isoformat(),
-            'views': 0
-        }
+        if request.include_voiceover and scenes:
+            await _set_job_status(job_id, 'generating_voiceover', {'scenes': video_scenes})
+            voiceover_data = await scene_voiceover([scene['text'] for scene in scenes], request.voice, job_id)
         
-        result = await db.videos.insert_one(video_data)
+        # Step 4: Save the finished video
+        await _set_job_status(job_id, 'completed', {'scenes': video_scenes, 'voiceover': voiceover_data})
+        outcome = 'completed'
         
         # Update user's video count
         await db.users.update_one(
-            {'_id': current_user['_id']},
+            {'_id': user_id},
             {'$inc': {'videos_created': 1}}
         )
-        
-        return {
-            'success': True,
-            'video_id': str(result.inserted_id),
-            'script': script_text,
-            'scenes': video_scenes,
-            'voiceover': voiceover_data,
-            'message': 'Video generated successfully!'
-        }
     
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        logger.error("Video job %s failed: %s", job_id, e)
+        tracing.record_exception(e)
+        try:
+            await _set_job_status(job_id, 'failed', {'error': str(e)})
+        except Exception as update_error:
+            logger.error("Could not mark video job %s failed: %s", job_id, update_error)
+    finally:
+        metrics.observe('stock_video_job_duration_seconds', time.perf_counter() - job_started,
+                        {'outcome': outcome}, metrics.LONG_BUCKETS)
+
+async def _find_job(job_id: str, current_user: dict) -> dict:
+    try:
+        video = await db.videos.find_one({'_id': ObjectId(job_id), 'user_id': str(current_user['_id'])})
+    except InvalidId:
+        video = None
+    if not video:
+        raise HTTPException(status_code=404, detail='Job not found')
+    return video
+
+@router.get('/jobs/{job_id}')
+async def get_job_status(job_id: str, current_user = Depends(get_current_user)):
+    """Status of a /generate-video job"""
+    video = await _find_job(job_id, current_user)
+    return {
+        'success': True,
+        'job_id': job_id,
+        'status': video.get('status'),
+        'done': video.get('status') in JOB_TERMINAL_STATUSES,
+        'error': video.get('error'),
+        'created_at': video.get('created_at'),
+        'updated_at': video.get('updated_at'),
+        'result_url': f"{router.prefix}/jobs/{job_id}/result"
+    }
+
+@router.get('/jobs/{job_id}/result')
+async def get_job_result(job_id: str, current_user = Depends(get_current_user)):
+    """
+    Result of a finished /generate-video job, in the shape the endpoint used to return
+    202 while the job is still running, 500 with the error if it failed
+    """
+    video = await _find_job(job_id, current_user)
+    status = video.get('status')
+    if status == 'failed':
+        raise HTTPException(status_code=500, detail=video.get('error') or 'Video generation failed')
+    if status != 'completed':
+        return JSONResponse(status_code=202, content={'success': True, 'job_id': job_id, 'status': status})
+    
+    return {
+        'success': True,
+        'video_id': job_id,
+        'script': video.get('script'),
+        'scenes': video.get('scenes'),
+        'voiceover': video.get('voiceover'),
+        'message': 'Video generated successfully!'
+    }
 
 @router.get('/my-videos')
 async def get_user_videos(current_user = Depends(get_current_user)):
@@ -163,6 +455,59 @@ async def get_video(video_id: str, current_user = Depends(get_current_user)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.put('/video/{video_id}/scenes/{scene_number}')
+async def update_scene(video_id: str, scene_number: int, request: SceneUpdateRequest, current_user = Depends(get_current_user)):
+    """Change one scene's narration; only that scene is sent to TTS again"""
+    try:
+        video = await db.videos.find_one({'_id': ObjectId(video_id), 'user_id': str(current_user['_id'])})
+        
+        if not video:
+            raise HTTPException(status_code=404, detail='Video not found')
+        
+        scenes = video.get('scenes') or []
+        if not 1 <= scene_number <= len(scenes):
+            raise HTTPException(status_code=404, detail='Scene not found')
+        scenes[scene_number - 1]['text'] = request.text
+        
+        voiceover_data = previous_voiceover = video.get('voiceover')
+        if previous_voiceover:
+            set_storage_owner(str(current_user['_id']), video_id, current_user.get('subscription_plan', 'free'))
+            voiceover_data = await scene_voiceover([scene['text'] for scene in scenes], previous_voiceover.get('voice', 'alloy'), video_id)
+            if voiceover_data is None:
+                # Keep the old narration, flagged as not matching the edited scene
+                logger.warning("Voiceover for video %s could not be updated; keeping the previous one", video_id)
+                voiceover_data = {**previous_voiceover, 'stale': True}
+        
+        await db.videos.update_one(
+            {'_id': video['_id']},
+            {'$set': {'scenes': scenes, 'voiceover': voiceover_data}}
+        )
+        await _delete_replaced_track(video_id, previous_voiceover, voiceover_data)
+        
+        return {
+            'success': True,
+            'scenes': scenes,
+            'voiceover': voiceover_data
+        }
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def _delete_replaced_track(video_id: str, previous: dict, current: dict):
+    """
+    Delete the track a re-narration replaced
+    Only tracks stored under this video: older ones were shared between videos by content
+    """
+    key = (previous or {}).get('key')
+    if not key or key == (current or {}).get('key') or not key.startswith(f"audio/{video_id}/"):
+        return
+    try:
+        await get_storage().delete(key)
+    except Exception as e:
+        logger.warning("Could not delete replaced voiceover %s: %s", key, e)
+
 @router.delete('/video/{video_id}')
 async def delete_video(video_id: str, current_user = Depends(get_current_user)):
     """Delete a video"""
@@ -172,6 +517,9 @@ async def delete_video(video_id: str, current_user = Depends(get_current_user)):
         if result.deleted_count == 0:
             raise HTTPException(status_code=404, detail='Video not found')
         
+        # Free the video's voiceover tracks; narration segments are a shared cache, left to eviction
+        await delete_project_media(get_storage(), video_id, kinds=('original',))
+        
         return {
             'success': True,
             'message': 'Video deleted successfully'
@@ -179,12 +527,3 @@ async def delete_video(video_id: str, current_user = Depends(get_current_user)):
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-
-def extract_keywords(text: str) -> str:
-    """Extract main keywords from text for stock footage search"""
-    # Simple keyword extraction - take first few words or main nouns
-    words = text.split()[:5]
-    # Remove common words
-    stop_words = {'a', 'an', 'the', 'is', 'are', 'was', 'were', 'in', 'on', 'at', 'to', 'for'}
-    keywords = [word for word in words if word.lower() not in stop_words]
-    return ' '.join(keywords[:3])
@@ -1,16 +1,30 @@
-from fastapi import FastAPI, APIRouter
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, APIRouter, Request, HTTPException, Response
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import asyncio
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
 from typing import List
 import uuid
 from datetime import datetime
-from routes import auth_routes, video_routes, payu_routes, ai_video_routes
+# Imported before the routes so their MongoDB command listeners see every client
+from utils import metrics, tracing
+from utils.http_metrics import HTTPMetricsMiddleware
+from utils import rate_limit
+from models.video_project import VideoStatus
+from routes import auth_routes, video_routes, payu_routes, ai_video_routes, debug_routes
+from utils import email_outbox, loop_monitor, warmup
+from utils.logging_config import setup_logging, shutdown_logging, RequestIdMiddleware
+from utils.media_files import MediaFiles
+from services.storage import STORAGE_LOCAL_ROOT, STORAGE_BACKEND, get_storage
+from services.storage import quota as storage_quota
+from services.image_derivatives import shutdown_derivative_pool
+from services.image_ingest import close_ingest_client
+from services.video_ai_service import close_openai_client
+from services import stock_footage
 
 
 ROOT_DIR = Path(__file__).parent
@@ -63,7 +77,7 @@ app.include_router(api_router)
 app.include_router(auth_routes.router, prefix="/api/auth", tags=["authentication"])
 
 # Include Video routes
-app.include_router(video_routes.router, prefix="/api/videos", tags=["videos"])
+app.include_router(video_routes.router, tags=["videos"])
 
 # Include PayU routes
 app.include_router(payu_routes.router, prefix="/api/payu", tags=["payu"])
@@ -71,10 +85,48 @@ app.include_router(payu_routes.router, prefix="/api/payu", tags=["payu"])
 # Include AI Video routes
 app.include_router(ai_video_routes.router, tags=["ai-video"])
 
+# Include debug routes (disabled unless DEBUG_API_TOKEN is set)
+app.include_router(debug_routes.router)
+
 # Mount static files for serving generated images
-static_dir = Path(__file__).parent / "static"
-static_dir.mkdir(exist_ok=True)
-app.mount("/static", StaticFiles(directory=static_dir), name="static")
+static_dir = Path(STORAGE_LOCAL_ROOT)
+static_dir.mkdir(parents=True, exist_ok=True)
+app.mount("/static", MediaFiles(directory=static_dir, on_access=storage_quota.touch), name="static")
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+METRICS_AUTH_TOKEN = os.environ.get('METRICS_AUTH_TOKEN')
+IN_FLIGHT_STATUSES = [s.value for s in VideoStatus if s not in (VideoStatus.COMPLETED, VideoStatus.FAILED)]
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics(request: Request):
+    """Prometheus scrape endpoint, aggregated across all worker processes"""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if METRICS_AUTH_TOKEN and request.headers.get('authorization') != f"Bearer {METRICS_AUTH_TOKEN}":
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    
+    # Job states live in Mongo, so count them there rather than per worker
+    counts = {status: 0 for status in IN_FLIGHT_STATUSES}
+    async for row in db.video_projects.aggregate([
+        {"$match": {"status": {"$in": IN_FLIGHT_STATUSES}}},
+        {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+    ]):
+        counts[row["_id"]] = row["count"]
+    
+    body = metrics.render_prometheus([
+        metrics.ScrapeGauge('video_jobs_in_flight', 'Video generation jobs by in-progress status', 'status', counts)
+    ])
+    return Response(content=body, media_type=metrics.CONTENT_TYPE_LATEST)
+
+# Innermost, so 429s still show up in HTTP metrics, traces and CORS
+if rate_limit.RATE_LIMIT_ENABLED:
+    app.add_middleware(rate_limit.RateLimitMiddleware)
+
+if METRICS_ENABLED:
+    app.add_middleware(HTTPMetricsMiddleware)
+
+if tracing.TRACING_ENABLED:
+    app.add_middleware(tracing.TracingMiddleware)
 
 app.add_middleware(
     CORSMiddleware,
@@ -82,15 +134,82 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[
+        "X-Request-ID", "X-Trace-Id", "Retry-After",
+        "RateLimit-Limit", "RateLimit-Remaining", "RateLimit-Reset", "RateLimit-Policy",
+    ],
 )
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+app.add_middleware(RequestIdMiddleware)
+
+# Configure logging: JSON lines written off the event loop by a listener thread
+setup_logging()
 logger = logging.getLogger(__name__)
 
+email_sender = email_outbox.OutboxSender()
+rate_limit_sync = rate_limit.SharedStateSync()
+storage_maintenance_stop = asyncio.Event()
+video_job_sweeper_stop = asyncio.Event()
+
+@app.on_event("startup")
+async def start_tracing():
+    tracing.setup_tracing()
+
+@app.on_event("startup")
+async def start_warmup():
+    # Heavy SDKs load lazily; preload them before the worker starts serving
+    if warmup.STARTUP_WARMUP:
+        await warmup.warm_up()
+
+@app.on_event("startup")
+async def start_loop_monitor():
+    if loop_monitor.LOOP_MONITOR_ENABLED:
+        loop_monitor.monitor.start()
+
+async def ensure_indexes():
+    """Create indexes without holding up start-up; they already exist after the first deploy"""
+    for ensure in (email_outbox.ensure_indexes, storage_quota.ensure_indexes, stock_footage.ensure_indexes,
+                   rate_limit.ensure_indexes, ai_video_routes.ensure_indexes, video_routes.ensure_indexes):
+        try:
+            await ensure()
+        except Exception as e:
+            logger.error("Index creation failed (%s): %s", ensure.__module__, e)
+
+@app.on_event("startup")
+async def start_index_creation():
+    asyncio.create_task(ensure_indexes())
+
+@app.on_event("startup")
+async def start_email_sender():
+    email_sender.start()
+
+@app.on_event("startup")
+async def start_rate_limit_sync():
+    if rate_limit.RATE_LIMIT_ENABLED and rate_limit.RATE_LIMIT_SHARED:
+        rate_limit_sync.start()
+
+@app.on_event("startup")
+async def start_storage_maintenance():
+    # Disk high-water eviction only applies to the local volume
+    root = str(static_dir) if STORAGE_BACKEND == 'local' else None
+    asyncio.create_task(storage_quota.run_maintenance(get_storage(), root, storage_maintenance_stop))
+
+@app.on_event("startup")
+async def start_video_job_sweeper():
+    asyncio.create_task(video_routes.run_job_sweeper(video_job_sweeper_stop))
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    loop_monitor.monitor.stop()
+    await email_sender.stop()
+    await rate_limit_sync.stop()
+    storage_maintenance_stop.set()
+    video_job_sweeper_stop.set()
+    await close_ingest_client()
+    await close_openai_client()
+    await stock_footage.close_stock_client()
+    shutdown_derivative_pool()
+    metrics.mark_process_dead()
+    tracing.shutdown_tracing()
+    shutdown_logging()
     client.close()
@@ -3,25 +3,61 @@ import json
 import base64
 import httpx
 import uuid
+import logging
 from typing import List, Dict
 from dotenv import load_dotenv
-from emergentintegrations.llm.chat import LlmChat, UserMessage
-
-# Try to set litellm drop_params if available
-try:
-    import litellm
-    litellm.drop_params = True
-except:
-    pass
+from services.storage import get_storage
+from services.image_derivatives import create_derivatives, image_id_from_url, load_manifest, media_url
+from services.resilience import concurrency_slot, get_provider, http_status_error, outbound_call, ProviderError
+from utils import tracing
+from utils.single_flight import SingleFlight
+from utils.logging_config import SAMPLED
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+IMAGE_REQUEST_TIMEOUT_SECONDS = float(os.getenv("IMAGE_REQUEST_TIMEOUT_SECONDS", 120))
+CHAT_REQUEST_TIMEOUT_SECONDS = float(os.getenv("CHAT_REQUEST_TIMEOUT_SECONDS", 120))
+EMERGENT_IMAGE_URL = os.getenv("EMERGENT_IMAGE_URL", "https://integrations.emergentagent.com/llm/images/generations")
+# Optional OpenAI-compatible chat completions endpoint used instead of LlmChat
+# (e.g. the load-test stand-in in benchmarks/stand_ins.py)
+EMERGENT_CHAT_URL = os.getenv("EMERGENT_CHAT_URL")
+
+_llm_chat_classes = None
+
+def llm_chat_classes():
+    """
+    Import emergentintegrations (and litellm under it) on first use
+    They take seconds to import, so they stay off the worker start-up path;
+    utils.warmup preloads them during start-up, before the worker serves
+    """
+    global _llm_chat_classes
+    if _llm_chat_classes is None:
+        from emergentintegrations.llm.chat import LlmChat, UserMessage
+        # Try to set litellm drop_params if available
+        try:
+            import litellm
+            litellm.drop_params = True
+        except ImportError:
+            pass
+        _llm_chat_classes = (LlmChat, UserMessage)
+    return _llm_chat_classes
+
+# Identical calls in flight at the same time share one upstream request; a
+# shared base64 image is still stored once per caller, under its own project
+_script_calls = SingleFlight('emergent_chat')
+_image_calls = SingleFlight('emergent_image')
+
+SCRIPT_SYSTEM_MESSAGE = "You are an expert video script writer and scene designer. You break down text into engaging visual scenes perfect for video creation."
+
 class AIVideoService:
     def __init__(self):
         # Use Emergent LLM Key for both text and image generation
         self.api_key = os.getenv("EMERGENT_LLM_KEY", "")
         # Emergent proxy URL for image generation
-        self.emergent_image_url = "https://integrations.emergentagent.com/llm/images/generations"
+        self.emergent_image_url = EMERGENT_IMAGE_URL
+        self.image_provider = get_provider("emergent_image")
     
     async def generate_script_scenes(self, input_text: str, num_scenes: int = 5) -> List[Dict]:
         """
@@ -52,18 +88,26 @@ class AIVideoService:
         Make the scenes flow naturally and tell a cohesive story. Each scene should be visually distinct.
         """
         
-        # Initialize chat with system message
-        chat = LlmChat(
-            api_key=self.api_key,
-            session_id="video_script_generation",
-            system_message="You are an expert video script writer and scene designer. You break down text into engaging visual scenes perfect for video creation."
-        ).with_model("openai", "gpt-4o")
-        
-        # Send message
-        user_message = UserMessage(text=prompt)
-        response = await chat.send_message(user_message)
-        
-        response_text = response.text if hasattr(response, 'text') else str(response)
+        return await _script_calls.do(prompt, lambda: self._generate_scenes(prompt))
+    
+    async def _generate_scenes(self, prompt: str) -> List[Dict]:
+        async with concurrency_slot("emergent_chat"), outbound_call("emergent_chat"):
+            if EMERGENT_CHAT_URL:
+                response_text = await self._request_chat_completion(prompt)
+            else:
+                LlmChat, UserMessage = llm_chat_classes()
+                
+                # Initialize chat with system message
+                chat = LlmChat(
+                    api_key=self.api_key,
+                    session_id="video_script_generation",
+                    system_message=SCRIPT_SYSTEM_MESSAGE
+                ).with_model("openai", "gpt-4o")
+                
+                # Send message
+                user_message = UserMessage(text=prompt)
+                response = await chat.send_message(user_message)
+                response_text = response.text if hasattr(response, 'text') else str(response)
         
         # Parse the JSON response
         try:
@@ -76,122 +120,151 @@ class AIVideoService:
             scenes = json.loads(response_text)
             return scenes
         except json.JSONDecodeError as e:
-            print(f"Error parsing JSON response: {e}")
-            print(f"Raw response: {response_text}")
+            logger.error("Error parsing script JSON: %s", e, extra={'response_preview': response_text[:500]})
             raise ValueError(f"Failed to parse AI response as JSON: {str(e)}")
     
+    async def _request_chat_completion(self, prompt: str) -> str:
+        """
+        Send the script prompt to the OpenAI-compatible EMERGENT_CHAT_URL
+        and return the reply text
+        """
+        async with httpx.AsyncClient(timeout=CHAT_REQUEST_TIMEOUT_SECONDS) as client:
+            response = await client.post(
+                EMERGENT_CHAT_URL,
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                json={
+                    "model": "gpt-4o",
+                    "messages": [
+                        {"role": "system", "content": SCRIPT_SYSTEM_MESSAGE},
+                        {"role": "user", "content": prompt}
+                    ]
+                }
+            )
+        if response.status_code != 200:
+            raise http_status_error(response.status_code, response.text)
+        return response.json()["choices"][0]["message"]["content"]
+    
     async def generate_image_for_scene(self, image_prompt: str) -> str:
         """
         Generate an image for a scene using gpt-image-1 via Emergent LLM Key
         Returns image URL directly (not base64 to avoid MongoDB 16MB document limit)
         
-        Calls Emergent API directly and returns the hosted image URL
+        Transient failures are retried with backoff inside the provider's retry
+        budget; raises ProviderError (or CircuitOpenError) when no image could be made
         """
+        image_data = await _image_calls.do(
+            image_prompt, lambda: self.image_provider.call(lambda: self._request_image(image_prompt))
+        )
+        
+        # Check if we have a URL - USE IT DIRECTLY (don't convert to base64 to avoid MongoDB 16MB limit)
+        if image_data.get("url"):
+            image_url = image_data["url"]
+            logger.info("Image generated", extra={**SAMPLED, 'image_url': image_url[:100]})
+            return image_url
+        
+        # Handle b64_json format - save to file and return URL to avoid MongoDB 16MB limit
+        b64_data = image_data["b64_json"]
+        image_url = await self._save_base64_image_to_file(b64_data)
+        logger.info("Image generated and stored", extra={**SAMPLED, 'image_url': image_url, 'b64_chars': len(b64_data)})
+        return image_url
+    
+    async def _request_image(self, image_prompt: str) -> Dict:
+        """
+        Make one image generation request and return the first image entry
+        Raises ProviderError classified as retryable or not
+        """
+        # Call the Emergent image generation API directly
+        async with httpx.AsyncClient(timeout=IMAGE_REQUEST_TIMEOUT_SECONDS) as client:
+            response = await client.post(
+                self.emergent_image_url,
+                headers={
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json"
+                },
+                json={
+                    "model": "gpt-image-1",
+                    "prompt": image_prompt,
+                    "n": 1,
+                    "quality": "low"
+                    # Note: response_format not supported by Emergent API for gpt-image-1
+                }
+            )
+        
+        if response.status_code != 200:
+            logger.warning("Image generation API error %s", response.status_code, extra={'response_preview': response.text[:200]})
+            raise http_status_error(response.status_code, response.text)
+        
         try:
-            # Call the Emergent image generation API directly
-            async with httpx.AsyncClient(timeout=120.0) as client:
-                response = await client.post(
-                    self.emergent_image_url,
-                    headers={
-                        "Authorization": f"Bearer {self.api_key}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "model": "gpt-image-1",
-                        "prompt": image_prompt,
-                        "n": 1,
-                        "quality": "low"
-                        # Note: response_format not supported by Emergent API for gpt-image-1
-                    }
-                )
-                
-                if response.status_code != 200:
-                    print(f"Image generation API error: {response.status_code} - {response.text}")
-                    return "https://via.placeholder.com/1024x1024/cccccc/666666?text=Image+Generation+Failed"
-                
-                result = response.json()
-                
-                # The API returns: {"data": [{"url": "..."}, ...]}
-                if "data" in result and len(result["data"]) > 0:
-                    image_data = result["data"][0]
-                    
-                    # Check if we have a URL - USE IT DIRECTLY (don't convert to base64 to avoid MongoDB 16MB limit)
-                    if "url" in image_data and image_data["url"]:
-                        image_url = image_data["url"]
-                        print(f"✅ Image generated successfully: {image_url[:100]}...")
-                        return image_url  # Return URL directly instead of converting to base64
-                    
-                    # Handle b64_json format - save to file and return URL to avoid MongoDB 16MB limit
-                    elif "b64_json" in image_data and image_data["b64_json"]:
-                        b64_data = image_data["b64_json"]
-                        print(f"✅ Image generated successfully (base64 format - {len(b64_data)} chars)")
-                        
-                        try:
-                            # Save base64 image to a file and return URL
-                            image_url = await self._save_base64_image_to_file(b64_data)
-                            print(f"✅ Image saved to file: {image_url}")
-                            return image_url
-                        except Exception as e:
-                            print(f"❌ Failed to save image to file: {e}")
-                            return "https://via.placeholder.com/1024x1024/cccccc/666666?text=File+Save+Failed"
-                    else:
-                        print(f"Unexpected response format: {list(image_data.keys())}")
-                        return "https://via.placeholder.com/1024x1024/cccccc/666666?text=Unexpected+Format"
-                else:
-                    print(f"No image data in response: {result}")
-                    return "https://via.placeholder.com/1024x1024/cccccc/666666?text=No+Image+Data"
-                    
-        except httpx.TimeoutException:
-            print(f"Timeout generating image for prompt: {image_prompt[:100]}")
-            return "https://via.placeholder.com/1024x1024/cccccc/666666?text=Timeout"
-        except Exception as e:
-            print(f"Error generating image: {e}")
-            import traceback
-            traceback.print_exc()
-            return "https://via.placeholder.com/1024x1024/cccccc/666666?text=Image+Generation+Failed"
+            result = response.json()
+        except ValueError:
+            raise ProviderError(f"Invalid JSON from image API: {response.text[:200]}")
+        
+        # The API returns: {"data": [{"url": "..."}, ...]}
+        if not result.get("data"):
+            raise ProviderError(f"No image data in response: {str(result)[:200]}")
+        
+        image_data = result["data"][0]
+        if not image_data.get("url") and not image_data.get("b64_json"):
+            raise ProviderError(f"Unexpected response format: {list(image_data.keys())}")
+        
+        return image_data
+    
+    def image_provider_available(self) -> bool:
+        """False while the image provider's circuit breaker is open"""
+        return self.image_provider.available()
     
     async def generate_all_scene_images(self, scenes: List[Dict]) -> List[Dict]:
         """
         Generate images for all scenes
+        Scenes whose image could not be generated get image_url None and an image_error
         """
         for scene in scenes:
             try:
-                print(f"Generating image for scene {scene['scene_number']}...")
-                image_url = await self.generate_image_for_scene(scene['image_prompt'])
-                scene['image_url'] = image_url
+                with tracing.span("video.scene_image", {'scene.number': scene['scene_number']}):
+                    image_url = await self.generate_image_for_scene(scene['image_prompt'])
+                    scene['image_url'] = image_url
+                    await self.attach_renditions(scene)
             except Exception as e:
-                print(f"Failed to generate image for scene {scene['scene_number']}: {e}")
+                logger.error("Failed to generate image for scene %s: %s", scene['scene_number'], e)
                 scene['image_url'] = None
+                scene['image_error'] = str(e)
         
         return scenes
 
+    async def attach_renditions(self, scene: Dict):
+        """
+        Record the image id and a medium-size preview URL on a scene whose
+        image has stored derivatives
+        """
+        image_id = image_id_from_url(scene.get('image_url'))
+        if image_id and await load_manifest(image_id):
+            scene['image_id'] = image_id
+            scene['preview_url'] = media_url(image_id, 'medium')
+        return scene
+
     async def _save_base64_image_to_file(self, b64_data: str) -> str:
         """
-        Save base64 image data to a file and return the URL
+        Save base64 image data to the storage backend and return its URL
         This avoids storing large base64 data in MongoDB (16MB limit)
         """
         try:
-            # Create images directory if it doesn't exist
-            images_dir = "/app/backend/static/images"
-            os.makedirs(images_dir, exist_ok=True)
-            
-            # Generate unique filename
+            # Generate unique key
             image_id = str(uuid.uuid4())
-            filename = f"{image_id}.png"
-            filepath = os.path.join(images_dir, filename)
+            key = f"images/{image_id}.png"
             
-            # Decode base64 and save to file
+            # Decode base64 and store it
             image_bytes = base64.b64decode(b64_data)
-            with open(filepath, "wb") as f:
-                f.write(image_bytes)
+            storage = get_storage()
+            await storage.put(key, image_bytes, content_type="image/png")
             
-            # Return URL to the saved image
-            # Use the backend URL to serve the static file
-            backend_url = os.getenv("BACKEND_URL", "https://core.preview.emergentagent.com")
-            image_url = f"{backend_url}/static/images/{filename}"
+            # Thumbnail/medium renditions; the original stays usable if this fails
+            try:
+                await create_derivatives(image_id, key, image_bytes, content_type="image/png")
+            except Exception as e:
+                logger.error("Failed to create derivatives for %s: %s", key, e)
             
-            return image_url
+            return storage.public_url(key)
             
         except Exception as e:
-            print(f"Error saving base64 image to file: {e}")
-            raise
\ No newline at end of file
+            logger.error("Error saving base64 image to storage: %s", e)
+            raise
@@ -0,0 +1,338 @@
+"""
+Adaptive concurrency limits for upstream AI providers, shared by all workers
+
+Each governed provider has one concurrency limit adjusted by AIMD (additive
+increase, multiplicative decrease): every successful call raises it by
+1 / limit, about one more slot per limit's worth of calls, while an
+overload signal (429, 503/504, timeouts, or a latency spike well above the
+provider's recent normal) cuts it by GOVERNOR_DECREASE_FACTOR, at most once
+per GOVERNOR_DECREASE_COOLDOWN_SECONDS so one burst of failures counts once.
+
+With GOVERNOR_BACKEND=mongo (the default) the limit and the slots live in
+one provider_concurrency document per provider. A call holds a lease entry
+in it: leases are taken and returned with single-document atomic updates, so
+every worker and host sees the same in-flight count and limit, and the
+lease of a crashed worker lapses after GOVERNOR_LEASE_SECONDS. A waiting
+call retries when a slot is returned in its own process or after a short
+jittered poll. If Mongo is unreachable the governor limits each worker on
+its own (GOVERNOR_BACKEND=local behaviour) for GOVERNOR_FALLBACK_SECONDS
+rather than holding calls up.
+
+Limits per provider come from PROVIDER_CONCURRENCY, 'name=initial:min:max'
+entries separated by commas; providers not listed are not governed.
+
+    async with governor.slot(is_overload):
+        await make_request()
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+import uuid
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Callable, Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+PROVIDER_CONCURRENCY = os.getenv('PROVIDER_CONCURRENCY', 'emergent_image=8:1:32,emergent_chat=8:1:32')
+GOVERNOR_BACKEND = os.getenv('GOVERNOR_BACKEND', 'mongo')
+GOVERNOR_DECREASE_FACTOR = float(os.getenv('GOVERNOR_DECREASE_FACTOR', 0.5))
+GOVERNOR_DECREASE_COOLDOWN_SECONDS = float(os.getenv('GOVERNOR_DECREASE_COOLDOWN_SECONDS', 5))
+# A success slower than this multiple of the recent average counts as overload
+GOVERNOR_LATENCY_TOLERANCE = float(os.getenv('GOVERNOR_LATENCY_TOLERANCE', 2.5))
+# Longer than the slowest provider timeout, so a live call never loses its lease
+GOVERNOR_LEASE_SECONDS = float(os.getenv('GOVERNOR_LEASE_SECONDS', 300))
+GOVERNOR_MAX_WAIT_SECONDS = float(os.getenv('GOVERNOR_MAX_WAIT_SECONDS', 120))
+GOVERNOR_POLL_SECONDS = float(os.getenv('GOVERNOR_POLL_SECONDS', 0.25))
+GOVERNOR_FALLBACK_SECONDS = float(os.getenv('GOVERNOR_FALLBACK_SECONDS', 30))
+# Successful calls observed before latency spikes are judged
+LATENCY_WARMUP_SAMPLES = 5
+LATENCY_EWMA_ALPHA = 0.1
+
+MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
+DB_NAME = os.getenv("DB_NAME", "test_database")
+client = AsyncIOMotorClient(MONGO_URL)
+db = client[DB_NAME]
+
+SUCCESS = 'success'
+OVERLOAD = 'overload'
+NEUTRAL = 'neutral'
+
+
+class GovernorTimeout(Exception):
+    """No slot became free within GOVERNOR_MAX_WAIT_SECONDS"""
+
+    def __init__(self, provider: str, waited: float):
+        super().__init__(f"{provider} is at its concurrency limit; gave up after {waited:.0f}s")
+        self.provider = provider
+
+
+def parse_limits(spec: str) -> dict:
+    """'name=initial:min:max,...' -> {name: (initial, min, max)}"""
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, values = item.partition('=')
+        try:
+            initial, low, high = (float(v) for v in values.split(':'))
+        except ValueError:
+            logger.error("Ignoring malformed PROVIDER_CONCURRENCY entry %r", item)
+            continue
+        limits[name.strip()] = (initial, max(1.0, low), max(1.0, low, high))
+    return limits
+
+
+def next_limit(limit: float, outcome: str, low: float, high: float) -> float:
+    """AIMD step (the mongo backend applies the same rule in its update pipeline)"""
+    if outcome == SUCCESS:
+        return min(high, limit + 1.0 / limit)
+    if outcome == OVERLOAD:
+        return max(low, limit * GOVERNOR_DECREASE_FACTOR)
+    return limit
+
+
+class ProviderGovernor:
+    def __init__(self, name: str, initial: float, low: float, high: float, backend: str = GOVERNOR_BACKEND,
+                 clock: Callable[[], float] = time.time):
+        self.name = name
+        self.low = low
+        self.high = high
+        self.backend = backend
+        self.clock = clock
+        self.labels = {'provider': name}
+        # Local state: the limit itself for the local backend, the last seen shared one otherwise
+        self.limit = min(high, max(low, initial))
+        self.in_flight = 0
+        self.decreased_at = 0.0
+        self.latency = None
+        self.latency_samples = 0
+        self.fallback_until = 0.0
+        # One event per call waiting in this process, oldest first
+        self._waiters = deque()
+        self._publish()
+
+    def _publish(self):
+        metrics.set_gauge('provider_concurrency_limit', self.limit, self.labels)
+        metrics.set_gauge('provider_concurrency_in_flight', self.in_flight, self.labels)
+
+    def _use_mongo(self) -> bool:
+        return self.backend == 'mongo' and self.clock() >= self.fallback_until
+
+    def _fall_back(self, error: Exception):
+        if self.clock() >= self.fallback_until:
+            logger.warning("Concurrency governor for %s falling back to per-worker limits: %s", self.name, error)
+        self.fallback_until = self.clock() + GOVERNOR_FALLBACK_SECONDS
+
+    async def _try_acquire_shared(self, lease_id: str) -> bool:
+        now = self.clock()
+        doc = await db.provider_concurrency.find_one_and_update(
+            {'_id': self.name},
+            [
+                {'$set': {
+                    'limit': {'$ifNull': ['$limit', self.limit]},
+                    'decreased_at': {'$ifNull': ['$decreased_at', 0]},
+                    'leases': {'$filter': {
+                        'input': {'$ifNull': ['$leases', []]},
+                        'cond': {'$gt': ['$$this.expires_at', now]},
+                    }},
+                }},
+                {'$set': {'leases': {'$cond': [
+                    {'$lt': [{'$size': '$leases'}, {'$floor': '$limit'}]},
+                    {'$concatArrays': ['$leases', [{'id': lease_id, 'expires_at': now + GOVERNOR_LEASE_SECONDS}]]},
+                    '$leases',
+                ]}}},
+            ],
+            projection={'limit': 1, 'leases.id': 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        self.limit = doc['limit']
+        self.in_flight = len(doc['leases'])
+        return any(lease['id'] == lease_id for lease in doc['leases'])
+
+    async def _release_shared(self, lease_id: str, outcome: str):
+        now = self.clock()
+        limit = '$limit'
+        if outcome == SUCCESS:
+            limit = {'$min': [self.high, {'$add': ['$limit', {'$divide': [1, '$limit']}]}]}
+        elif outcome == OVERLOAD:
+            limit = {'$cond': [
+                {'$lt': ['$decreased_at', now - GOVERNOR_DECREASE_COOLDOWN_SECONDS]},
+                {'$max': [self.low, {'$multiply': ['$limit', GOVERNOR_DECREASE_FACTOR]}]},
+                '$limit',
+            ]}
+        update = {
+            'leases': {'$filter': {
+                'input': '$leases',
+                'cond': {'$and': [{'$ne': ['$$this.id', lease_id]}, {'$gt': ['$$this.expires_at', now]}]},
+            }},
+            'limit': limit,
+        }
+        if outcome == OVERLOAD:
+            update['decreased_at'] = {'$cond': [
+                {'$lt': ['$decreased_at', now - GOVERNOR_DECREASE_COOLDOWN_SECONDS]}, now, '$decreased_at'
+            ]}
+        doc = await db.provider_concurrency.find_one_and_update(
+            {'_id': self.name}, [{'$set': update}],
+            projection={'limit': 1, 'leases.id': 1}, return_document=ReturnDocument.AFTER,
+        )
+        if doc is not None:
+            self.limit = doc['limit']
+            self.in_flight = len(doc['leases'])
+
+    def _try_acquire_local(self) -> bool:
+        if self.in_flight < int(self.limit):
+            self.in_flight += 1
+            return True
+        return False
+
+    def _release_local(self, outcome: str):
+        self.in_flight -= 1
+        if outcome == OVERLOAD:
+            now = self.clock()
+            if now - self.decreased_at < GOVERNOR_DECREASE_COOLDOWN_SECONDS:
+                return
+            self.decreased_at = now
+        self.limit = next_limit(self.limit, outcome, self.low, self.high)
+
+    async def _try_acquire(self, lease_id: str) -> Optional[tuple]:
+        if self._use_mongo():
+            try:
+                if await self._try_acquire_shared(lease_id):
+                    return 'mongo', lease_id
+                return None
+            except Exception as e:
+                self._fall_back(e)
+        if self._try_acquire_local():
+            return 'local', lease_id
+        return None
+
+    def _wake_head(self):
+        if self._waiters:
+            self._waiters[0].set()
+
+    async def acquire(self) -> tuple:
+        """Wait for a slot; returns the lease (backend, id) to release"""
+        start = time.perf_counter()
+        lease_id = uuid.uuid4().hex
+        lease = None if self._waiters else await self._try_acquire(lease_id)
+        if lease is None:
+            lease = await self._wait_in_line(lease_id, start)
+        metrics.observe('provider_concurrency_wait_seconds', time.perf_counter() - start, self.labels)
+        self._publish()
+        return lease
+
+    async def _wait_in_line(self, lease_id: str, start: float) -> tuple:
+        """
+        Queue in arrival order within this process. Only the head of the line
+        tries for a slot: a slot returned here wakes it at once, slots returned
+        by other workers are found by polling. Whoever gets a slot hands the
+        turn to the next in line, who tries straight away.
+        """
+        turn = asyncio.Event()
+        self._waiters.append(turn)
+        poll = GOVERNOR_POLL_SECONDS
+        try:
+            while True:
+                turn.clear()
+                head = self._waiters[0] is turn
+                if head:
+                    lease = await self._try_acquire(lease_id)
+                    if lease is not None:
+                        return lease
+                remaining = GOVERNOR_MAX_WAIT_SECONDS - (time.perf_counter() - start)
+                if remaining <= 0:
+                    metrics.inc('provider_concurrency_timeouts_total', self.labels)
+                    raise GovernorTimeout(self.name, time.perf_counter() - start)
+                timeout = min(remaining, random.uniform(0.5, 1.0) * poll) if head else remaining
+                try:
+                    await asyncio.wait_for(turn.wait(), timeout)
+                except asyncio.TimeoutError:
+                    if head:
+                        poll = min(poll * 2, 2.0)
+        finally:
+            self._waiters.remove(turn)
+            self._wake_head()
+
+    async def release(self, lease: tuple, outcome: str):
+        backend, lease_id = lease
+        if backend == 'mongo':
+            try:
+                await self._release_shared(lease_id, outcome)
+            except Exception as e:
+                # The lease lapses on its own after GOVERNOR_LEASE_SECONDS
+                self._fall_back(e)
+        else:
+            self._release_local(outcome)
+        if outcome == OVERLOAD:
+            metrics.inc('provider_concurrency_decreases_total', self.labels)
+        self._publish()
+        self._wake_head()
+
+    def classify(self, seconds: float, error: Optional[Exception], is_overload: Callable[[Exception], bool]) -> str:
+        if error is not None:
+            return OVERLOAD if is_overload(error) else NEUTRAL
+        if self.latency is None:
+            self.latency = seconds
+        spike = self.latency_samples >= LATENCY_WARMUP_SAMPLES and seconds > self.latency * GOVERNOR_LATENCY_TOLERANCE
+        self.latency += LATENCY_EWMA_ALPHA * (seconds - self.latency)
+        self.latency_samples += 1
+        return OVERLOAD if spike else SUCCESS
+
+    @asynccontextmanager
+    async def slot(self, is_overload: Callable[[Exception], bool]):
+        """
+        Hold one of the provider's slots for one upstream call
+
+        A call that was cancelled (or interrupted) says nothing about the
+        provider, so it is released without moving the limit.
+        """
+        lease = await self.acquire()
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            if isinstance(error, Exception) or error is None:
+                outcome = self.classify(time.perf_counter() - start, error, is_overload)
+            else:
+                outcome = NEUTRAL
+            # Return the slot even if this task is being cancelled
+            await asyncio.shield(self.release(lease, outcome))
+
+    def state(self) -> dict:
+        return {
+            'backend': 'mongo' if self._use_mongo() else 'local',
+            'limit': round(self.limit, 2),
+            'min': self.low,
+            'max': self.high,
+            'in_flight': self.in_flight,
+            'waiting_here': len(self._waiters),
+            'typical_latency_seconds': round(self.latency, 3) if self.latency is not None else None,
+        }
+
+
+_limits = parse_limits(PROVIDER_CONCURRENCY)
+_governors = {}
+
+
+def get_governor(name: str) -> Optional[ProviderGovernor]:
+    """The process-wide governor for a provider, or None if it is not governed"""
+    if name not in _limits:
+        return None
+    if name not in _governors:
+        _governors[name] = ProviderGovernor(name, *_limits[name])
+    return _governors[name]
+
+
+def governor_states() -> dict:
+    return {name: governor.state() for name, governor in _governors.items()}
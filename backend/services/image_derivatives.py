@@ -0,0 +1,222 @@
+"""
+Image derivative pipeline
+
+Every stored scene image gets smaller renditions (thumb and medium, each in
+WebP and JPEG) plus a JSON manifest describing them. Resizing and encoding
+are CPU-bound, so they run in a process pool and never on the event loop.
+
+Keys for an image `images/<id>.png`:
+    images/<id>_thumb.webp, images/<id>_thumb.jpg, ... renditions
+    images/<id>.json                                  manifest
+"""
+import asyncio
+import io
+import json
+import multiprocessing
+import os
+import re
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from services.storage import get_storage
+from utils import tracing
+
+IMAGE_DERIVATIVE_WORKERS = int(os.getenv('IMAGE_DERIVATIVE_WORKERS', 2))
+MANIFEST_CACHE_SIZE = int(os.getenv('IMAGE_MANIFEST_CACHE_SIZE', 2048))
+
+RENDITION_WIDTHS = {
+    'thumb': 256,
+    'medium': 640,
+}
+
+RENDITION_FORMATS = {
+    'webp': {'format': 'WEBP', 'content_type': 'image/webp', 'ext': 'webp', 'options': {'quality': 80, 'method': 4}},
+    'jpeg': {'format': 'JPEG', 'content_type': 'image/jpeg', 'ext': 'jpg', 'options': {'quality': 82, 'optimize': True, 'progressive': True}},
+}
+
+IMAGE_ID_PATTERN = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$')
+IMAGE_URL_PATTERN = re.compile(r'/images/([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})\.\w+$')
+
+_pool = None
+_manifest_cache = OrderedDict()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn, not fork: the parent holds Mongo and HTTP client threads
+        _pool = ProcessPoolExecutor(
+            max_workers=IMAGE_DERIVATIVE_WORKERS,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    return _pool
+
+
+def shutdown_derivative_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def render_renditions(image_bytes: bytes) -> dict:
+    """
+    Decode an image and encode every rendition (runs in a worker process)
+    """
+    # Imported here so only the pool's worker processes load Pillow
+    from PIL import Image
+
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        img.load()
+        width, height = img.size
+        rgb = img.convert('RGB')
+
+    renditions = []
+    for name, target_width in RENDITION_WIDTHS.items():
+        if target_width < width:
+            size = (target_width, max(1, round(height * target_width / width)))
+            scaled = rgb.resize(size, Image.LANCZOS)
+        else:
+            scaled = rgb
+
+        for format_name, fmt in RENDITION_FORMATS.items():
+            buffer = io.BytesIO()
+            scaled.save(buffer, fmt['format'], **fmt['options'])
+            renditions.append({
+                'name': name,
+                'format': format_name,
+                'width': scaled.size[0],
+                'height': scaled.size[1],
+                'data': buffer.getvalue()
+            })
+
+    return {'width': width, 'height': height, 'renditions': renditions}
+
+
+def manifest_key(image_id: str) -> str:
+    return f"images/{image_id}.json"
+
+
+def image_id_from_url(url: Optional[str]) -> Optional[str]:
+    """Return the image id for URLs that point at our own stored images"""
+    if not url:
+        return None
+    match = IMAGE_URL_PATTERN.search(url.split('?')[0])
+    return match.group(1) if match else None
+
+
+def _cache_manifest(image_id: str, manifest: dict):
+    _manifest_cache[image_id] = manifest
+    _manifest_cache.move_to_end(image_id)
+    while len(_manifest_cache) > MANIFEST_CACHE_SIZE:
+        _manifest_cache.popitem(last=False)
+
+
+def forget_manifest(image_id: str):
+    """Drop a cached manifest, e.g. after its renditions were evicted"""
+    _manifest_cache.pop(image_id, None)
+
+
+async def create_derivatives(image_id: str, original_key: str, image_bytes: bytes, content_type: str = 'image/png') -> dict:
+    """
+    Render, store and cache all renditions for a stored original image
+
+    Returns:
+        dict: The size manifest
+    """
+    loop = asyncio.get_running_loop()
+    with tracing.span('image.render_renditions', {'image.id': image_id, 'image.bytes': len(image_bytes)}):
+        rendered = await loop.run_in_executor(_get_pool(), render_renditions, image_bytes)
+
+    storage = get_storage()
+    renditions = []
+    uploads = []
+    for rendition in rendered['renditions']:
+        fmt = RENDITION_FORMATS[rendition['format']]
+        key = f"images/{image_id}_{rendition['name']}.{fmt['ext']}"
+        uploads.append(storage.put(key, rendition['data'], content_type=fmt['content_type']))
+        renditions.append({
+            'name': rendition['name'],
+            'format': rendition['format'],
+            'content_type': fmt['content_type'],
+            'width': rendition['width'],
+            'height': rendition['height'],
+            'size': len(rendition['data']),
+            'key': key,
+            'url': storage.public_url(key)
+        })
+    await asyncio.gather(*uploads)
+
+    manifest = {
+        'id': image_id,
+        'original': {
+            'key': original_key,
+            'url': storage.public_url(original_key),
+            'content_type': content_type,
+            'width': rendered['width'],
+            'height': rendered['height'],
+            'size': len(image_bytes)
+        },
+        'renditions': renditions
+    }
+    await storage.put(manifest_key(image_id), json.dumps(manifest).encode(), content_type='application/json')
+    _cache_manifest(image_id, manifest)
+    return manifest
+
+
+async def load_manifest(image_id: str) -> Optional[dict]:
+    """Return the manifest for an image id, or None if it has no derivatives"""
+    if not IMAGE_ID_PATTERN.match(image_id):
+        return None
+    if image_id in _manifest_cache:
+        _manifest_cache.move_to_end(image_id)
+        return _manifest_cache[image_id]
+
+    try:
+        manifest = json.loads(await get_storage().get(manifest_key(image_id)))
+    except FileNotFoundError:
+        return None
+    _cache_manifest(image_id, manifest)
+    return manifest
+
+
+async def regenerate_derivatives(image_id: str, original_key: str, content_type: str = 'image/png') -> dict:
+    """Rebuild renditions from a stored original, e.g. after they were evicted"""
+    image_bytes = await get_storage().get(original_key)
+    return await create_derivatives(image_id, original_key, image_bytes, content_type=content_type)
+
+
+def choose_rendition(manifest: dict, size: Optional[str] = None, width: Optional[int] = None, accept: str = '') -> dict:
+    """
+    Pick the best rendition for a request
+
+    Uses WebP when the client accepts it, otherwise JPEG. With `width`, returns
+    the smallest rendition at least that wide; with `size`, the named rendition.
+    Falls back to the original image when nothing smaller fits.
+    """
+    if size == 'original':
+        return manifest['original']
+
+    format_name = 'webp' if 'image/webp' in (accept or '') else 'jpeg'
+    candidates = sorted(
+        (r for r in manifest['renditions'] if r['format'] == format_name),
+        key=lambda r: r['width']
+    )
+
+    if width:
+        for rendition in candidates:
+            if rendition['width'] >= width:
+                return rendition
+        return manifest['original']
+
+    for rendition in candidates:
+        if rendition['name'] == (size or 'medium'):
+            return rendition
+    return manifest['original']
+
+
+def media_url(image_id: str, size: str) -> str:
+    """URL of the rendition-selecting media endpoint for an image"""
+    backend_url = os.getenv("BACKEND_URL", "https://core.preview.emergentagent.com")
+    return f"{backend_url}/api/video/media/{image_id}?size={size}"
@@ -0,0 +1,188 @@
+"""
+Background ingestion of provider-hosted images
+
+When the image API answers with a hosted `url` instead of base64 data, the
+scene initially points at the provider's (expiring) URL. After the job is
+marked completed, ingest_project_images() downloads those URLs through a
+bounded pool, checks type and size, stores them in our storage backend with
+derivatives, and rewrites each scene's image_url only if it still holds the
+original provider URL.
+"""
+import asyncio
+import logging
+import os
+import uuid
+from typing import Optional
+
+import httpx
+
+from services.storage import get_storage
+from services.image_derivatives import create_derivatives, media_url
+
+logger = logging.getLogger(__name__)
+
+IMAGE_INGEST_CONCURRENCY = int(os.getenv('IMAGE_INGEST_CONCURRENCY', 4))
+IMAGE_INGEST_MAX_BYTES = int(os.getenv('IMAGE_INGEST_MAX_BYTES', 20 * 1024 * 1024))
+IMAGE_INGEST_TIMEOUT_SECONDS = float(os.getenv('IMAGE_INGEST_TIMEOUT_SECONDS', 30))
+IMAGE_INGEST_BUDGET_SECONDS = float(os.getenv('IMAGE_INGEST_BUDGET_SECONDS', 120))
+
+ALLOWED_IMAGE_TYPES = {
+    'image/png': 'png',
+    'image/jpeg': 'jpg',
+    'image/webp': 'webp',
+}
+
+# Magic numbers, so a mislabelled HTML error page is never stored as an image
+IMAGE_SIGNATURES = {
+    'image/png': lambda data: data[:8] == b'\x89PNG\r\n\x1a\n',
+    'image/jpeg': lambda data: data[:3] == b'\xff\xd8\xff',
+    'image/webp': lambda data: data[:4] == b'RIFF' and data[8:12] == b'WEBP',
+}
+
+SKIPPED_HOSTS = ('via.placeholder.com',)
+
+_client: Optional[httpx.AsyncClient] = None
+_semaphore: Optional[asyncio.Semaphore] = None
+_tasks = set()
+
+
+class IngestError(Exception):
+    pass
+
+
+def _get_client() -> httpx.AsyncClient:
+    global _client, _semaphore
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=IMAGE_INGEST_TIMEOUT_SECONDS,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=IMAGE_INGEST_CONCURRENCY * 2, max_keepalive_connections=IMAGE_INGEST_CONCURRENCY)
+        )
+        _semaphore = asyncio.Semaphore(IMAGE_INGEST_CONCURRENCY)
+    return _client
+
+
+async def close_ingest_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def needs_ingestion(url: Optional[str]) -> bool:
+    """True for remote image URLs that are not already in our storage"""
+    if not url or not url.startswith(('http://', 'https://')):
+        return False
+    if any(host in url for host in SKIPPED_HOSTS):
+        return False
+    return not url.startswith(get_storage().public_url(''))
+
+
+async def download_image(url: str) -> tuple:
+    """
+    Stream a remote image into memory, enforcing type and size limits
+
+    Returns:
+        (bytes, content_type)
+    """
+    client = _get_client()
+    async with _semaphore:
+        async with client.stream('GET', url) as response:
+            if response.status_code != 200:
+                raise IngestError(f"HTTP {response.status_code} fetching image")
+
+            content_type = response.headers.get('content-type', '').split(';')[0].strip().lower()
+            if content_type not in ALLOWED_IMAGE_TYPES:
+                raise IngestError(f"Unsupported content type: {content_type or 'missing'}")
+
+            declared = response.headers.get('content-length')
+            if declared and int(declared) > IMAGE_INGEST_MAX_BYTES:
+                raise IngestError(f"Image too large: {declared} bytes")
+
+            data = bytearray()
+            async for chunk in response.aiter_bytes():
+                data.extend(chunk)
+                if len(data) > IMAGE_INGEST_MAX_BYTES:
+                    raise IngestError(f"Image exceeds {IMAGE_INGEST_MAX_BYTES} bytes")
+
+    if not IMAGE_SIGNATURES[content_type](data):
+        raise IngestError(f"Body does not look like {content_type}")
+    return bytes(data), content_type
+
+
+async def ingest_image(url: str) -> dict:
+    """
+    Copy one remote image into storage and build its derivatives
+
+    Returns:
+        dict: image_id, image_url and preview_url for the stored copy
+    """
+    data, content_type = await download_image(url)
+    image_id = str(uuid.uuid4())
+    key = f"images/{image_id}.{ALLOWED_IMAGE_TYPES[content_type]}"
+
+    storage = get_storage()
+    await storage.put(key, data, content_type=content_type)
+    await create_derivatives(image_id, key, data, content_type=content_type)
+
+    return {
+        'image_id': image_id,
+        'image_url': storage.public_url(key),
+        'preview_url': media_url(image_id, 'medium')
+    }
+
+
+async def _ingest_scene(db, project_id: str, scene: dict):
+    source_url = scene['image_url']
+    try:
+        stored = await ingest_image(source_url)
+    except Exception as e:
+        logger.warning("Image ingestion failed for project %s scene %s: %s", project_id, scene.get('scene_number'), e)
+        return
+
+    # Only rewrite if the scene still points at the URL we downloaded
+    await db.video_projects.update_one(
+        {
+            '_id': project_id,
+            'scenes': {'$elemMatch': {'scene_number': scene['scene_number'], 'image_url': source_url}}
+        },
+        {
+            '$set': {
+                'scenes.$.image_url': stored['image_url'],
+                'scenes.$.image_id': stored['image_id'],
+                'scenes.$.preview_url': stored['preview_url'],
+                'scenes.$.source_image_url': source_url
+            }
+        }
+    )
+    await db.video_projects.update_one(
+        {'_id': project_id, 'thumbnail_url': source_url},
+        {'$set': {'thumbnail_url': media_url(stored['image_id'], 'thumb')}}
+    )
+
+
+async def ingest_project_images(db, project_id: str, budget_seconds: float = IMAGE_INGEST_BUDGET_SECONDS):
+    """Ingest every provider-hosted scene image of a project within budget_seconds"""
+    project = await db.video_projects.find_one({'_id': project_id}, {'scenes': 1})
+    if not project:
+        return
+
+    scenes = [s for s in project.get('scenes', []) if needs_ingestion(s.get('image_url'))]
+    if not scenes:
+        return
+
+    tasks = [asyncio.create_task(_ingest_scene(db, project_id, scene)) for scene in scenes]
+    done, pending = await asyncio.wait(tasks, timeout=budget_seconds)
+    for task in pending:
+        task.cancel()
+    if pending:
+        logger.warning("Image ingestion for project %s hit its %ss budget; %d scene(s) left on provider URLs",
+                       project_id, budget_seconds, len(pending))
+
+
+def schedule_project_ingestion(db, project_id: str):
+    """Start ingestion in the background without waiting for it"""
+    task = asyncio.create_task(ingest_project_images(db, project_id))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
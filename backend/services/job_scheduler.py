@@ -0,0 +1,216 @@
+"""
+Priority and fair-share scheduling of video generation jobs
+
+Generation jobs run in JOB_CONCURRENCY slots per worker. When the slots are
+busy, jobs queue, and the next free slot goes to:
+
+1. The plan class (free, starter, professional, enterprise) with the lowest
+   pass. Every job started for a class advances its pass by 1 / job_weight
+   (SUBSCRIPTION_PLANS[plan]['job_weight']), so busy classes share the slots
+   in proportion to their weights (stride scheduling). A class that was idle
+   rejoins at the current virtual time instead of cashing in its idle period.
+2. Aging: a class's pass is reduced by how long it has had jobs waiting
+   without being given a slot, one free-plan job's worth per
+   JOB_AGING_SECONDS. However heavy the paid traffic, a waiting class
+   eventually outranks it; a class that is served regularly (say, a free
+   burst draining in its share) gains nothing.
+3. Within the class, the user with the fewest jobs started recently (the
+   same stride with equal weights), so one account queueing many jobs takes
+   turns with everyone else instead of filling the slots.
+4. That user's oldest job.
+
+Jobs that start without queueing are still charged, so a user who keeps the
+slots busy ranks behind newcomers once contention begins. The queue is per
+worker process, like the background tasks that run the jobs.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Callable, Optional
+
+from config.subscription_plans import SUBSCRIPTION_PLANS, get_job_weight
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+JOB_CONCURRENCY = int(os.getenv('JOB_CONCURRENCY', 4))
+JOB_AGING_SECONDS = float(os.getenv('JOB_AGING_SECONDS', 300))
+# Forget the stride of idle users beyond this many (they restart at the class's virtual time)
+JOB_SCHEDULER_MAX_USERS = 10000
+
+
+class Ticket:
+    """One job's place in the scheduler"""
+    __slots__ = ('job_id', 'user_id', 'plan', 'enqueued_at', 'started_at', 'future')
+
+    def __init__(self, plan: str, user_id, job_id: Optional[str] = None, now: float = 0.0):
+        self.plan = plan if plan in SUBSCRIPTION_PLANS else 'free'
+        self.user_id = user_id
+        self.job_id = job_id
+        self.enqueued_at = now
+        self.started_at = None
+        self.future = None
+
+    @property
+    def wait_seconds(self) -> float:
+        return (self.started_at if self.started_at is not None else self.enqueued_at) - self.enqueued_at
+
+
+class _PlanClass:
+    __slots__ = ('name', 'weight', 'pass_', 'users', 'user_pass', 'user_vtime', 'queued', 'running', 'served_at')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.weight = get_job_weight(name)
+        self.pass_ = 0.0
+        # user -> deque of waiting tickets, oldest first
+        self.users = {}
+        self.user_pass = {}
+        self.user_vtime = 0.0
+        self.queued = 0
+        self.running = 0
+        self.served_at = 0.0
+
+    def oldest_enqueued_at(self) -> float:
+        return min(tickets[0].enqueued_at for tickets in self.users.values())
+
+    def charge(self, user_id):
+        self.pass_ += 1.0 / self.weight
+        user_pass = max(self.user_pass.get(user_id, self.user_vtime), self.user_vtime)
+        self.user_vtime = user_pass
+        self.user_pass[user_id] = user_pass + 1.0
+        if len(self.user_pass) > JOB_SCHEDULER_MAX_USERS:
+            # Users at or behind the virtual time would restart there anyway
+            self.user_pass = {
+                user: p for user, p in self.user_pass.items() if p > self.user_vtime or user in self.users
+            }
+
+
+class JobScheduler:
+    def __init__(self, slots: int = JOB_CONCURRENCY, aging_seconds: float = JOB_AGING_SECONDS,
+                 clock: Callable[[], float] = time.monotonic):
+        self.slots = slots
+        self.aging_seconds = aging_seconds
+        self.clock = clock
+        self.running = 0
+        self.queued = 0
+        self._classes = {name: _PlanClass(name) for name in SUBSCRIPTION_PLANS}
+        self._vtime = 0.0
+
+    def enqueue(self, ticket: Ticket) -> list:
+        """Queue a job; returns the tickets started as a result (possibly this one)"""
+        plan_class = self._classes[ticket.plan]
+        if plan_class.queued == 0:
+            # Idle classes rejoin at the current virtual time
+            plan_class.pass_ = max(plan_class.pass_, self._vtime)
+        plan_class.users.setdefault(ticket.user_id, deque()).append(ticket)
+        plan_class.queued += 1
+        self.queued += 1
+        started = self._dispatch()
+        self._publish()
+        return started
+
+    def finish(self, ticket: Ticket) -> list:
+        """Free a started job's slot; returns the tickets started in its place"""
+        self.running -= 1
+        self._classes[ticket.plan].running -= 1
+        started = self._dispatch()
+        self._publish()
+        return started
+
+    def cancel(self, ticket: Ticket):
+        """Drop a job that has not started"""
+        plan_class = self._classes[ticket.plan]
+        tickets = plan_class.users.get(ticket.user_id)
+        if tickets is None or ticket not in tickets:
+            return
+        tickets.remove(ticket)
+        if not tickets:
+            del plan_class.users[ticket.user_id]
+        plan_class.queued -= 1
+        self.queued -= 1
+        self._publish()
+
+    def _pick(self, now: float) -> _PlanClass:
+        best, best_score = None, None
+        for plan_class in self._classes.values():
+            if not plan_class.queued:
+                continue
+            waited = now - max(plan_class.served_at, plan_class.oldest_enqueued_at())
+            score = plan_class.pass_ - waited / self.aging_seconds
+            if best is None or score < best_score or (score == best_score and plan_class.weight > best.weight):
+                best, best_score = plan_class, score
+        return best
+
+    def _dispatch(self) -> list:
+        started = []
+        now = self.clock()
+        while self.running < self.slots and self.queued:
+            plan_class = self._pick(now)
+            user_id = min(
+                plan_class.users,
+                key=lambda user: (plan_class.user_pass.get(user, plan_class.user_vtime), plan_class.users[user][0].enqueued_at)
+            )
+            tickets = plan_class.users[user_id]
+            ticket = tickets.popleft()
+            if not tickets:
+                del plan_class.users[user_id]
+            plan_class.queued -= 1
+            self.queued -= 1
+
+            self._vtime = max(self._vtime, plan_class.pass_)
+            plan_class.charge(user_id)
+            plan_class.served_at = now
+            plan_class.running += 1
+            self.running += 1
+            ticket.started_at = now
+            metrics.observe('generation_job_queue_wait_seconds', ticket.wait_seconds,
+                            {'plan': ticket.plan}, metrics.LONG_BUCKETS)
+            started.append(ticket)
+            if ticket.future is not None and not ticket.future.done():
+                ticket.future.set_result(None)
+        return started
+
+    def _publish(self):
+        for plan_class in self._classes.values():
+            metrics.set_gauge('generation_jobs_queued', plan_class.queued, {'plan': plan_class.name}, 'livesum')
+            metrics.set_gauge('generation_jobs_running', plan_class.running, {'plan': plan_class.name}, 'livesum')
+
+    @asynccontextmanager
+    async def slot(self, plan: str, user_id, job_id: Optional[str] = None):
+        """Hold a job slot for the body of the block, queueing for one first if needed"""
+        ticket = Ticket(plan, user_id, job_id, self.clock())
+        ticket.future = asyncio.get_running_loop().create_future()
+        self.enqueue(ticket)
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            if ticket.started_at is None:
+                self.cancel(ticket)
+            else:
+                self.finish(ticket)
+            raise
+        if ticket.wait_seconds >= 1:
+            logger.info("Generation job %s started after %.1fs in the %s queue", job_id, ticket.wait_seconds, ticket.plan)
+        try:
+            yield ticket
+        finally:
+            self.finish(ticket)
+
+    def stats(self) -> dict:
+        now = self.clock()
+        plans = {}
+        for plan_class in self._classes.values():
+            plans[plan_class.name] = {
+                'weight': plan_class.weight,
+                'queued': plan_class.queued,
+                'running': plan_class.running,
+                'oldest_wait_seconds': round(now - plan_class.oldest_enqueued_at(), 1) if plan_class.queued else 0.0,
+            }
+        return {'slots': self.slots, 'running': self.running, 'queued': self.queued, 'plans': plans}
+
+
+scheduler = JobScheduler()
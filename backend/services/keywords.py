@@ -0,0 +1,148 @@
+"""
+Stock-search keywords for the scenes of a script
+
+extract_queries() scores all scenes of a script in one pass. Each scene's
+text is split into candidate phrases at stop words and punctuation (RAKE);
+a word scores its TF-IDF weight across the script's scenes times its RAKE
+degree/frequency ratio, and a phrase scores the sum of its words. Words the
+whole script repeats (the subject, the narrator's filler) are damped by IDF,
+so each scene's queries name what is specific to it.
+
+The counting and scoring run on flat NumPy arrays of (scene, word) pairs,
+so a long script costs one vectorised pass rather than one per scene.
+"""
+import re
+from typing import List
+
+MAX_PHRASE_WORDS = 3
+MIN_WORD_LENGTH = 3
+
+# English function words plus words that are common in scripts but useless
+# as footage queries
+STOP_WORDS = frozenset("""
+a about above across after again against all almost along already also although always am among an and another any
+anyone anything are around as at away back be became because become becomes been before behind being below between
+beyond both but by can cannot could did do does doing done down during each either else enough even ever every
+everyone everything few for from further get gets getting give given go goes going gone got had has have having he
+her here hers herself him himself his how however i if in into is it its itself just keep know last least less let
+like made make makes many may me might more most much must my myself near need never new next no nobody none nor not
+nothing now of off often on once one only onto or other others our ours ourselves out over own per perhaps put rather
+really same see seem seems several shall she should show shows since so some someone something sometimes still such
+take than that the their theirs them themselves then there these they thing things this those though through thus
+till to together too toward towards under until up upon us use used very via want was way ways we well were what
+whatever when where whether which while who whom whose why will with within without would yet you your yours
+yourself yourselves
+scene scenes narrator narration voiceover voice-over cut fade shot shots camera clip frame intro outro video today
+let's we'll we're you'll you're it's that's there's here's don't can't won't isn't aren't
+""".split())
+
+_TOKEN = re.compile(r"[a-z][a-z'-]*|[^\sa-z]")
+
+
+def _phrases(text: str) -> list:
+    """Candidate phrases: runs of content words between stop words and punctuation"""
+    phrases, current = [], []
+    for token in _TOKEN.findall(text.lower()):
+        word = token.strip("'-")
+        if len(word) >= MIN_WORD_LENGTH and word not in STOP_WORDS and word[0].isalpha():
+            current.append(word)
+            if len(current) == MAX_PHRASE_WORDS:
+                phrases.append(tuple(current))
+                current = []
+        elif current:
+            phrases.append(tuple(current))
+            current = []
+    if current:
+        phrases.append(tuple(current))
+    return phrases
+
+
+def extract_queries(texts: List[str], max_queries: int = 2, min_terms: int = 2) -> List[List[str]]:
+    """
+    Ranked search queries for each scene of a script
+
+    Args:
+        texts: Scene texts, scored together as one corpus
+        max_queries: Queries to return per scene, best first
+        min_terms: Single-word phrases are extended with the scene's next
+            best word up to this many terms
+
+    Returns:
+        One list of queries per scene (empty if a scene has no content words)
+    """
+    scene_phrases = [list(dict.fromkeys(_phrases(text))) for text in texts]
+
+    vocabulary = {}
+    token_scene, token_word, token_phrase, token_degree = [], [], [], []
+    phrase_scene = []
+    for scene, phrases in enumerate(scene_phrases):
+        for phrase in phrases:
+            phrase_id = len(phrase_scene)
+            phrase_scene.append(scene)
+            for word in phrase:
+                token_scene.append(scene)
+                token_word.append(vocabulary.setdefault(word, len(vocabulary)))
+                token_phrase.append(phrase_id)
+                # RAKE degree: each occurrence co-occurs with the whole phrase
+                token_degree.append(len(phrase))
+
+    results = [[] for _ in texts]
+    if not phrase_scene:
+        return results
+
+    # Imported here so loading the routes does not load NumPy (utils.warmup does)
+    import numpy as np
+
+    token_scene = np.asarray(token_scene, dtype=np.int64)
+    token_word = np.asarray(token_word, dtype=np.int64)
+    token_phrase = np.asarray(token_phrase, dtype=np.int64)
+    token_degree = np.asarray(token_degree, dtype=np.float64)
+    phrase_scene = np.asarray(phrase_scene, dtype=np.int64)
+    n_scenes, n_words = len(texts), len(vocabulary)
+
+    # Sparse (scene, word) counts as one sorted array of pair ids
+    pair_ids = token_scene * n_words + token_word
+    pairs, token_pair, counts = np.unique(pair_ids, return_inverse=True, return_counts=True)
+    pair_scene, pair_word = pairs // n_words, pairs % n_words
+
+    scene_totals = np.bincount(token_scene, minlength=n_scenes).astype(np.float64)
+    document_frequency = np.bincount(pair_word, minlength=n_words)
+    idf = np.log((1 + n_scenes) / (1 + document_frequency)) + 1
+    tfidf = counts / scene_totals[pair_scene] * idf[pair_word]
+    rake = np.bincount(token_pair, weights=token_degree, minlength=len(pairs)) / counts
+    pair_score = tfidf * rake
+
+    phrase_score = np.bincount(token_phrase, weights=pair_score[token_pair], minlength=len(phrase_scene))
+
+    # Best phrases first within each scene
+    phrase_order = np.lexsort((-phrase_score, phrase_scene))
+    scene_start = np.searchsorted(phrase_scene, np.arange(n_scenes))
+    word_order = np.lexsort((-pair_score, pair_scene))
+    words = list(vocabulary)
+    best_words = [[] for _ in texts]
+    for pair in word_order:
+        scene_words = best_words[pair_scene[pair]]
+        if len(scene_words) < min_terms + max_queries:
+            scene_words.append(words[pair_word[pair]])
+
+    for phrase_id in phrase_order:
+        scene = phrase_scene[phrase_id]
+        queries = results[scene]
+        if len(queries) >= max_queries:
+            continue
+        terms = list(scene_phrases[scene][phrase_id - scene_start[scene]])
+        for word in best_words[scene]:
+            if len(terms) >= min_terms:
+                break
+            if word not in terms:
+                terms.append(word)
+        query = ' '.join(terms)
+        if query not in queries:
+            queries.append(query)
+    return results
+
+
+def extract_keywords(text: str) -> str:
+    """Best single search query for one piece of text"""
+    queries = extract_queries([text], max_queries=1)[0]
+    return queries[0] if queries else ''
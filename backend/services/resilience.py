@@ -0,0 +1,301 @@
+"""
+Per-provider resilience: error classification, jittered retries inside a
+retry budget, a circuit breaker and, for providers listed in
+PROVIDER_CONCURRENCY, a shared adaptive concurrency limit
+
+    provider = get_provider('emergent_image')
+    result = await provider.call(lambda: make_request())
+
+Only retryable failures (timeouts, connection errors, 408/425/429/5xx) count
+against the breaker; a bad request is the caller's fault, not an outage.
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import httpx
+
+from services.concurrency_governor import GovernorTimeout, get_governor
+from utils import metrics, tracing
+
+logger = logging.getLogger(__name__)
+
+PROVIDER_RETRY_MAX_ATTEMPTS = int(os.getenv('PROVIDER_RETRY_MAX_ATTEMPTS', 3))
+PROVIDER_RETRY_BASE_SECONDS = float(os.getenv('PROVIDER_RETRY_BASE_SECONDS', 1))
+PROVIDER_RETRY_MAX_SECONDS = float(os.getenv('PROVIDER_RETRY_MAX_SECONDS', 20))
+PROVIDER_RETRY_BUDGET_RATIO = float(os.getenv('PROVIDER_RETRY_BUDGET_RATIO', 0.2))
+PROVIDER_RETRY_BUDGET_MIN_PER_SECOND = float(os.getenv('PROVIDER_RETRY_BUDGET_MIN_PER_SECOND', 0.5))
+PROVIDER_BREAKER_FAILURE_THRESHOLD = int(os.getenv('PROVIDER_BREAKER_FAILURE_THRESHOLD', 5))
+PROVIDER_BREAKER_RESET_SECONDS = float(os.getenv('PROVIDER_BREAKER_RESET_SECONDS', 30))
+
+RETRYABLE_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+# Answers meaning the provider wants less traffic, not that the request was bad
+OVERLOAD_STATUS_CODES = {429, 503, 504}
+
+CIRCUIT_CLOSED = 'closed'
+CIRCUIT_OPEN = 'open'
+CIRCUIT_HALF_OPEN = 'half_open'
+CIRCUIT_STATE_VALUES = {CIRCUIT_CLOSED: 0, CIRCUIT_HALF_OPEN: 1, CIRCUIT_OPEN: 2}
+
+
+class ProviderError(Exception):
+    """A provider call failed; `retryable` says whether trying again may help"""
+
+    def __init__(self, message: str, retryable: bool = False, status_code: int = None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.status_code = status_code
+
+
+class CircuitOpenError(ProviderError):
+    """The provider's breaker is open, so the call was not attempted"""
+
+    def __init__(self, provider: str):
+        super().__init__(f"{provider} is temporarily unavailable", retryable=False)
+
+
+def http_status_error(status_code: int, body: str = '') -> ProviderError:
+    return ProviderError(
+        f"HTTP {status_code}: {body[:200]}",
+        retryable=status_code in RETRYABLE_STATUS_CODES,
+        status_code=status_code
+    )
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, ProviderError):
+        return error.retryable
+    return isinstance(error, (httpx.TimeoutException, httpx.TransportError, asyncio.TimeoutError, ConnectionError))
+
+
+def is_overload(error: Exception) -> bool:
+    """True for failures that should shrink the provider's concurrency limit"""
+    if isinstance(error, ProviderError):
+        return error.status_code in OVERLOAD_STATUS_CODES
+    return isinstance(error, (httpx.TimeoutException, asyncio.TimeoutError))
+
+
+def backoff_delay(attempt: int, base: float = PROVIDER_RETRY_BASE_SECONDS, cap: float = PROVIDER_RETRY_MAX_SECONDS) -> float:
+    """Full-jitter exponential backoff for the given 0-based retry attempt"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+@asynccontextmanager
+async def outbound_call(provider: str):
+    """
+    Record latency and outcome of one outbound request to a provider
+
+    Feeds provider_request_duration_seconds and provider_requests_total, the
+    per-provider series behind the /metrics latency and error-rate panels.
+    """
+    start = time.perf_counter()
+    outcome = 'success'
+    try:
+        with tracing.span(f"provider.{provider}", {'provider.name': provider}, kind=tracing.SpanKind.CLIENT):
+            yield
+    except Exception as e:
+        outcome = 'retryable_error' if is_retryable(e) else 'error'
+        raise
+    finally:
+        labels = {'provider': provider, 'outcome': outcome}
+        metrics.observe('provider_request_duration_seconds', time.perf_counter() - start, labels, metrics.LONG_BUCKETS)
+        metrics.inc('provider_requests_total', labels)
+
+
+@asynccontextmanager
+async def concurrency_slot(provider: str):
+    """
+    Hold one of the provider's concurrency slots for one request
+
+    Waits while all workers together are at the provider's adaptive limit
+    (see services.concurrency_governor); a no-op for ungoverned providers.
+    """
+    governor = get_governor(provider)
+    if governor is None:
+        yield
+        return
+    async with governor.slot(is_overload):
+        yield
+
+
+class RetryBudget:
+    """
+    Caps retries to a fraction of recent traffic
+
+    Every first attempt deposits `ratio` tokens and every retry withdraws one,
+    with a small time-based floor so low-traffic periods can still retry.
+    During an outage retries stay at ~ratio of load instead of multiplying it.
+    """
+
+    def __init__(self, ratio: float, min_per_second: float, capacity: float = 20):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.min_per_second)
+        self.updated = now
+
+    def record_request(self):
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + self.ratio)
+
+    def try_withdraw(self) -> bool:
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures, rejects calls for
+    `reset_seconds`, then lets a single probe through (half-open)
+
+    allow() hands out a token that the caller passes to release() when the
+    call ends, however it ends: a probe that was cancelled or raised
+    something other than a provider error frees the half-open slot instead
+    of wedging the breaker.
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = CIRCUIT_CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._probe = 0
+
+    def available(self) -> bool:
+        """True if a call would currently be let through"""
+        if self.state == CIRCUIT_OPEN:
+            return time.monotonic() - self.opened_at >= self.reset_seconds
+        if self.state == CIRCUIT_HALF_OPEN:
+            return not self._probe_in_flight
+        return True
+
+    def allow(self) -> Optional[int]:
+        """None if the call is rejected, else a token for release(): 0, or the probe's number"""
+        if self.state == CIRCUIT_OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+            self.state = CIRCUIT_HALF_OPEN
+            self._probe_in_flight = False
+        if self.state == CIRCUIT_HALF_OPEN:
+            if self._probe_in_flight:
+                return None
+            self._probe_in_flight = True
+            self._probe += 1
+            return self._probe
+        return 0 if self.state == CIRCUIT_CLOSED else None
+
+    def release(self, token: int):
+        """The call allow() let through has ended; a probe with no recorded outcome frees its slot"""
+        if token and token == self._probe and self.state == CIRCUIT_HALF_OPEN:
+            self._probe_in_flight = False
+
+    def record_success(self):
+        self.state = CIRCUIT_CLOSED
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == CIRCUIT_HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self.state = CIRCUIT_OPEN
+            self.opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+
+class ProviderResilience:
+    def __init__(self, name: str):
+        self.name = name
+        self.max_attempts = PROVIDER_RETRY_MAX_ATTEMPTS
+        self.breaker = CircuitBreaker(PROVIDER_BREAKER_FAILURE_THRESHOLD, PROVIDER_BREAKER_RESET_SECONDS)
+        self.budget = RetryBudget(PROVIDER_RETRY_BUDGET_RATIO, PROVIDER_RETRY_BUDGET_MIN_PER_SECOND)
+        self._publish_state()
+
+    def _publish_state(self):
+        metrics.set_gauge('provider_circuit_state', CIRCUIT_STATE_VALUES[self.breaker.state], {'provider': self.name})
+
+    def available(self) -> bool:
+        return self.breaker.available()
+
+    async def call(self, fn):
+        """
+        Await fn() with retries; fn must be a zero-argument coroutine factory
+        """
+        labels = {'provider': self.name}
+        self.budget.record_request()
+
+        attempt = 0
+        while True:
+            token = self.breaker.allow()
+            if token is None:
+                metrics.inc('provider_circuit_rejections_total', labels)
+                raise CircuitOpenError(self.name)
+
+            try:
+                async with concurrency_slot(self.name):
+                    async with outbound_call(self.name):
+                        result = await fn()
+            except GovernorTimeout:
+                # Nothing was sent, so the breaker has nothing to learn; a
+                # probe that timed out in line is released below
+                raise
+            except Exception as e:
+                retryable = is_retryable(e)
+                if retryable:
+                    self.breaker.record_failure()
+                else:
+                    # The provider answered; it is up even if the request was bad
+                    self.breaker.record_success()
+                self._publish_state()
+
+                attempt += 1
+                if not retryable or attempt >= self.max_attempts:
+                    raise
+                if not self.budget.try_withdraw():
+                    metrics.inc('provider_retry_budget_exhausted_total', labels)
+                    raise
+
+                delay = backoff_delay(attempt - 1)
+                metrics.inc('provider_retries_total', labels)
+                logger.warning("%s call failed (%s), retry %d in %.1fs", self.name, e, attempt, delay)
+                await asyncio.sleep(delay)
+                continue
+            finally:
+                # A no-op once an outcome was recorded; frees a cancelled probe
+                self.breaker.release(token)
+
+            self.breaker.record_success()
+            self._publish_state()
+            return result
+
+
+_providers = {}
+
+
+def get_provider(name: str) -> ProviderResilience:
+    """Return the process-wide resilience wrapper for a provider"""
+    if name not in _providers:
+        _providers[name] = ProviderResilience(name)
+    return _providers[name]
+
+
+def provider_states() -> dict:
+    return {
+        name: {
+            'state': provider.breaker.state,
+            'consecutive_failures': provider.breaker.consecutive_failures,
+            'retry_tokens': round(provider.budget.tokens, 2)
+        }
+        for name, provider in _providers.items()
+    }
@@ -0,0 +1,250 @@
+"""
+Pexels stock footage search with a shared keyword cache
+
+search_many() looks up every scene's keywords at once: cache hits are
+answered from memory or the stock_search_cache collection (shared by all
+workers and users), identical keywords in flight are searched once, and the
+remaining searches go out concurrently over one pooled HTTP client.
+
+Pexels reports its quota in X-Ratelimit-Limit/-Remaining/-Reset. When the
+remaining requests fall to STOCK_RATELIMIT_RESERVE, or Pexels answers 429,
+no further searches are sent until the reset; lookups are then served from
+cache (expired entries included) or fall back to placeholder images.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import httpx
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from services.resilience import ProviderError, get_provider, http_status_error
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+PEXELS_API_BASE = os.getenv('PEXELS_API_BASE', 'https://api.pexels.com')
+STOCK_SEARCH_CONCURRENCY = int(os.getenv('STOCK_SEARCH_CONCURRENCY', 8))
+STOCK_SEARCH_TIMEOUT_SECONDS = float(os.getenv('STOCK_SEARCH_TIMEOUT_SECONDS', 10))
+STOCK_CACHE_TTL_SECONDS = float(os.getenv('STOCK_CACHE_TTL_SECONDS', 7 * 24 * 3600))
+STOCK_CACHE_MAX_ENTRIES = int(os.getenv('STOCK_CACHE_MAX_ENTRIES', 5000))
+STOCK_RATELIMIT_RESERVE = int(os.getenv('STOCK_RATELIMIT_RESERVE', 10))
+# Used when Pexels says 429 without telling us when to come back
+STOCK_RATELIMIT_DEFAULT_BACKOFF_SECONDS = float(os.getenv('STOCK_RATELIMIT_DEFAULT_BACKOFF_SECONDS', 60))
+
+MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
+DB_NAME = os.getenv("DB_NAME", "test_database")
+client = AsyncIOMotorClient(MONGO_URL)
+db = client[DB_NAME]
+
+PLACEHOLDER_FOOTAGE = {
+    'type': 'image',
+    'url': 'https://images.unsplash.com/photo-1559860199-52dc7841bf5c',
+    'thumbnail': 'https://images.unsplash.com/photo-1559860199-52dc7841bf5c?w=400',
+    'source': 'unsplash'
+}
+
+_client: Optional[httpx.AsyncClient] = None
+_semaphore: Optional[asyncio.Semaphore] = None
+_in_flight = {}
+# key -> (expires_at monotonic, results); kept past expiry for rate-limited periods
+_memory = OrderedDict()
+_ratelimit = {'limit': None, 'remaining': None, 'blocked_until': 0.0}
+
+
+def _api_key() -> Optional[str]:
+    key = os.getenv('PEXELS_API_KEY')
+    if not key or key == 'your_pexels_api_key_here':
+        return None
+    return key
+
+
+def _get_client() -> httpx.AsyncClient:
+    global _client, _semaphore
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=STOCK_SEARCH_TIMEOUT_SECONDS,
+            limits=httpx.Limits(max_connections=STOCK_SEARCH_CONCURRENCY, max_keepalive_connections=STOCK_SEARCH_CONCURRENCY)
+        )
+        _semaphore = asyncio.Semaphore(STOCK_SEARCH_CONCURRENCY)
+    return _client
+
+
+async def close_stock_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def ensure_indexes():
+    await db.stock_search_cache.create_index('expires_at', expireAfterSeconds=0)
+
+
+def cache_key(query: str, count: int) -> str:
+    return f"{count}:{' '.join(query.lower().split())}"
+
+
+def _remember(key: str, results: list, expires_at: float):
+    _memory[key] = (expires_at, results)
+    _memory.move_to_end(key)
+    while len(_memory) > STOCK_CACHE_MAX_ENTRIES:
+        _memory.popitem(last=False)
+
+
+def _reset_delay(value: str) -> Optional[float]:
+    """Seconds until a reset given as a UNIX timestamp (Pexels) or a delta"""
+    try:
+        reset = float(value)
+    except (TypeError, ValueError):
+        return None
+    # Anything this large is an epoch time, not a number of seconds
+    if reset > 1e9:
+        return max(0.0, reset - time.time())
+    return reset
+
+
+def _record_ratelimit(response: httpx.Response):
+    headers = response.headers
+    if 'x-ratelimit-remaining' in headers:
+        try:
+            _ratelimit['limit'] = int(headers.get('x-ratelimit-limit', 0)) or None
+            _ratelimit['remaining'] = int(headers['x-ratelimit-remaining'])
+        except ValueError:
+            return
+        metrics.set_gauge('pexels_ratelimit_remaining', _ratelimit['remaining'])
+
+    if response.status_code == 429:
+        delay = _reset_delay(headers.get('retry-after')) or _reset_delay(headers.get('x-ratelimit-reset'))
+        delay = delay if delay else STOCK_RATELIMIT_DEFAULT_BACKOFF_SECONDS
+    elif _ratelimit['remaining'] is not None and _ratelimit['remaining'] <= STOCK_RATELIMIT_RESERVE:
+        delay = _reset_delay(headers.get('x-ratelimit-reset')) or STOCK_RATELIMIT_DEFAULT_BACKOFF_SECONDS
+    else:
+        return
+    _ratelimit['blocked_until'] = max(_ratelimit['blocked_until'], time.monotonic() + delay)
+    logger.warning("Pexels rate limit reached (%s remaining); pausing searches for %.0fs", _ratelimit['remaining'], delay)
+
+
+def rate_limited() -> bool:
+    return time.monotonic() < _ratelimit['blocked_until']
+
+
+def ratelimit_state() -> dict:
+    return {
+        'limit': _ratelimit['limit'],
+        'remaining': _ratelimit['remaining'],
+        'paused_for_seconds': round(max(0.0, _ratelimit['blocked_until'] - time.monotonic()), 1)
+    }
+
+
+async def _request(query: str, count: int, api_key: str) -> list:
+    async with _semaphore:
+        response = await _get_client().get(
+            f'{PEXELS_API_BASE}/videos/search',
+            headers={'Authorization': api_key},
+            params={'query': query, 'per_page': count}
+        )
+    _record_ratelimit(response)
+    if response.status_code == 429:
+        # Retrying before the reset only burns more quota
+        raise ProviderError("Pexels rate limit exceeded", retryable=False, status_code=429)
+    if response.status_code != 200:
+        raise http_status_error(response.status_code, response.text)
+
+    videos = []
+    for video in response.json().get('videos', [])[:count]:
+        video_files = video.get('video_files', [])
+        if video_files:
+            videos.append({
+                'type': 'video',
+                'url': video_files[0]['link'],
+                'thumbnail': video.get('image'),
+                'source': 'pexels'
+            })
+    return videos
+
+
+async def _lookup(query: str, count: int, api_key: str) -> Optional[list]:
+    """Cached or fresh results for one query; None if neither is available"""
+    key = cache_key(query, count)
+    now = time.monotonic()
+    cached = _memory.get(key)
+    if cached is not None and cached[0] > now:
+        _memory.move_to_end(key)
+        metrics.inc('stock_search_cache_total', {'result': 'memory'})
+        return cached[1]
+
+    try:
+        doc = await db.stock_search_cache.find_one({'_id': key, 'expires_at': {'$gt': datetime.now(timezone.utc)}})
+    except Exception as e:
+        logger.warning("Stock search cache lookup failed: %s", e)
+        doc = None
+    if doc is not None:
+        remaining = (doc['expires_at'].replace(tzinfo=timezone.utc) - datetime.now(timezone.utc)).total_seconds()
+        _remember(key, doc['results'], now + remaining)
+        metrics.inc('stock_search_cache_total', {'result': 'mongo'})
+        return doc['results']
+
+    if rate_limited():
+        metrics.inc('stock_search_cache_total', {'result': 'rate_limited'})
+        return cached[1] if cached is not None else None
+
+    metrics.inc('stock_search_cache_total', {'result': 'miss'})
+    try:
+        results = await get_provider('pexels').call(lambda: _request(query, count, api_key))
+    except Exception as e:
+        logger.error("Error fetching stock footage: %s", e)
+        return cached[1] if cached is not None else None
+
+    _remember(key, results, time.monotonic() + STOCK_CACHE_TTL_SECONDS)
+    try:
+        await db.stock_search_cache.update_one(
+            {'_id': key},
+            {'$set': {
+                'query': query,
+                'results': results,
+                'expires_at': datetime.now(timezone.utc) + timedelta(seconds=STOCK_CACHE_TTL_SECONDS)
+            }},
+            upsert=True
+        )
+    except Exception as e:
+        logger.warning("Could not store stock search cache entry: %s", e)
+    return results
+
+
+async def _shared_lookup(query: str, count: int, api_key: str) -> Optional[list]:
+    """Concurrent lookups of the same query share one search"""
+    key = cache_key(query, count)
+    task = _in_flight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_lookup(query, count, api_key))
+        _in_flight[key] = task
+        task.add_done_callback(lambda _: _in_flight.pop(key, None))
+    # Shield so one caller's cancellation does not cancel the others' search
+    return await asyncio.shield(task)
+
+
+async def search_stock_footage(query: str, count: int = 5) -> list:
+    """Search for stock videos/images from Pexels"""
+    return (await search_many([query], count))[0]
+
+
+async def search_many(queries: list, count: int = 1) -> list:
+    """
+    Search several queries concurrently
+
+    Returns a list of results per query, in order; a query with no usable
+    results gets placeholder footage.
+    """
+    api_key = _api_key()
+    if not api_key:
+        # Return placeholder images if no API key
+        return [[dict(PLACEHOLDER_FOOTAGE) for _ in range(count)] for _ in queries]
+
+    _get_client()
+    results = await asyncio.gather(*(_shared_lookup(query, count, api_key) for query in queries))
+    return [found if found is not None else [dict(PLACEHOLDER_FOOTAGE)] for found in results]
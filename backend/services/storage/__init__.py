@@ -0,0 +1,55 @@
+"""
+Pluggable asset storage
+
+STORAGE_BACKEND selects the driver: `local` (default) or `s3`. Unless
+STORAGE_ACCOUNTING=false, the driver is wrapped with quota checks and usage
+accounting (see services.storage.quota).
+"""
+import os
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+from services.storage.base import StorageBackend
+
+load_dotenv()
+
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'local').lower()
+STORAGE_ACCOUNTING = os.getenv('STORAGE_ACCOUNTING', 'true').lower() == 'true'
+STORAGE_LOCAL_ROOT = os.getenv('STORAGE_LOCAL_ROOT', str(Path(__file__).resolve().parents[2] / 'static'))
+
+_storage = None
+
+
+def get_storage() -> StorageBackend:
+    """Return the process-wide storage backend, creating it on first use"""
+    global _storage
+    if _storage is not None:
+        return _storage
+
+    if STORAGE_BACKEND == 's3':
+        from services.storage.s3 import S3Storage
+        _storage = S3Storage(
+            bucket=os.environ['STORAGE_S3_BUCKET'],
+            endpoint_url=os.getenv('STORAGE_S3_ENDPOINT_URL'),
+            region=os.getenv('STORAGE_S3_REGION'),
+            public_base_url=os.getenv('STORAGE_S3_PUBLIC_BASE_URL'),
+            max_workers=int(os.getenv('STORAGE_S3_MAX_WORKERS', 16)),
+            multipart_threshold_mb=int(os.getenv('STORAGE_S3_MULTIPART_THRESHOLD_MB', 8)),
+            multipart_chunksize_mb=int(os.getenv('STORAGE_S3_MULTIPART_CHUNKSIZE_MB', 8)),
+            max_concurrency=int(os.getenv('STORAGE_S3_MAX_CONCURRENCY', 8))
+        )
+    elif STORAGE_BACKEND == 'local':
+        from services.storage.local import LocalStorage
+        _storage = LocalStorage(
+            root=STORAGE_LOCAL_ROOT,
+            base_url=os.getenv('BACKEND_URL', 'https://core.preview.emergentagent.com')
+        )
+    else:
+        raise ValueError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+
+    if STORAGE_ACCOUNTING:
+        from services.storage.quota import AccountedStorage
+        _storage = AccountedStorage(_storage)
+
+    return _storage
@@ -0,0 +1,42 @@
+"""
+Storage backend interface for generated assets
+"""
+from abc import ABC, abstractmethod
+from typing import Optional
+
+
+class StorageBackend(ABC):
+    """
+    Stores assets under slash-separated keys such as `images/<uuid>.png`
+
+    stat() returns a dict with `key`, `size`, `content_type`, `etag` and
+    `last_modified`, or None if the key does not exist.
+    """
+
+    @abstractmethod
+    async def put(self, key: str, data: bytes, content_type: str = 'application/octet-stream') -> str:
+        """Store bytes under key and return the key"""
+
+    @abstractmethod
+    async def put_file(self, key: str, path: str, content_type: str = 'application/octet-stream') -> str:
+        """Store a local file under key (streamed, multipart for large files) and return the key"""
+
+    @abstractmethod
+    async def get(self, key: str) -> bytes:
+        """Return the stored bytes, raising FileNotFoundError if missing"""
+
+    @abstractmethod
+    async def stat(self, key: str) -> Optional[dict]:
+        """Return object metadata, or None if missing"""
+
+    @abstractmethod
+    async def delete(self, key: str) -> bool:
+        """Delete key and return whether it existed"""
+
+    @abstractmethod
+    def public_url(self, key: str) -> str:
+        """Return a long-lived URL suitable for storing in the database"""
+
+    @abstractmethod
+    async def signed_url(self, key: str, expires_in: int = 3600) -> str:
+        """Return a time-limited URL granting read access to key"""
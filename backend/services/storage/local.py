@@ -0,0 +1,92 @@
+"""
+Local filesystem storage driver
+
+Files live under STORAGE_LOCAL_ROOT, which server.py serves at /static.
+"""
+import asyncio
+import hashlib
+import mimetypes
+import os
+import shutil
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+from services.storage.base import StorageBackend
+from utils import tracing
+
+
+class LocalStorage(StorageBackend):
+    def __init__(self, root: str, base_url: str):
+        self.root = Path(root)
+        self.base_url = base_url.rstrip('/')
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def path_for(self, key: str) -> Path:
+        path = (self.root / key).resolve()
+        if self.root.resolve() not in path.parents:
+            raise ValueError(f"Invalid storage key: {key}")
+        return path
+
+    def _write(self, path: Path, data: bytes):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary name first so readers never see a partial file
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _copy(self, path: Path, source: str):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+        shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, path)
+
+    async def put(self, key: str, data: bytes, content_type: str = 'application/octet-stream') -> str:
+        with tracing.span('storage.put', {'storage.backend': 'local', 'storage.key': key, 'storage.bytes': len(data)}):
+            await asyncio.to_thread(self._write, self.path_for(key), data)
+        return key
+
+    async def put_file(self, key: str, path: str, content_type: str = 'application/octet-stream') -> str:
+        with tracing.span('storage.put_file', {'storage.backend': 'local', 'storage.key': key}):
+            await asyncio.to_thread(self._copy, self.path_for(key), path)
+        return key
+
+    async def get(self, key: str) -> bytes:
+        return await asyncio.to_thread(self.path_for(key).read_bytes)
+
+    def _stat(self, key: str) -> Optional[dict]:
+        path = self.path_for(key)
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            return None
+        etag = hashlib.md5(f"{st.st_ino}-{st.st_size}-{st.st_mtime_ns}".encode()).hexdigest()
+        return {
+            'key': key,
+            'size': st.st_size,
+            'content_type': mimetypes.guess_type(path.name)[0] or 'application/octet-stream',
+            'etag': etag,
+            'last_modified': datetime.fromtimestamp(st.st_mtime, tz=timezone.utc)
+        }
+
+    async def stat(self, key: str) -> Optional[dict]:
+        return await asyncio.to_thread(self._stat, key)
+
+    def _delete(self, key: str) -> bool:
+        try:
+            self.path_for(key).unlink()
+            return True
+        except FileNotFoundError:
+            return False
+
+    async def delete(self, key: str) -> bool:
+        return await asyncio.to_thread(self._delete, key)
+
+    def public_url(self, key: str) -> str:
+        return f"{self.base_url}/static/{key}"
+
+    async def signed_url(self, key: str, expires_in: int = 3600) -> str:
+        # Local assets are served publicly under unguessable UUID names
+        return self.public_url(key)
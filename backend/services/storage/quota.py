@@ -0,0 +1,391 @@
+"""
+Storage accounting, per-plan quotas and LRU eviction
+
+Every object written through get_storage() is recorded in `media_objects`
+(key, owner, kind, size, last access), and the owner's totals in
+`storage_usage` are adjusted with $inc on each write and delete:
+
+    {_id: 'user:<user_id>', bytes, objects}
+    {_id: 'project:<project_id>', bytes, objects}
+
+Objects are classified by key:
+
+    original    images/<id>.png        user data, never evicted
+                audio/<video_id>/...   voiceover tracks
+    derivative  images/<id>_thumb.webp, images/<id>.json
+    cache       cache/...              safe to drop at any time
+
+The owner comes from a context variable set by the generation job, so
+nested calls (image save, derivatives, ingestion) need no extra arguments.
+Originals reserve their size against the owner's plan quota before they
+are written: a guarded $inc that only matches while the reservation fits,
+so concurrent writes cannot overshoot the quota together. When the local
+volume passes STORAGE_HIGH_WATER, derivatives and cache objects are evicted
+least-recently-accessed first until usage drops below STORAGE_LOW_WATER.
+Every worker runs the maintenance loop, but eviction takes a per-volume
+lease in `maintenance_leases`, so only one worker at a time evicts.
+"""
+import asyncio
+import contextvars
+import logging
+import os
+import re
+import shutil
+import socket
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from config.subscription_plans import get_storage_quota_bytes
+from services.storage.base import StorageBackend
+
+logger = logging.getLogger(__name__)
+
+MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
+DB_NAME = os.getenv("DB_NAME", "test_database")
+client = AsyncIOMotorClient(MONGO_URL)
+db = client[DB_NAME]
+
+STORAGE_HIGH_WATER = float(os.getenv('STORAGE_HIGH_WATER', 0.85))
+STORAGE_LOW_WATER = float(os.getenv('STORAGE_LOW_WATER', 0.75))
+STORAGE_MAINTENANCE_INTERVAL_SECONDS = float(os.getenv('STORAGE_MAINTENANCE_INTERVAL_SECONDS', 60))
+# Another worker takes over eviction if the holder dies mid-run
+STORAGE_EVICTION_LEASE_SECONDS = float(os.getenv('STORAGE_EVICTION_LEASE_SECONDS', 600))
+
+ORIGINAL_KEY_PATTERN = re.compile(r'^images/([0-9a-f-]{36})\.\w+$')
+DERIVATIVE_KEY_PATTERN = re.compile(r'^images/([0-9a-f-]{36})(_\w+\.\w+|\.json)$')
+
+EVICTABLE_KINDS = ('derivative', 'cache')
+
+_current_owner = contextvars.ContextVar('storage_owner', default=None)
+_pending_access = {}
+_worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+
+class StorageQuotaExceeded(Exception):
+    pass
+
+
+def set_storage_owner(user_id: str, project_id: str = None, plan: str = 'free'):
+    """Attribute storage writes in the current context (and tasks it spawns) to a user/project"""
+    _current_owner.set({'user_id': user_id, 'project_id': project_id, 'plan': plan})
+
+
+def classify_key(key: str) -> tuple:
+    """
+    Returns:
+        (kind, image_id) for a storage key
+    """
+    match = ORIGINAL_KEY_PATTERN.match(key)
+    if match and not key.endswith('.json'):
+        return 'original', match.group(1)
+    match = DERIVATIVE_KEY_PATTERN.match(key)
+    if match:
+        return 'derivative', match.group(1)
+    if key.startswith('cache/'):
+        return 'cache', None
+    return 'original', None
+
+
+async def ensure_indexes():
+    await db.media_objects.create_index([('kind', ASCENDING), ('last_accessed', ASCENDING)])
+    await db.media_objects.create_index('image_id')
+    await db.media_objects.create_index('project_id')
+
+
+async def get_usage(user_id: str) -> int:
+    doc = await db.storage_usage.find_one({'_id': f"user:{user_id}"})
+    return doc['bytes'] if doc else 0
+
+
+def _quota_exceeded(used: int, quota: int) -> StorageQuotaExceeded:
+    return StorageQuotaExceeded(
+        f"Storage quota exceeded: {used / 1024 / 1024:.1f} MB used of {quota / 1024 / 1024:.0f} MB"
+    )
+
+
+async def check_quota(owner: Optional[dict], incoming_bytes: int):
+    """
+    Raise StorageQuotaExceeded if writing incoming_bytes would exceed the owner's plan quota
+    A pre-check only; writes reserve their bytes with reserve_quota()
+    """
+    if not owner or not owner.get('user_id'):
+        return
+    quota = get_storage_quota_bytes(owner.get('plan') or 'free')
+    used = await get_usage(owner['user_id'])
+    if used + incoming_bytes > quota:
+        raise _quota_exceeded(used, quota)
+
+
+async def reserve_quota(owner: Optional[dict], incoming_bytes: int) -> int:
+    """
+    Charge incoming_bytes to the owner's usage if it fits the plan quota,
+    else raise StorageQuotaExceeded
+
+    Returns:
+        int: Bytes reserved, to pass to record_write() (or release_quota() if the write fails)
+    """
+    if not owner or not owner.get('user_id'):
+        return 0
+    quota = get_storage_quota_bytes(owner.get('plan') or 'free')
+    usage_id = f"user:{owner['user_id']}"
+    for _ in range(2):
+        result = await db.storage_usage.update_one(
+            {'_id': usage_id, 'bytes': {'$lte': quota - incoming_bytes}},
+            {'$inc': {'bytes': incoming_bytes}}
+        )
+        if result.matched_count:
+            return incoming_bytes
+        if incoming_bytes > quota:
+            break
+        try:
+            # First write of this user
+            await db.storage_usage.insert_one({'_id': usage_id, 'bytes': incoming_bytes, 'objects': 0})
+            return incoming_bytes
+        except DuplicateKeyError:
+            # It exists, and either is full or was created just now; check again
+            continue
+    raise _quota_exceeded(await get_usage(owner['user_id']), quota)
+
+
+async def release_quota(owner: Optional[dict], reserved: int):
+    """Return a reservation whose write did not happen"""
+    if reserved:
+        await _adjust_usage({'user_id': owner['user_id']}, -reserved, 0)
+
+
+async def _adjust_usage(owner: Optional[dict], delta_bytes: int, delta_objects: int, reserved: int = 0):
+    """reserved bytes were already charged to the user by reserve_quota()"""
+    if not owner:
+        return
+    updates = []
+    if owner.get('user_id'):
+        updates.append((f"user:{owner['user_id']}", delta_bytes - reserved))
+    if owner.get('project_id'):
+        updates.append((f"project:{owner['project_id']}", delta_bytes))
+    for usage_id, delta in updates:
+        await db.storage_usage.update_one(
+            {'_id': usage_id},
+            {'$inc': {'bytes': delta, 'objects': delta_objects}},
+            upsert=True
+        )
+
+
+async def record_write(key: str, size: int, owner: Optional[dict], reserved: int = 0):
+    """Record an object write, charging only the size difference on overwrite"""
+    kind, image_id = classify_key(key)
+    now = datetime.now(timezone.utc)
+    previous = await db.media_objects.find_one_and_update(
+        {'_id': key},
+        {
+            '$set': {
+                'size': size,
+                'kind': kind,
+                'image_id': image_id,
+                'user_id': (owner or {}).get('user_id'),
+                'project_id': (owner or {}).get('project_id'),
+                'last_accessed': now
+            },
+            '$setOnInsert': {'created_at': now}
+        },
+        upsert=True
+    )
+    if previous:
+        await _adjust_usage(previous, size - previous.get('size', 0), 0)
+        if reserved:
+            # The overwrite was charged to the previous owner; drop the reservation
+            await release_quota(owner, reserved)
+    else:
+        await _adjust_usage(owner, size, 1, reserved)
+
+
+async def record_delete(key: str):
+    doc = await db.media_objects.find_one_and_delete({'_id': key})
+    if doc:
+        await _adjust_usage(doc, -doc.get('size', 0), -1)
+
+
+def touch(key: str):
+    """Note an access for LRU ordering; flushed to Mongo in batches"""
+    _pending_access[key] = time.time()
+
+
+async def flush_access_times():
+    if not _pending_access:
+        return
+    pending = dict(_pending_access)
+    _pending_access.clear()
+    await db.media_objects.bulk_write(
+        [
+            UpdateOne({'_id': key}, {'$set': {'last_accessed': datetime.fromtimestamp(ts, tz=timezone.utc)}})
+            for key, ts in pending.items()
+        ],
+        ordered=False
+    )
+
+
+async def find_original(image_id: str) -> Optional[dict]:
+    return await db.media_objects.find_one({'image_id': image_id, 'kind': 'original'})
+
+
+class AccountedStorage(StorageBackend):
+    """Wraps a storage driver with quota checks and usage accounting"""
+
+    def __init__(self, backend: StorageBackend):
+        self.backend = backend
+
+    async def _before_write(self, key: str, size: int) -> int:
+        if classify_key(key)[0] == 'original':
+            return await reserve_quota(_current_owner.get(), size)
+        return 0
+
+    async def _after_write(self, key: str, size: int, reserved: int):
+        try:
+            await record_write(key, size, _current_owner.get(), reserved)
+        except Exception as e:
+            logger.error("Failed to record storage write for %s: %s", key, e)
+
+    async def _write(self, key: str, size: int, write):
+        reserved = await self._before_write(key, size)
+        try:
+            await write()
+        except BaseException:
+            await release_quota(_current_owner.get(), reserved)
+            raise
+        await self._after_write(key, size, reserved)
+        return key
+
+    async def put(self, key: str, data: bytes, content_type: str = 'application/octet-stream') -> str:
+        return await self._write(key, len(data), lambda: self.backend.put(key, data, content_type))
+
+    async def put_file(self, key: str, path: str, content_type: str = 'application/octet-stream') -> str:
+        size = os.path.getsize(path)
+        return await self._write(key, size, lambda: self.backend.put_file(key, path, content_type))
+
+    async def get(self, key: str) -> bytes:
+        touch(key)
+        return await self.backend.get(key)
+
+    async def stat(self, key: str) -> Optional[dict]:
+        return await self.backend.stat(key)
+
+    async def delete(self, key: str) -> bool:
+        existed = await self.backend.delete(key)
+        try:
+            await record_delete(key)
+        except Exception as e:
+            logger.error("Failed to record storage delete for %s: %s", key, e)
+        return existed
+
+    def public_url(self, key: str) -> str:
+        return self.backend.public_url(key)
+
+    async def signed_url(self, key: str, expires_in: int = 3600) -> str:
+        return await self.backend.signed_url(key, expires_in)
+
+
+async def delete_project_media(storage: StorageBackend, project_id: str, kinds: tuple = None) -> int:
+    """Delete every stored object (of kinds, if given) of a project and return how many were removed"""
+    count = 0
+    query = {'project_id': project_id}
+    if kinds:
+        query['kind'] = {'$in': list(kinds)}
+    async for doc in db.media_objects.find(query, {'_id': 1}):
+        await storage.delete(doc['_id'])
+        count += 1
+    return count
+
+
+async def _take_eviction_lease(lease_id: str) -> bool:
+    now = datetime.now(timezone.utc)
+    try:
+        await db.maintenance_leases.find_one_and_update(
+            {'_id': lease_id, '$or': [{'holder': _worker_id}, {'expires_at': {'$lt': now}}]},
+            {'$set': {'holder': _worker_id,
+                      'expires_at': now + timedelta(seconds=STORAGE_EVICTION_LEASE_SECONDS)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        # Held by another worker
+        return False
+
+
+async def _release_eviction_lease(lease_id: str):
+    await db.maintenance_leases.delete_one({'_id': lease_id, 'holder': _worker_id})
+
+
+async def evict_if_needed(storage: StorageBackend, root: str) -> int:
+    """
+    Evict derivatives and cached objects in LRU order while the volume holding
+    root is above the high-water mark
+    Skipped while another worker holds the volume's eviction lease
+
+    Returns:
+        int: Bytes freed
+    """
+    usage = await asyncio.to_thread(shutil.disk_usage, root)
+    if usage.used / usage.total < STORAGE_HIGH_WATER:
+        return 0
+
+    lease_id = f"storage_eviction:{socket.gethostname()}:{os.path.realpath(root)}"
+    if not await _take_eviction_lease(lease_id):
+        return 0
+    try:
+        return await _evict(storage, root)
+    finally:
+        await _release_eviction_lease(lease_id)
+
+
+async def _evict(storage: StorageBackend, root: str) -> int:
+    from services.image_derivatives import forget_manifest
+
+    # Measured again under the lease: the previous holder may have just freed enough
+    usage = await asyncio.to_thread(shutil.disk_usage, root)
+    if usage.used / usage.total < STORAGE_HIGH_WATER:
+        return 0
+
+    to_free = usage.used - usage.total * STORAGE_LOW_WATER
+    freed = 0
+    evicted_images = set()
+    cursor = db.media_objects.find({'kind': {'$in': list(EVICTABLE_KINDS)}}).sort('last_accessed', ASCENDING)
+    async for doc in cursor:
+        if freed >= to_free:
+            break
+        image_id = doc.get('image_id')
+        if image_id:
+            if image_id in evicted_images:
+                continue
+            # Drop an image's renditions and manifest together so the media
+            # endpoint knows to regenerate them
+            evicted_images.add(image_id)
+            forget_manifest(image_id)
+            async for derivative in db.media_objects.find({'image_id': image_id, 'kind': 'derivative'}):
+                await storage.delete(derivative['_id'])
+                freed += derivative.get('size', 0)
+        else:
+            await storage.delete(doc['_id'])
+            freed += doc.get('size', 0)
+
+    logger.warning("Storage above %.0f%% of volume; evicted %d bytes of derived/cached media",
+                   STORAGE_HIGH_WATER * 100, freed)
+    return freed
+
+
+async def run_maintenance(storage: StorageBackend, root: Optional[str], stop: asyncio.Event):
+    """Periodically flush access times and, for local storage, enforce the high-water mark"""
+    while not stop.is_set():
+        try:
+            await flush_access_times()
+            if root:
+                await evict_if_needed(storage, root)
+        except Exception as e:
+            logger.error("Storage maintenance failed: %s", e)
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=STORAGE_MAINTENANCE_INTERVAL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
@@ -0,0 +1,139 @@
+"""
+S3-compatible storage driver
+
+Works against AWS S3 or any S3-compatible service. For local development
+point it at MinIO:
+
+    docker run -p 9000:9000 minio/minio server /data
+    STORAGE_BACKEND=s3 STORAGE_S3_BUCKET=videoai STORAGE_S3_ENDPOINT_URL=http://localhost:9000
+    AWS_ACCESS_KEY_ID=minioadmin AWS_SECRET_ACCESS_KEY=minioadmin
+
+boto3 is blocking, so every call runs on a dedicated thread pool. Uploads and
+downloads go through boto3's transfer manager, which switches to multipart
+transfers above the configured threshold and moves parts concurrently.
+"""
+import asyncio
+import functools
+import io
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+from services.storage.base import StorageBackend
+from utils import tracing
+
+MB = 1024 * 1024
+
+
+class S3Storage(StorageBackend):
+    def __init__(
+        self,
+        bucket: str,
+        endpoint_url: Optional[str] = None,
+        region: Optional[str] = None,
+        public_base_url: Optional[str] = None,
+        max_workers: int = 16,
+        multipart_threshold_mb: int = 8,
+        multipart_chunksize_mb: int = 8,
+        max_concurrency: int = 8
+    ):
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url
+        self.public_base_url = public_base_url.rstrip('/') if public_base_url else None
+        self.client = boto3.client(
+            's3',
+            endpoint_url=endpoint_url,
+            region_name=region,
+            config=Config(
+                # Path-style addressing is what MinIO and most S3 stand-ins expect
+                s3={'addressing_style': 'path' if endpoint_url else 'auto'},
+                max_pool_connections=max_workers + max_concurrency,
+                retries={'max_attempts': 5, 'mode': 'adaptive'}
+            )
+        )
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_threshold_mb * MB,
+            multipart_chunksize=multipart_chunksize_mb * MB,
+            max_concurrency=max_concurrency,
+            use_threads=True
+        )
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='s3-storage')
+
+    async def _run(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+
+    async def put(self, key: str, data: bytes, content_type: str = 'application/octet-stream') -> str:
+        with tracing.span('storage.put', {'storage.backend': 's3', 'storage.key': key, 'storage.bytes': len(data)}):
+            await self._run(
+                self.client.upload_fileobj,
+                io.BytesIO(data), self.bucket, key,
+                ExtraArgs={'ContentType': content_type},
+                Config=self.transfer_config
+            )
+        return key
+
+    async def put_file(self, key: str, path: str, content_type: str = 'application/octet-stream') -> str:
+        with tracing.span('storage.put_file', {'storage.backend': 's3', 'storage.key': key}):
+            await self._run(
+                self.client.upload_file,
+                path, self.bucket, key,
+                ExtraArgs={'ContentType': content_type},
+                Config=self.transfer_config
+            )
+        return key
+
+    def _get(self, key: str) -> bytes:
+        buffer = io.BytesIO()
+        try:
+            self.client.download_fileobj(self.bucket, key, buffer, Config=self.transfer_config)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey'):
+                raise FileNotFoundError(key)
+            raise
+        return buffer.getvalue()
+
+    async def get(self, key: str) -> bytes:
+        return await self._run(self._get, key)
+
+    def _stat(self, key: str) -> Optional[dict]:
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+        return {
+            'key': key,
+            'size': head['ContentLength'],
+            'content_type': head.get('ContentType', 'application/octet-stream'),
+            'etag': head['ETag'].strip('"'),
+            'last_modified': head['LastModified']
+        }
+
+    async def stat(self, key: str) -> Optional[dict]:
+        return await self._run(self._stat, key)
+
+    async def delete(self, key: str) -> bool:
+        existed = await self.stat(key) is not None
+        await self._run(self.client.delete_object, Bucket=self.bucket, Key=key)
+        return existed
+
+    def public_url(self, key: str) -> str:
+        if self.public_base_url:
+            return f"{self.public_base_url}/{key}"
+        if self.endpoint_url:
+            return f"{self.endpoint_url.rstrip('/')}/{self.bucket}/{key}"
+        return f"https://{self.bucket}.s3.amazonaws.com/{key}"
+
+    async def signed_url(self, key: str, expires_in: int = 3600) -> str:
+        return await self._run(
+            self.client.generate_presigned_url,
+            'get_object',
+            Params={'Bucket': self.bucket, 'Key': key},
+            ExpiresIn=expires_in
+        )
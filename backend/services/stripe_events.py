@@ -0,0 +1,265 @@
+"""
+Queued processing of Stripe webhook events
+
+The webhook route only verifies an event and stores it in the stripe_events
+collection (unique on event_id), so Stripe gets its 200 straight away and
+redeliveries are deduplicated. A background consumer claims pending events
+oldest-first and applies the subscription change to the users collection,
+retrying with exponential backoff.
+
+Every user update is guarded by the Stripe event's `created` timestamp, so
+replaying an event, or applying an older one after a newer one, never moves
+a user back to a stale plan.
+"""
+import asyncio
+import logging
+import os
+import random
+from datetime import datetime, timedelta, timezone
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
+DB_NAME = os.getenv("DB_NAME", "test_database")
+client = AsyncIOMotorClient(MONGO_URL)
+db = client[DB_NAME]
+
+STRIPE_EVENT_MAX_ATTEMPTS = int(os.getenv('STRIPE_EVENT_MAX_ATTEMPTS', 8))
+STRIPE_EVENT_POLL_SECONDS = float(os.getenv('STRIPE_EVENT_POLL_SECONDS', 5))
+STRIPE_EVENT_LEASE_SECONDS = float(os.getenv('STRIPE_EVENT_LEASE_SECONDS', 60))
+STRIPE_EVENT_BACKOFF_BASE_SECONDS = float(os.getenv('STRIPE_EVENT_BACKOFF_BASE_SECONDS', 2))
+STRIPE_EVENT_BACKOFF_MAX_SECONDS = float(os.getenv('STRIPE_EVENT_BACKOFF_MAX_SECONDS', 600))
+
+# Subscription statuses after which the user drops back to the free plan
+INACTIVE_SUBSCRIPTION_STATUSES = {'canceled', 'unpaid', 'incomplete_expired'}
+
+_wakeup = asyncio.Event()
+
+
+async def ensure_indexes():
+    """Create the indexes the queue relies on"""
+    await db.stripe_events.create_index('event_id', unique=True)
+    await db.stripe_events.create_index([('status', ASCENDING), ('created', ASCENDING)])
+
+
+async def enqueue_event(event: dict) -> bool:
+    """
+    Store a verified Stripe event for background processing
+
+    Returns:
+        bool: False if the event was already stored (a Stripe redelivery)
+    """
+    now = datetime.now(timezone.utc)
+    try:
+        await db.stripe_events.insert_one({
+            'event_id': event['id'],
+            'type': event['type'],
+            'created': event.get('created', 0),
+            'payload': event,
+            'status': 'pending',
+            'attempts': 0,
+            'next_attempt_at': now,
+            'received_at': now,
+            'last_error': None
+        })
+    except DuplicateKeyError:
+        return False
+
+    _wakeup.set()
+    return True
+
+
+async def _claim_next_event():
+    """Lease the oldest event that is due, including events whose lease expired"""
+    now = datetime.now(timezone.utc)
+    return await db.stripe_events.find_one_and_update(
+        {
+            '$or': [
+                {'status': 'pending', 'next_attempt_at': {'$lte': now}},
+                {'status': 'processing', 'locked_until': {'$lt': now}}
+            ]
+        },
+        {
+            '$set': {
+                'status': 'processing',
+                'locked_until': now + timedelta(seconds=STRIPE_EVENT_LEASE_SECONDS)
+            },
+            '$inc': {'attempts': 1}
+        },
+        sort=[('created', ASCENDING), ('received_at', ASCENDING)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+async def _update_user(user_filter: dict, changes: dict, event_created: int) -> str:
+    """
+    Apply changes to one user unless a newer Stripe event was already applied
+    """
+    now = datetime.now(timezone.utc)
+    result = await db.users.update_one(
+        {
+            **user_filter,
+            '$or': [
+                {'stripe_event_created': {'$exists': False}},
+                {'stripe_event_created': {'$lte': event_created}}
+            ]
+        },
+        {
+            '$set': {
+                **changes,
+                'stripe_event_created': event_created,
+                'updated_at': now.isoformat()
+            }
+        }
+    )
+    if result.matched_count:
+        return 'applied'
+    if await db.users.count_documents(user_filter, limit=1):
+        return 'stale'
+    return 'no_user'
+
+
+async def _handle_checkout_completed(session: dict, event_created: int) -> str:
+    metadata = session.get('metadata') or {}
+    plan = metadata.get('plan')
+    email = (session.get('customer_details') or {}).get('email') or session.get('customer_email')
+    if not plan or not email:
+        return 'ignored'
+
+    return await _update_user(
+        {'email': email},
+        {
+            'subscription_plan': plan,
+            'billing_period': metadata.get('billing'),
+            'subscription_status': 'active',
+            'stripe_customer_id': session.get('customer'),
+            'stripe_subscription_id': session.get('subscription')
+        },
+        event_created
+    )
+
+
+async def _handle_subscription_updated(subscription: dict, event_created: int) -> str:
+    status = subscription.get('status')
+    changes = {'subscription_status': status}
+    if status in INACTIVE_SUBSCRIPTION_STATUSES:
+        changes['subscription_plan'] = 'free'
+    elif (subscription.get('metadata') or {}).get('plan'):
+        changes['subscription_plan'] = subscription['metadata']['plan']
+
+    return await _update_user(
+        {'stripe_subscription_id': subscription['id']},
+        changes,
+        event_created
+    )
+
+
+async def _handle_subscription_deleted(subscription: dict, event_created: int) -> str:
+    return await _update_user(
+        {'stripe_subscription_id': subscription['id']},
+        {'subscription_plan': 'free', 'subscription_status': 'canceled'},
+        event_created
+    )
+
+
+async def _handle_payment_intent_succeeded(payment_intent: dict, event_created: int) -> str:
+    plan = (payment_intent.get('metadata') or {}).get('plan')
+    email = payment_intent.get('receipt_email')
+    if not plan or not email:
+        return 'ignored'
+
+    return await _update_user(
+        {'email': email},
+        {'subscription_plan': plan, 'subscription_status': 'active'},
+        event_created
+    )
+
+
+EVENT_HANDLERS = {
+    'checkout.session.completed': _handle_checkout_completed,
+    'customer.subscription.updated': _handle_subscription_updated,
+    'customer.subscription.deleted': _handle_subscription_deleted,
+    'payment_intent.succeeded': _handle_payment_intent_succeeded,
+}
+
+
+async def process_event(doc: dict):
+    """Apply one claimed event and record the outcome"""
+    handler = EVENT_HANDLERS.get(doc['type'])
+    try:
+        outcome = 'ignored'
+        if handler:
+            outcome = await handler(doc['payload']['data']['object'], doc.get('created', 0))
+    except Exception as e:
+        await _schedule_retry(doc, e)
+        return
+
+    await db.stripe_events.update_one(
+        {'_id': doc['_id']},
+        {
+            '$set': {
+                'status': 'done',
+                'outcome': outcome,
+                'processed_at': datetime.now(timezone.utc),
+                'last_error': None
+            },
+            '$unset': {'locked_until': ''}
+        }
+    )
+    logger.info('Stripe event %s (%s): %s', doc['event_id'], doc['type'], outcome)
+
+
+async def _schedule_retry(doc: dict, error: Exception):
+    attempts = doc.get('attempts', 1)
+    if attempts >= STRIPE_EVENT_MAX_ATTEMPTS:
+        update = {'status': 'failed', 'last_error': str(error)}
+        logger.error('Stripe event %s failed permanently: %s', doc['event_id'], error)
+    else:
+        delay = min(STRIPE_EVENT_BACKOFF_MAX_SECONDS, STRIPE_EVENT_BACKOFF_BASE_SECONDS * 2 ** (attempts - 1))
+        delay = random.uniform(delay / 2, delay)
+        update = {
+            'status': 'pending',
+            'last_error': str(error),
+            'next_attempt_at': datetime.now(timezone.utc) + timedelta(seconds=delay)
+        }
+        logger.warning('Stripe event %s attempt %d failed, retrying in %.1fs: %s',
+                       doc['event_id'], attempts, delay, error)
+
+    await db.stripe_events.update_one(
+        {'_id': doc['_id']},
+        {'$set': update, '$unset': {'locked_until': ''}}
+    )
+
+
+async def run_consumer(stop: asyncio.Event):
+    """
+    Drain the event queue until stop is set
+
+    Waits for a new-event signal from this process, or polls every
+    STRIPE_EVENT_POLL_SECONDS to pick up events stored by other workers and
+    retries that have come due.
+    """
+    while not stop.is_set():
+        try:
+            doc = await _claim_next_event()
+        except Exception as e:
+            logger.error('Failed to claim Stripe event: %s', e)
+            doc = None
+
+        if doc:
+            try:
+                await process_event(doc)
+                continue
+            except Exception:
+                # Recording the outcome failed; the lease lapses and the event is claimed again
+                logger.exception('Failed to process Stripe event %s', doc.get('event_id'))
+
+        _wakeup.clear()
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=STRIPE_EVENT_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
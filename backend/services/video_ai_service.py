@@ -1,14 +1,76 @@
-from openai import OpenAI
+import asyncio
+import hashlib
+import json
 import os
 from dotenv import load_dotenv
-import requests
+import logging
+
+from services.resilience import outbound_call
+from services.storage import get_storage
+from services.storage.quota import touch
+from utils import metrics
+from utils.single_flight import SingleFlight
 
 load_dotenv()
 
-client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+# Shared by every request in the worker: one connection pool to the API
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL') or None
+OPENAI_MAX_CONNECTIONS = int(os.getenv('OPENAI_MAX_CONNECTIONS', 100))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('OPENAI_MAX_KEEPALIVE_CONNECTIONS', 20))
+OPENAI_CONNECT_TIMEOUT_SECONDS = float(os.getenv('OPENAI_CONNECT_TIMEOUT_SECONDS', 5))
+OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', 2))
+SCRIPT_TIMEOUT_SECONDS = float(os.getenv('SCRIPT_TIMEOUT_SECONDS', 60))
+VOICEOVER_TIMEOUT_SECONDS = float(os.getenv('VOICEOVER_TIMEOUT_SECONDS', 120))
+TTS_MODEL = os.getenv('TTS_MODEL', 'tts-1')
+TTS_CONCURRENCY = int(os.getenv('TTS_CONCURRENCY', 4))
+
+_client = None
+_tts_semaphore = None
+# Identical calls in flight at the same time share one request
+_script_calls = SingleFlight('openai_chat')
+_tts_calls = SingleFlight('openai_tts')
+
+def get_openai_client():
+    """
+    Create the async OpenAI client on first use; the SDK is slow to import
+
+    Calls are awaited, so a slow completion only holds its own coroutine
+    (and one pooled connection), never the worker's event loop.
+    """
+    global _client
+    if _client is None:
+        import httpx
+        from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+        _client = AsyncOpenAI(
+            api_key=os.getenv('OPENAI_API_KEY'),
+            base_url=OPENAI_BASE_URL,
+            max_retries=OPENAI_MAX_RETRIES,
+            http_client=DefaultAsyncHttpxClient(
+                timeout=httpx.Timeout(SCRIPT_TIMEOUT_SECONDS, connect=OPENAI_CONNECT_TIMEOUT_SECONDS),
+                limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS
+                )
+            )
+        )
+        # The SDK imports resource modules on first access; do it here, where
+        # the start-up warm-up runs it on a thread, not in the first request
+        _client.chat.completions, _client.audio.speech
+    return _client
+
+async def close_openai_client():
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+logger = logging.getLogger(__name__)
 
 async def generate_script(prompt: str, video_length: str = "short") -> dict:
     """Generate video script using OpenAI GPT-4"""
+    return await _script_calls.do((prompt, video_length), lambda: _generate_script(prompt, video_length))
+
+async def _generate_script(prompt: str, video_length: str) -> dict:
     try:
         word_count = {
             "short": "100-150",
@@ -26,15 +88,19 @@ async def generate_script(prompt: str, video_length: str = "short") -> dict:
         - Word count: {word_count} words
         """
         
-        response = client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"Create a video script about: {prompt}"}
-            ],
-            temperature=0.7,
-            max_tokens=1500
-        )
+        # Cancelling the awaiting task (client gone, shutdown) aborts the
+        # request and returns its connection to the pool
+        async with outbound_call('openai_chat'):
+            response = await get_openai_client().chat.completions.create(
+                model="gpt-4",
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": f"Create a video script about: {prompt}"}
+                ],
+                temperature=0.7,
+                max_tokens=1500,
+                timeout=SCRIPT_TIMEOUT_SECONDS
+            )
         
         script_text = response.choices[0].message.content
         
@@ -80,77 +146,95 @@ def parse_script_into_scenes(script_text: str) -> list:
     
     return scenes[:10]  # Limit to 10 scenes
 
-async def search_stock_footage(query: str, count: int = 5) -> list:
-    """Search for stock videos/images from Pexels"""
-    pexels_api_key = os.getenv('PEXELS_API_KEY')
-    
-    if not pexels_api_key or pexels_api_key == 'your_pexels_api_key_here':
-        # Return placeholder images if no API key
-        return [
-            {
-                'type': 'image',
-                'url': 'https://images.unsplash.com/photo-1559860199-52dc7841bf5c',
-                'thumbnail': 'https://images.unsplash.com/photo-1559860199-52dc7841bf5c?w=400',
-                'source': 'unsplash'
-            }
-            for _ in range(count)
-        ]
-    
+def voiceover_segment_key(text: str, voice: str, model: str = TTS_MODEL) -> str:
+    """Storage key for a narration segment; stable across processes and restarts"""
+    digest = hashlib.sha256(json.dumps([model, voice, text]).encode()).hexdigest()
+    return f"cache/tts/{digest}.mp3"
+
+def _strip_id3(data: bytes) -> bytes:
+    """Drop a leading ID3v2 tag so segments concatenate into one MP3 stream"""
+    if len(data) < 10 or data[:3] != b'ID3':
+        return data
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    footer = 10 if data[5] & 0x10 else 0
+    return data[10 + size + footer:]
+
+async def synthesize_segment(text: str, voice: str = "alloy") -> dict:
+    """
+    Return the stored narration for text, calling TTS only on a cache miss
+
+    Returns:
+        dict: key of the segment in storage and whether it was already cached
+    """
+    storage = get_storage()
+    key = voiceover_segment_key(text, voice)
+    if await storage.stat(key) is not None:
+        metrics.inc('tts_segment_cache_total', {'result': 'hit'})
+        # stat() is not an access; without this, segments in use look cold to eviction
+        touch(key)
+        return {'key': key, 'cached': True}
+
+    metrics.inc('tts_segment_cache_total', {'result': 'miss'})
+    await _tts_calls.do(key, lambda: _synthesize(key, text, voice))
+    return {'key': key, 'cached': False}
+
+async def _synthesize(key: str, text: str, voice: str):
+    global _tts_semaphore
+    if _tts_semaphore is None:
+        _tts_semaphore = asyncio.Semaphore(TTS_CONCURRENCY)
+    async with _tts_semaphore:
+        async with outbound_call('openai_tts'):
+            response = await get_openai_client().audio.speech.create(
+                model=TTS_MODEL,
+                voice=voice,  # alloy, echo, fable, onyx, nova, shimmer
+                input=text,
+                timeout=VOICEOVER_TIMEOUT_SECONDS
+            )
+    await get_storage().put(key, response.content, 'audio/mpeg')
+
+async def _read_segment(storage, key: str, text: str, voice: str) -> bytes:
+    """A segment's audio, synthesized again if it was evicted since it was found"""
     try:
-        # Search for videos
-        headers = {'Authorization': pexels_api_key}
-        response = requests.get(
-            f'https://api.pexels.com/videos/search',
-            headers=headers,
-            params={'query': query, 'per_page': count}
-        )
-        
-        if response.status_code == 200:
-            data = response.json()
-            videos = []
-            
-            for video in data.get('videos', [])[:count]:
-                video_files = video.get('video_files', [])
-                if video_files:
-                    videos.append({
-                        'type': 'video',
-                        'url': video_files[0]['link'],
-                        'thumbnail': video.get('image'),
-                        'source': 'pexels'
-                    })
-            
-            return videos
-        
-    except Exception as e:
-        print(f"Error fetching stock footage: {e}")
-    
-    # Fallback to placeholder
-    return [{
-        'type': 'image',
-        'url': 'https://images.unsplash.com/photo-1559860199-52dc7841bf5c',
-        'thumbnail': 'https://images.unsplash.com/photo-1559860199-52dc7841bf5c?w=400',
-        'source': 'unsplash'
-    }]
-
-async def generate_voiceover(text: str, voice: str = "alloy") -> dict:
-    """Generate AI voiceover using OpenAI TTS"""
+        return await storage.get(key)
+    except FileNotFoundError:
+        logger.warning("Narration segment %s was evicted before stitching; synthesizing it again", key)
+        await _tts_calls.do(key, lambda: _synthesize(key, text, voice))
+        return await storage.get(key)
+
+async def generate_voiceover(texts: list, voice: str = "alloy", video_id: str = None) -> dict:
+    """
+    Generate AI voiceover using OpenAI TTS, one segment per scene
+
+    Segments are synthesized concurrently and cached by (text, voice, model),
+    so regenerating a video after editing one scene costs one TTS call. The
+    stitched track is stored under the video (user data, charged to the
+    storage owner's quota), keyed by its segments and rebuilt only when they
+    change; the caller deletes the track it replaces.
+    """
     try:
-        response = client.audio.speech.create(
-            model="tts-1",
-            voice=voice,  # alloy, echo, fable, onyx, nova, shimmer
-            input=text
-        )
-        
-        # Save audio file
-        audio_filename = f"voiceover_{hash(text)}.mp3"
-        audio_path = f"/tmp/{audio_filename}"
+        segment_keys = [voiceover_segment_key(text, voice) for text in texts]
+        # Repeated lines are synthesized once
+        unique = dict(zip(segment_keys, texts))
+        results = await asyncio.gather(*(synthesize_segment(text, voice) for text in unique.values()))
+        cached = {result['key']: result['cached'] for result in results}
         
-        response.stream_to_file(audio_path)
+        storage = get_storage()
+        track_digest = hashlib.sha256('\n'.join(segment_keys).encode()).hexdigest()
+        audio_filename = f"voiceover_{track_digest[:32]}.mp3"
+        track_key = f"audio/{video_id}/{audio_filename}" if video_id else f"audio/{audio_filename}"
+        if await storage.stat(track_key) is None:
+            segments = await asyncio.gather(*(_read_segment(storage, key, unique[key], voice) for key in segment_keys))
+            track = segments[0] + b''.join(_strip_id3(segment) for segment in segments[1:]) if segments else b''
+            await storage.put(track_key, track, 'audio/mpeg')
         
         return {
             'success': True,
-            'audio_path': audio_path,
-            'filename': audio_filename
+            'key': track_key,
+            'url': storage.public_url(track_key),
+            'filename': audio_filename,
+            'voice': voice,
+            'segments': [{'key': key, 'cached': cached[key]} for key in segment_keys],
+            'tts_calls': sum(1 for was_cached in cached.values() if not was_cached)
         }
     
     except Exception as e:
@@ -1,64 +1,27 @@
 import os
-import aiosmtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from utils.email_outbox import enqueue_email
 
-# Email configuration from environment variables
-SMTP_HOST = os.environ.get('SMTP_HOST', 'smtp.gmail.com')
-SMTP_PORT = int(os.environ.get('SMTP_PORT', 587))
-SMTP_USER = os.environ.get('SMTP_USER')
-SMTP_PASSWORD = os.environ.get('SMTP_PASSWORD')
-SMTP_FROM_EMAIL = os.environ.get('SMTP_FROM_EMAIL')
-SMTP_FROM_NAME = os.environ.get('SMTP_FROM_NAME', 'VideoAI')
 FRONTEND_URL = os.environ.get('FRONTEND_URL', 'http://localhost:3000')
 
 async def send_email(to_email: str, subject: str, html_content: str, text_content: str = None):
     """
-    Send an email using SMTP
+    Queue an email for delivery by the background outbox sender
     
     Args:
         to_email: Recipient email address
         subject: Email subject
         html_content: HTML content of the email
         text_content: Plain text fallback (optional)
-    """
-    if not SMTP_USER or not SMTP_PASSWORD:
-        raise Exception("Email configuration not set. Please configure SMTP settings.")
-    
-    # Create message
-    message = MIMEMultipart('alternative')
-    message['Subject'] = subject
-    message['From'] = f"{SMTP_FROM_NAME} <{SMTP_FROM_EMAIL}>"
-    message['To'] = to_email
-    
-    # Add plain text version
-    if text_content:
-        text_part = MIMEText(text_content, 'plain')
-        message.attach(text_part)
     
-    # Add HTML version
-    html_part = MIMEText(html_content, 'html')
-    message.attach(html_part)
-    
-    # Send email
-    try:
-        await aiosmtplib.send(
-            message,
-            hostname=SMTP_HOST,
-            port=SMTP_PORT,
-            username=SMTP_USER,
-            password=SMTP_PASSWORD,
-            start_tls=True
-        )
-        return True
-    except Exception as e:
-        print(f"Error sending email: {e}")
-        raise
+    Returns:
+        str: Outbox id of the queued email
+    """
+    return await enqueue_email(to_email, subject, html_content, text_content)
 
 
 async def send_password_reset_email(to_email: str, reset_token: str, user_name: str = None):
     """
-    Send password reset email with reset link
+    Queue password reset email with reset link
     
     Args:
         to_email: User's email address
@@ -204,7 +167,7 @@ async def send_password_reset_email(to_email: str, reset_token: str, user_name:
 
 async def send_password_changed_notification(to_email: str, user_name: str = None):
     """
-    Send notification email when password is successfully changed
+    Queue notification email when password is successfully changed
     
     Args:
         to_email: User's email address
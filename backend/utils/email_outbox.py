@@ -0,0 +1,399 @@
+"""
+Persistent email outbox with a pooled SMTP sender
+
+Request handlers call enqueue_email(), which only inserts into the
+email_outbox collection. OutboxSender drains that collection in the
+background over a small pool of already-authenticated SMTP connections,
+retrying transient failures with exponential backoff and staying under the
+provider's per-minute sending limit. That limit is one budget for all
+workers: a GCRA schedule in the email_send_rate collection, advanced with a
+guarded atomic update per message (SharedRateLimiter). If Mongo is
+unreachable each worker limits itself for SMTP_RATE_LIMIT_FALLBACK_SECONDS. Only a refused recipient fails a message
+for good; a sender-side problem (bad credentials, sender refused) fails every
+message alike, so those are retried every EMAIL_CONFIG_RETRY_SECONDS without
+using up attempts, and logged as errors until the configuration is fixed.
+
+To run against a local SMTP stand-in (e.g. `python -m aiosmtpd -n -l localhost:1025`):
+SMTP_HOST=localhost SMTP_PORT=1025 SMTP_START_TLS=false SMTP_AUTH=false
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+import aiosmtplib
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# Email configuration from environment variables
+SMTP_HOST = os.environ.get('SMTP_HOST', 'smtp.gmail.com')
+SMTP_PORT = int(os.environ.get('SMTP_PORT', 587))
+SMTP_USER = os.environ.get('SMTP_USER')
+SMTP_PASSWORD = os.environ.get('SMTP_PASSWORD')
+SMTP_FROM_EMAIL = os.environ.get('SMTP_FROM_EMAIL')
+SMTP_FROM_NAME = os.environ.get('SMTP_FROM_NAME', 'VideoAI')
+SMTP_START_TLS = os.environ.get('SMTP_START_TLS', 'true').lower() == 'true'
+SMTP_AUTH = os.environ.get('SMTP_AUTH', 'true').lower() == 'true'
+SMTP_TIMEOUT_SECONDS = float(os.environ.get('SMTP_TIMEOUT_SECONDS', 30))
+SMTP_POOL_SIZE = int(os.environ.get('SMTP_POOL_SIZE', 2))
+SMTP_MAX_PER_MINUTE = int(os.environ.get('SMTP_MAX_PER_MINUTE', 60))
+# mongo: SMTP_MAX_PER_MINUTE is shared by every worker and host; local: each worker gets it
+SMTP_RATE_LIMIT_BACKEND = os.environ.get('SMTP_RATE_LIMIT_BACKEND', 'mongo')
+SMTP_RATE_LIMIT_FALLBACK_SECONDS = float(os.environ.get('SMTP_RATE_LIMIT_FALLBACK_SECONDS', 30))
+
+EMAIL_MAX_ATTEMPTS = int(os.environ.get('EMAIL_MAX_ATTEMPTS', 6))
+EMAIL_BACKOFF_BASE_SECONDS = float(os.environ.get('EMAIL_BACKOFF_BASE_SECONDS', 5))
+EMAIL_BACKOFF_MAX_SECONDS = float(os.environ.get('EMAIL_BACKOFF_MAX_SECONDS', 900))
+EMAIL_POLL_SECONDS = float(os.environ.get('EMAIL_POLL_SECONDS', 5))
+EMAIL_LEASE_SECONDS = float(os.environ.get('EMAIL_LEASE_SECONDS', 120))
+EMAIL_CONFIG_RETRY_SECONDS = float(os.environ.get('EMAIL_CONFIG_RETRY_SECONDS', 300))
+
+# Replies to RCPT that reject the recipient itself (no such mailbox, not local, bad address)
+PERMANENT_RECIPIENT_CODES = (550, 551, 553)
+# Authentication required / too weak / credentials rejected: our setup, not the message
+SENDER_CONFIG_CODES = (530, 534, 535)
+
+MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
+DB_NAME = os.getenv("DB_NAME", "test_database")
+client = AsyncIOMotorClient(MONGO_URL)
+db = client[DB_NAME]
+
+_wakeup = asyncio.Event()
+
+
+class PermanentEmailError(Exception):
+    """The SMTP server rejected a message in a way retrying will not fix"""
+
+
+class SenderConfigError(Exception):
+    """Sending failed because of our SMTP credentials or sender setup; every message would fail"""
+
+
+async def ensure_indexes():
+    await db.email_outbox.create_index([('status', ASCENDING), ('next_attempt_at', ASCENDING)])
+
+
+async def enqueue_email(to_email: str, subject: str, html_content: str, text_content: str = None) -> str:
+    """
+    Queue an email for background delivery
+
+    Returns:
+        str: Outbox id of the queued message
+    """
+    if SMTP_AUTH and (not SMTP_USER or not SMTP_PASSWORD):
+        raise Exception("Email configuration not set. Please configure SMTP settings.")
+
+    now = datetime.now(timezone.utc)
+    email_id = str(uuid.uuid4())
+    await db.email_outbox.insert_one({
+        '_id': email_id,
+        'to': to_email,
+        'subject': subject,
+        'html': html_content,
+        'text': text_content,
+        'status': 'pending',
+        'attempts': 0,
+        'next_attempt_at': now,
+        'created_at': now,
+        'last_error': None
+    })
+    _wakeup.set()
+    return email_id
+
+
+def build_message(doc: dict) -> MIMEMultipart:
+    """Build the MIME message for an outbox document"""
+    message = MIMEMultipart('alternative')
+    message['Subject'] = doc['subject']
+    message['From'] = f"{SMTP_FROM_NAME} <{SMTP_FROM_EMAIL}>"
+    message['To'] = doc['to']
+
+    # Add plain text version
+    if doc.get('text'):
+        message.attach(MIMEText(doc['text'], 'plain'))
+
+    # Add HTML version
+    message.attach(MIMEText(doc['html'], 'html'))
+    return message
+
+
+class RateLimiter:
+    """Token bucket allowing `per_minute` sends per minute with a burst of the same size"""
+
+    def __init__(self, per_minute: int):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1, per_minute)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class SharedRateLimiter:
+    """
+    SMTP_MAX_PER_MINUTE across all workers, as a GCRA schedule in Mongo
+
+    The document holds the theoretical arrival time (tat) of the next send.
+    A send is allowed while tat is at most a burst's worth of intervals
+    ahead of now; the guarded update that checks this also advances tat by
+    one interval, so concurrent workers cannot overspend together.
+    """
+
+    def __init__(self, per_minute: int, key: str = None):
+        self.key = key or f"smtp:{SMTP_HOST}:{SMTP_USER or ''}"
+        self.interval = 60.0 / max(1, per_minute)
+        self.tolerance = (max(1, per_minute) - 1) * self.interval
+        self.local = RateLimiter(per_minute)
+        self.fallback_until = 0.0
+
+    async def _try_acquire_shared(self) -> float:
+        """0 if a send was allowed, else seconds until the next one may be"""
+        now = time.time()
+        try:
+            await db.email_send_rate.find_one_and_update(
+                {'_id': self.key, 'tat': {'$lte': now + self.tolerance}},
+                [{'$set': {'tat': {'$add': [{'$max': [{'$ifNull': ['$tat', now]}, now]}, self.interval]}}}],
+                upsert=True
+            )
+            return 0.0
+        except DuplicateKeyError:
+            # The document exists and the budget is spent
+            doc = await db.email_send_rate.find_one({'_id': self.key}, {'tat': 1})
+            return max(0.01, doc['tat'] - self.tolerance - now) if doc else 0.01
+
+    async def acquire(self):
+        while time.monotonic() >= self.fallback_until:
+            try:
+                wait = await self._try_acquire_shared()
+            except Exception as e:
+                logger.warning('Shared SMTP rate limit unavailable, limiting per worker for %.0fs: %s',
+                               SMTP_RATE_LIMIT_FALLBACK_SECONDS, e)
+                self.fallback_until = time.monotonic() + SMTP_RATE_LIMIT_FALLBACK_SECONDS
+                break
+            if not wait:
+                return
+            await asyncio.sleep(wait * random.uniform(1, 1.1))
+        await self.local.acquire()
+
+
+class SMTPPool:
+    """
+    A small pool of connected, authenticated SMTP sessions
+
+    Connections are opened lazily up to `size` and returned to the pool after
+    each message, so STARTTLS and AUTH happen once per connection rather than
+    once per email.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._idle = asyncio.Queue()
+        self._slots = asyncio.Semaphore(size)
+
+    async def _connect(self) -> aiosmtplib.SMTP:
+        smtp = aiosmtplib.SMTP(
+            hostname=SMTP_HOST,
+            port=SMTP_PORT,
+            start_tls=SMTP_START_TLS,
+            timeout=SMTP_TIMEOUT_SECONDS
+        )
+        await smtp.connect()
+        if SMTP_AUTH:
+            await smtp.login(SMTP_USER, SMTP_PASSWORD)
+        return smtp
+
+    async def send(self, message: MIMEMultipart):
+        async with self._slots:
+            smtp = None
+            while not self._idle.empty() and smtp is None:
+                candidate = self._idle.get_nowait()
+                if candidate.is_connected:
+                    smtp = candidate
+            if smtp is None:
+                smtp = await self._connect()
+
+            try:
+                try:
+                    await smtp.send_message(message)
+                except aiosmtplib.SMTPServerDisconnected:
+                    # The server dropped an idle connection; reconnect once
+                    smtp = await self._connect()
+                    await smtp.send_message(message)
+            except Exception:
+                await self._discard(smtp)
+                raise
+
+            self._idle.put_nowait(smtp)
+
+    async def _discard(self, smtp: aiosmtplib.SMTP):
+        try:
+            smtp.close()
+        except Exception:
+            pass
+
+    async def close(self):
+        while not self._idle.empty():
+            smtp = self._idle.get_nowait()
+            try:
+                await smtp.quit()
+            except Exception:
+                smtp.close()
+
+
+async def deliver(pool: SMTPPool, doc: dict):
+    """Send one outbox message, classifying SMTP errors as permanent or transient"""
+    try:
+        await pool.send(build_message(doc))
+    except aiosmtplib.SMTPRecipientsRefused as e:
+        # 4xx refusals (greylisting, mailbox busy) are worth retrying
+        if all(refused.code in PERMANENT_RECIPIENT_CODES for refused in e.recipients):
+            raise PermanentEmailError(str(e))
+        raise
+    except aiosmtplib.SMTPRecipientRefused as e:
+        if e.code in PERMANENT_RECIPIENT_CODES:
+            raise PermanentEmailError(f"{e.code} {e.message}")
+        raise
+    except (aiosmtplib.SMTPAuthenticationError, aiosmtplib.SMTPSenderRefused) as e:
+        raise SenderConfigError(f"{e.code} {e.message}")
+    except aiosmtplib.SMTPResponseException as e:
+        # Anything else (421/451 throttling, other 5xx) is retried up to EMAIL_MAX_ATTEMPTS
+        if e.code in SENDER_CONFIG_CODES:
+            raise SenderConfigError(f"{e.code} {e.message}")
+        raise
+
+
+class OutboxSender:
+    """Background sender draining email_outbox through an SMTPPool"""
+
+    def __init__(self, pool_size: int = SMTP_POOL_SIZE, max_per_minute: int = SMTP_MAX_PER_MINUTE):
+        self.pool = SMTPPool(pool_size)
+        self.rate_limiter = (SharedRateLimiter(max_per_minute) if SMTP_RATE_LIMIT_BACKEND == 'mongo'
+                             else RateLimiter(max_per_minute))
+        self._stop = asyncio.Event()
+        self._tasks = []
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.pool.size)]
+
+    async def stop(self):
+        self._stop.set()
+        _wakeup.set()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.pool.close()
+
+    async def _claim(self):
+        now = datetime.now(timezone.utc)
+        return await db.email_outbox.find_one_and_update(
+            {
+                '$or': [
+                    {'status': 'pending', 'next_attempt_at': {'$lte': now}},
+                    {'status': 'sending', 'locked_until': {'$lt': now}}
+                ]
+            },
+            {
+                '$set': {'status': 'sending', 'locked_until': now + timedelta(seconds=EMAIL_LEASE_SECONDS)},
+                '$inc': {'attempts': 1}
+            },
+            sort=[('next_attempt_at', ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _worker(self):
+        while not self._stop.is_set():
+            try:
+                doc = await self._claim()
+            except Exception as e:
+                logger.error('Failed to claim outbox email: %s', e)
+                doc = None
+
+            if doc is None:
+                _wakeup.clear()
+                try:
+                    await asyncio.wait_for(_wakeup.wait(), timeout=EMAIL_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self.rate_limiter.acquire()
+            try:
+                await deliver(self.pool, doc)
+            except Exception as e:
+                try:
+                    await self._record_failure(doc, e)
+                except Exception as record_error:
+                    # The lease lapses and the email is claimed again
+                    logger.error('Failed to record failure of email %s: %s', doc['_id'], record_error)
+                continue
+
+            try:
+                await db.email_outbox.update_one(
+                    {'_id': doc['_id']},
+                    {
+                        '$set': {'status': 'sent', 'sent_at': datetime.now(timezone.utc), 'last_error': None},
+                        '$unset': {'locked_until': ''}
+                    }
+                )
+            except Exception as e:
+                # Delivery is at least once: the email is sent again when its lease lapses
+                logger.error('Failed to mark email %s sent: %s', doc['_id'], e)
+
+    async def _record_failure(self, doc: dict, error: Exception):
+        attempts = doc.get('attempts', 1)
+        if isinstance(error, SenderConfigError):
+            # Not the message's fault: try again later without using up an attempt
+            metrics.inc('email_sender_config_errors_total')
+            logger.error('SMTP sender configuration rejected (email %s held, retrying in %.0fs): %s',
+                         doc['_id'], EMAIL_CONFIG_RETRY_SECONDS, error)
+            await db.email_outbox.update_one(
+                {'_id': doc['_id']},
+                {
+                    '$set': {
+                        'status': 'pending',
+                        'last_error': str(error),
+                        'next_attempt_at': datetime.now(timezone.utc) + timedelta(seconds=EMAIL_CONFIG_RETRY_SECONDS)
+                    },
+                    '$inc': {'attempts': -1},
+                    '$unset': {'locked_until': ''}
+                }
+            )
+            return
+
+        if isinstance(error, PermanentEmailError) or attempts >= EMAIL_MAX_ATTEMPTS:
+            update = {'status': 'failed', 'last_error': str(error)}
+            logger.error('Email %s to %s failed permanently: %s', doc['_id'], doc['to'], error)
+        else:
+            delay = min(EMAIL_BACKOFF_MAX_SECONDS, EMAIL_BACKOFF_BASE_SECONDS * 2 ** (attempts - 1))
+            delay = random.uniform(delay / 2, delay)
+            update = {
+                'status': 'pending',
+                'last_error': str(error),
+                'next_attempt_at': datetime.now(timezone.utc) + timedelta(seconds=delay)
+            }
+            logger.warning('Email %s attempt %d failed, retrying in %.0fs: %s', doc['_id'], attempts, delay, error)
+
+        await db.email_outbox.update_one(
+            {'_id': doc['_id']},
+            {'$set': update, '$unset': {'locked_until': ''}}
+        )
@@ -0,0 +1,65 @@
+"""
+Per-route HTTP latency metrics
+
+A plain ASGI middleware (no BaseHTTPMiddleware, so responses keep streaming)
+that records http_request_duration_seconds and http_requests_total labelled
+by method, route template and status code. Using the template
+(/api/video/projects/{project_id}) rather than the raw path keeps the number
+of series bounded.
+"""
+import time
+
+from utils import metrics
+
+UNMATCHED_ROUTE = 'unmatched'
+
+
+def _route_template(scope) -> str:
+    route = scope.get('route')
+    if route is not None:
+        return route.path
+    # Mounted apps (e.g. /static) only leave their mount prefix behind
+    if scope.get('root_path'):
+        return f"{scope['root_path']}/{{path}}"
+    return UNMATCHED_ROUTE
+
+
+class HTTPMetricsMiddleware:
+    def __init__(self, app, skip_paths: tuple = ('/metrics',)):
+        self.app = app
+        self.skip_paths = skip_paths
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+
+        status = {'code': 500}
+        start = time.perf_counter()
+        recorded = False
+
+        def record():
+            nonlocal recorded
+            if recorded:
+                return
+            recorded = True
+            labels = {
+                'method': scope['method'],
+                'route': _route_template(scope),
+                'status': str(status['code'])
+            }
+            metrics.observe('http_request_duration_seconds', time.perf_counter() - start, labels)
+            metrics.inc('http_requests_total', labels)
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                status['code'] = message['status']
+            await send(message)
+            # Stop the clock once the body is sent; background tasks run later
+            if message['type'] == 'http.response.body' and not message.get('more_body', False):
+                record()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            record()
@@ -0,0 +1,197 @@
+"""
+Structured, non-blocking logging
+
+setup_logging() routes every logger (uvicorn's included) through a
+QueueHandler: the calling coroutine only enqueues the record, and a
+listener thread formats it and writes to stdout. Records become one JSON
+object per line (LOG_FORMAT=json, the default) carrying the correlation ids
+of the request and background job that produced them.
+
+    LOG_LEVEL=INFO
+    LOG_LEVELS=services.image_ingest=DEBUG,pymongo=WARNING   per-logger levels
+    LOG_SUCCESS_SAMPLE_RATE=0.1                               see SAMPLED
+
+Routine success messages pass extra=SAMPLED so only a fraction of them are
+kept; warnings and errors are never sampled.
+"""
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import uuid
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+
+from utils.tracing import current_trace_id
+
+load_dotenv()
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_LEVELS = os.getenv('LOG_LEVELS', '')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json').lower()
+LOG_SUCCESS_SAMPLE_RATE = float(os.getenv('LOG_SUCCESS_SAMPLE_RATE', 0.1))
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+
+# Pass as extra= on high-volume success messages to sample them
+SAMPLED = {'sampled': True}
+
+request_id_var = contextvars.ContextVar('request_id', default=None)
+job_id_var = contextvars.ContextVar('job_id', default=None)
+
+# Attributes every LogRecord has; anything else came from extra=
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+_listener = None
+
+
+def bind_job(job_id: str):
+    """Tag log records from the current context (and tasks it spawns) with a job id"""
+    job_id_var.set(job_id)
+
+
+class ContextFilter(logging.Filter):
+    """
+    Adds correlation ids and applies success-message sampling
+
+    Runs in the logging thread of the caller, where the context variables
+    of the request or job are visible.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, 'sampled', False) and record.levelno < logging.WARNING:
+            if random.random() >= LOG_SUCCESS_SAMPLE_RATE:
+                return False
+            record.sample_rate = LOG_SUCCESS_SAMPLE_RATE
+        record.request_id = request_id_var.get()
+        record.job_id = job_id_var.get()
+        record.trace_id = current_trace_id()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'pid': record.process,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and key != 'sampled' and value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Enqueues records without blocking; if the writer falls behind and the
+    queue is full, the record is dropped rather than stalling the event loop
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Resolve the message and traceback now, keeping extra fields intact
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+def _apply_levels():
+    logging.getLogger().setLevel(LOG_LEVEL)
+    for item in filter(None, LOG_LEVELS.split(',')):
+        name, _, level = item.partition('=')
+        logging.getLogger(name.strip()).setLevel(level.strip().upper())
+
+
+def setup_logging():
+    """Install the queue handler and listener thread; safe to call more than once"""
+    global _listener
+    if _listener is not None:
+        return
+
+    if LOG_FORMAT == 'json':
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s %(job_id)s] %(message)s')
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    _apply_levels()
+
+    # Send uvicorn's error and access logs through the same pipeline
+    for name in ('uvicorn', 'uvicorn.error', 'uvicorn.access'):
+        uvicorn_logger = logging.getLogger(name)
+        uvicorn_logger.handlers = []
+        uvicorn_logger.propagate = True
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging():
+    """Flush queued records; call on process shutdown"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class RequestIdMiddleware:
+    """
+    Plain ASGI middleware giving every request a correlation id
+
+    Reuses an incoming X-Request-ID (from a proxy or the frontend) or makes
+    one, exposes it to log records and echoes it in the response.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for key, value in scope['headers']:
+            if key == b'x-request-id':
+                request_id = value.decode('latin-1')[:128]
+                break
+        request_id = request_id or uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                message['headers'] = list(message.get('headers', [])) + [(b'x-request-id', request_id.encode('latin-1'))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_id_var.reset(token)
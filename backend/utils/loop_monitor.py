@@ -0,0 +1,200 @@
+"""
+Event-loop lag monitor and blocking-call profiler
+
+A heartbeat task sleeps for LOOP_MONITOR_INTERVAL_MS and measures how late
+it wakes up; that lateness is the event-loop lag (event_loop_lag_seconds).
+A watchdog thread notices when the heartbeat is overdue by more than
+LOOP_MONITOR_THRESHOLD_MS, i.e. some coroutine is running synchronous code,
+and captures the loop thread's stack while it is still blocked. Stalls are
+grouped by where they happened (the innermost application frames) so the
+report lists the worst offenders by total blocked time.
+
+Cost while enabled: one timer wake-up per interval on the loop and one
+thread wake-up per threshold/4; stacks are only walked during a stall.
+It can be switched on, off and re-tuned at runtime (see routes/debug_routes.py).
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Optional
+
+from utils import metrics
+
+LOOP_MONITOR_ENABLED = os.getenv('LOOP_MONITOR_ENABLED', 'false').lower() == 'true'
+LOOP_MONITOR_THRESHOLD_MS = float(os.getenv('LOOP_MONITOR_THRESHOLD_MS', 100))
+LOOP_MONITOR_INTERVAL_MS = float(os.getenv('LOOP_MONITOR_INTERVAL_MS', 50))
+LOOP_MONITOR_MAX_OFFENDERS = int(os.getenv('LOOP_MONITOR_MAX_OFFENDERS', 200))
+
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SIGNATURE_FRAMES = 3
+LAG_WINDOW = 1200
+
+
+def _is_app_frame(filename: str) -> bool:
+    return filename.startswith(APP_ROOT) and 'site-packages' not in filename
+
+
+def _signature(stack: traceback.StackSummary) -> tuple:
+    """
+    Identify a stall by the innermost application frames plus the frame
+    that was actually executing (often inside a library, e.g. bcrypt)
+    """
+    app_frames = [f for f in stack if _is_app_frame(f.filename)][-SIGNATURE_FRAMES:]
+    innermost = stack[-1] if stack else None
+    frames = app_frames + ([innermost] if innermost is not None and innermost not in app_frames else [])
+    return tuple(f"{os.path.relpath(f.filename, APP_ROOT) if _is_app_frame(f.filename) else f.filename}:{f.lineno} {f.name}"
+                 for f in frames)
+
+
+class LoopMonitor:
+    def __init__(self, threshold_ms: float = LOOP_MONITOR_THRESHOLD_MS, interval_ms: float = LOOP_MONITOR_INTERVAL_MS):
+        self.threshold = threshold_ms / 1000
+        self.interval = interval_ms / 1000
+        self.enabled = False
+        self._loop = None
+        self._loop_thread_id = None
+        self._heartbeat_task = None
+        self._watchdog = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._last_beat = time.monotonic()
+        self._pending = None
+        self._lags = deque(maxlen=LAG_WINDOW)
+        self._offenders = {}
+        self.stalls = 0
+
+    def start(self):
+        """Start monitoring the running event loop; call from a coroutine on that loop"""
+        if self.enabled:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        # A fresh event per run so a previous watchdog thread cannot resume
+        self._stop = threading.Event()
+        self.enabled = True
+        self._heartbeat_task = self._loop.create_task(self._heartbeat())
+        self._watchdog = threading.Thread(target=self._watch, args=(self._stop,), name='loop-monitor', daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        self._stop.set()
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+
+    def configure(self, threshold_ms: Optional[float] = None, interval_ms: Optional[float] = None):
+        if threshold_ms is not None:
+            self.threshold = threshold_ms / 1000
+        if interval_ms is not None:
+            self.interval = interval_ms / 1000
+
+    def reset(self):
+        with self._lock:
+            self._offenders.clear()
+            self._lags.clear()
+            self.stalls = 0
+
+    async def _heartbeat(self):
+        while self.enabled:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            self._last_beat = now
+            self._lags.append(lag)
+            metrics.observe('event_loop_lag_seconds', lag)
+            if lag >= self.threshold:
+                self._record_stall(lag)
+            elif self._pending is not None:
+                # The watchdog fired but the beat came in under threshold
+                with self._lock:
+                    self._pending = None
+
+    def _watch(self, stop: threading.Event):
+        while not stop.wait(max(self.threshold / 4, 0.005)):
+            overdue = time.monotonic() - self._last_beat - self.interval
+            if overdue < self.threshold:
+                continue
+            with self._lock:
+                if self._pending is not None and self._pending['beat'] == self._last_beat:
+                    continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame)
+            task = asyncio.current_task(self._loop)
+            with self._lock:
+                self._pending = {
+                    'beat': self._last_beat,
+                    'stack': stack,
+                    'task': task.get_name() if task is not None else None
+                }
+
+    def _record_stall(self, lag: float):
+        """Called on the loop once a stall is over, with its measured length"""
+        with self._lock:
+            pending, self._pending = self._pending, None
+            self.stalls += 1
+            metrics.inc('event_loop_stalls_total')
+            if pending is None:
+                # Over before the watchdog looked (just past the threshold)
+                key, stack, task = ('<not captured>',), None, None
+            else:
+                key, stack, task = _signature(pending['stack']), pending['stack'], pending['task']
+
+            offender = self._offenders.get(key)
+            if offender is None:
+                if len(self._offenders) >= LOOP_MONITOR_MAX_OFFENDERS:
+                    key = ('<other>',)
+                    offender = self._offenders.get(key)
+                if offender is None:
+                    offender = self._offenders[key] = {
+                        'location': list(key),
+                        'count': 0,
+                        'total_seconds': 0.0,
+                        'max_seconds': 0.0,
+                        'task': task,
+                        'stack': traceback.format_list(stack[-12:]) if stack else []
+                    }
+            offender['count'] += 1
+            offender['total_seconds'] += lag
+            offender['max_seconds'] = max(offender['max_seconds'], lag)
+
+    def report(self, limit: int = 20) -> dict:
+        with self._lock:
+            lags = sorted(self._lags)
+            offenders = sorted(self._offenders.values(), key=lambda o: o['total_seconds'], reverse=True)[:limit]
+            offenders = [
+                {
+                    **o,
+                    'total_ms': round(o['total_seconds'] * 1000, 1),
+                    'max_ms': round(o['max_seconds'] * 1000, 1)
+                }
+                for o in offenders
+            ]
+        for o in offenders:
+            del o['total_seconds'], o['max_seconds']
+
+        def pct(p):
+            return round(lags[min(len(lags) - 1, int(p / 100 * len(lags)))] * 1000, 2) if lags else 0
+
+        return {
+            'pid': os.getpid(),
+            'enabled': self.enabled,
+            'threshold_ms': self.threshold * 1000,
+            'interval_ms': self.interval * 1000,
+            'lag_ms': {'p50': pct(50), 'p99': pct(99), 'max': pct(100), 'samples': len(lags)},
+            'stalls': self.stalls,
+            'offenders': offenders
+        }
+
+
+monitor = LoopMonitor()
@@ -0,0 +1,230 @@
+"""
+Static media serving for immutable, content-addressed assets
+
+A drop-in replacement for StaticFiles for the /static mount:
+
+- UUID-named files never change, so they get a one-year `immutable`
+  Cache-Control and browsers stop revalidating them
+- strong ETags derived from file content, with 304 handling for
+  If-None-Match / If-Modified-Since
+- single-range `Range` requests (206 / 416) honouring If-Range
+- precompressed `.br` / `.gz` siblings served when Accept-Encoding allows
+- zero-copy transfer through the ASGI `http.response.zerocopysend`
+  extension when the server offers it, otherwise large chunked reads off
+  the event loop
+"""
+import hashlib
+import mimetypes
+import os
+import re
+import stat
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+
+import anyio
+from starlette.datastructures import Headers
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+DEFAULT_CACHE_CONTROL = 'public, max-age=300'
+CHUNK_SIZE = 1024 * 1024
+ETAG_CACHE_SIZE = 8192
+
+IMMUTABLE_NAME_PATTERN = re.compile(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+PRECOMPRESSED_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def _content_hash(path: str) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == '*':
+        return True
+    # If-None-Match uses weak comparison
+    candidates = [tag.strip() for tag in header.split(',')]
+    return any(tag.removeprefix('W/') == etag for tag in candidates)
+
+
+def parse_range(header: str, size: int):
+    """
+    Parse a single-range `Range` header
+
+    Returns:
+        (start, end) inclusive byte offsets, None to serve the whole file,
+        or 'unsatisfiable'
+    """
+    match = RANGE_PATTERN.match(header.strip())
+    if not match:
+        # Multiple ranges or other units: serving the full body is allowed
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        length = int(last)
+        if length == 0:
+            return 'unsatisfiable'
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return 'unsatisfiable'
+    return start, end
+
+
+class MediaFiles:
+    """ASGI app serving files under `directory` with caching-friendly headers"""
+
+    def __init__(self, directory, on_access=None):
+        self.directory = Path(directory).resolve()
+        self.on_access = on_access
+        self._etags = OrderedDict()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            raise RuntimeError('MediaFiles only handles HTTP requests')
+
+        method = scope['method']
+        if method not in ('GET', 'HEAD'):
+            await self._send_empty(send, 405, [(b'allow', b'GET, HEAD')])
+            return
+
+        relative = scope['path'].removeprefix(scope.get('root_path', ''))
+        path = (self.directory / relative.lstrip('/')).resolve()
+        if self.directory not in path.parents:
+            await self._send_empty(send, 404)
+            return
+
+        request_headers = Headers(scope=scope)
+        served_path, encoding = await self._select_variant(path, request_headers)
+        try:
+            st = await anyio.to_thread.run_sync(os.stat, served_path)
+        except (FileNotFoundError, NotADirectoryError):
+            await self._send_empty(send, 404)
+            return
+        if not stat.S_ISREG(st.st_mode):
+            await self._send_empty(send, 404)
+            return
+
+        if self.on_access:
+            self.on_access(str(path.relative_to(self.directory)))
+
+        etag = await self._etag(served_path, st, encoding)
+        headers = [
+            (b'content-type', (mimetypes.guess_type(path.name)[0] or 'application/octet-stream').encode()),
+            (b'etag', etag.encode()),
+            (b'last-modified', formatdate(st.st_mtime, usegmt=True).encode()),
+            (b'cache-control', (IMMUTABLE_CACHE_CONTROL if IMMUTABLE_NAME_PATTERN.search(path.name) else DEFAULT_CACHE_CONTROL).encode()),
+            (b'accept-ranges', b'bytes'),
+            (b'vary', b'Accept-Encoding'),
+            (b'x-content-type-options', b'nosniff'),
+        ]
+        if encoding:
+            headers.append((b'content-encoding', encoding.encode()))
+
+        if self._not_modified(request_headers, etag, st.st_mtime):
+            await self._send_empty(send, 304, [h for h in headers if h[0] != b'content-type'])
+            return
+
+        start, end, status = 0, st.st_size - 1, 200
+        range_header = request_headers.get('range')
+        if range_header and not encoding and self._if_range_matches(request_headers, etag, st.st_mtime):
+            byte_range = parse_range(range_header, st.st_size)
+            if byte_range == 'unsatisfiable':
+                await self._send_empty(send, 416, [(b'content-range', f'bytes */{st.st_size}'.encode())])
+                return
+            if byte_range:
+                start, end = byte_range
+                status = 206
+                headers.append((b'content-range', f'bytes {start}-{end}/{st.st_size}'.encode()))
+
+        length = end - start + 1 if st.st_size else 0
+        headers.append((b'content-length', str(length).encode()))
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        if method == 'HEAD' or length == 0:
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+
+        await self._send_file(scope, send, served_path, start, length)
+
+    async def _select_variant(self, path: Path, request_headers: Headers):
+        accept_encoding = request_headers.get('accept-encoding', '')
+        if not accept_encoding or request_headers.get('range'):
+            return path, None
+        accepted = {part.split(';')[0].strip() for part in accept_encoding.split(',')}
+        for encoding, suffix in PRECOMPRESSED_ENCODINGS:
+            if encoding in accepted:
+                candidate = path.with_name(path.name + suffix)
+                if await anyio.to_thread.run_sync(candidate.is_file):
+                    return candidate, encoding
+        return path, None
+
+    async def _etag(self, path: Path, st: os.stat_result, encoding) -> str:
+        cache_key = (str(path), st.st_ino, st.st_size, st.st_mtime_ns)
+        digest = self._etags.get(cache_key)
+        if digest is None:
+            digest = await anyio.to_thread.run_sync(_content_hash, str(path))
+            self._etags[cache_key] = digest
+            while len(self._etags) > ETAG_CACHE_SIZE:
+                self._etags.popitem(last=False)
+        else:
+            self._etags.move_to_end(cache_key)
+        return f'"{digest}-{encoding}"' if encoding else f'"{digest}"'
+
+    def _not_modified(self, request_headers: Headers, etag: str, mtime: float) -> bool:
+        if_none_match = request_headers.get('if-none-match')
+        if if_none_match is not None:
+            return _etag_matches(if_none_match, etag)
+        if_modified_since = request_headers.get('if-modified-since')
+        if if_modified_since:
+            try:
+                return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def _if_range_matches(self, request_headers: Headers, etag: str, mtime: float) -> bool:
+        if_range = request_headers.get('if-range')
+        if not if_range:
+            return True
+        if if_range.startswith('"'):
+            # If-Range requires strong comparison
+            return if_range == etag
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_range).timestamp()
+        except (TypeError, ValueError):
+            return False
+
+    async def _send_file(self, scope, send, path: Path, offset: int, length: int):
+        if 'http.response.zerocopysend' in scope.get('extensions', {}):
+            with open(path, 'rb') as f:
+                await send({
+                    'type': 'http.response.zerocopysend',
+                    'file': f.fileno(),
+                    'offset': offset,
+                    'count': length,
+                    'more_body': False,
+                })
+            return
+
+        async with await anyio.open_file(path, 'rb') as f:
+            await f.seek(offset)
+            remaining = length
+            while remaining > 0:
+                chunk = await f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': remaining > 0})
+            if remaining > 0:
+                await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+    async def _send_empty(self, send, status: int, headers=None):
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers or []})
+        await send({'type': 'http.response.body', 'body': b''})
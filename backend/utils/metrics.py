@@ -0,0 +1,227 @@
+"""
+Application metrics
+
+Counters, gauges and latency histograms keyed by metric name and label set.
+Every value is kept in a small in-process registry (for the JSON debug
+endpoints) and mirrored into prometheus_client for scraping at /metrics.
+
+Multi-worker deployments must export PROMETHEUS_MULTIPROC_DIR (an empty,
+writable directory) before the workers start; each process then writes its
+samples to mmap files there and render_prometheus() aggregates all of them,
+so a scrape sees the whole server no matter which worker answers it.
+
+Importing this module also registers a pymongo command listener that times
+every MongoDB command. Listeners only apply to clients created afterwards,
+so import it before anything that constructs a Motor client.
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import prometheus_client
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, multiprocess
+from prometheus_client.core import GaugeMetricFamily
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+METRICS_MONGO_COMMANDS = os.getenv('METRICS_MONGO_COMMANDS', 'true').lower() == 'true'
+
+# Seconds; the defaults suit HTTP handlers and DB calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Outbound AI calls and pipeline stages run for seconds to minutes
+LONG_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_timings = {}
+_prometheus = {}
+
+
+def _key(name: str, labels: dict = None):
+    return name, tuple(sorted((labels or {}).items()))
+
+
+def _prometheus_metric(kind, name: str, labels: dict, **kwargs):
+    """
+    Return the prometheus_client child for name/labels, creating the metric
+    on first use. Label names are fixed by the first call for each metric.
+    """
+    metric = _prometheus.get(name)
+    if metric is None:
+        with _lock:
+            metric = _prometheus.get(name)
+            if metric is None:
+                metric = kind(name, name.replace('_', ' '), sorted(labels or {}), **kwargs)
+                _prometheus[name] = metric
+    if not labels:
+        return metric
+    try:
+        return metric.labels(**labels)
+    except ValueError:
+        logger.warning("Metric %s used with inconsistent labels %s", name, sorted(labels))
+        return None
+
+
+def inc(name: str, labels: dict = None, value: float = 1):
+    """Increment a counter"""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+    child = _prometheus_metric(Counter, name, labels)
+    if child is not None:
+        child.inc(value)
+
+
+def set_gauge(name: str, value: float, labels: dict = None, multiprocess_mode: str = 'liveall'):
+    """
+    Set a gauge to an absolute value
+
+    multiprocess_mode decides how values from several workers combine
+    (liveall keeps one series per live worker, livesum adds them up)
+    """
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = value
+    child = _prometheus_metric(Gauge, name, labels, multiprocess_mode=multiprocess_mode)
+    if child is not None:
+        child.set(value)
+
+
+def observe(name: str, seconds: float, labels: dict = None, buckets: tuple = DEFAULT_BUCKETS):
+    """Record a duration in seconds"""
+    key = _key(name, labels)
+    with _lock:
+        stats = _timings.setdefault(key, {'count': 0, 'sum': 0.0, 'max': 0.0})
+        stats['count'] += 1
+        stats['sum'] += seconds
+        stats['max'] = max(stats['max'], seconds)
+    child = _prometheus_metric(Histogram, name, labels, buckets=buckets)
+    if child is not None:
+        child.observe(seconds)
+
+
+@contextmanager
+def timer(name: str, labels: dict = None, buckets: tuple = DEFAULT_BUCKETS):
+    """Time the wrapped block and record it with observe()"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, labels, buckets)
+
+
+def snapshot(prefix: str = '') -> dict:
+    """
+    Return a JSON-serialisable copy of this process's metrics whose name
+    starts with prefix
+    """
+    with _lock:
+        counters = [
+            {'name': name, 'labels': dict(labels), 'value': value}
+            for (name, labels), value in _counters.items()
+            if name.startswith(prefix)
+        ]
+        gauges = [
+            {'name': name, 'labels': dict(labels), 'value': value}
+            for (name, labels), value in _gauges.items()
+            if name.startswith(prefix)
+        ]
+        timings = [
+            {
+                'name': name,
+                'labels': dict(labels),
+                'count': stats['count'],
+                'avg_seconds': stats['sum'] / stats['count'] if stats['count'] else 0,
+                'max_seconds': stats['max'],
+            }
+            for (name, labels), stats in _timings.items()
+            if name.startswith(prefix)
+        ]
+    return {'counters': counters, 'gauges': gauges, 'timings': timings}
+
+
+def render_prometheus(extra_collectors: list = None) -> bytes:
+    """
+    Render all metrics in the Prometheus text format
+
+    In multiprocess mode the samples of every worker are merged. Collectors
+    in extra_collectors (objects with a collect() method) are appended, for
+    values computed at scrape time.
+    """
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    output = prometheus_client.generate_latest(registry)
+
+    if extra_collectors:
+        extra = CollectorRegistry(auto_describe=False)
+        for collector in extra_collectors:
+            extra.register(collector)
+        output += prometheus_client.generate_latest(extra)
+    return output
+
+
+def mark_process_dead(pid: int = None):
+    """Drop live-gauge samples of an exiting worker (multiprocess mode only)"""
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid or os.getpid())
+
+
+CONTENT_TYPE_LATEST = prometheus_client.CONTENT_TYPE_LATEST
+
+
+class ScrapeGauge:
+    """
+    A gauge computed at scrape time, e.g. from a database count, for
+    render_prometheus(extra_collectors=...). Values that come from shared
+    state are already global, so they bypass per-worker aggregation.
+    """
+
+    def __init__(self, name: str, documentation: str, label_name: str, values: dict):
+        self.name = name
+        self.documentation = documentation
+        self.label_name = label_name
+        self.values = values
+
+    def collect(self):
+        family = GaugeMetricFamily(self.name, self.documentation, labels=[self.label_name])
+        for label_value, value in self.values.items():
+            family.add_metric([label_value], value)
+        yield family
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Times every MongoDB command by command name and collection"""
+
+    def __init__(self):
+        self._collections = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if isinstance(collection, str):
+            self._collections[event.request_id] = collection
+
+    def _labels(self, event) -> dict:
+        return {
+            'command': event.command_name,
+            'collection': self._collections.pop(event.request_id, '')
+        }
+
+    def succeeded(self, event):
+        observe('mongodb_command_duration_seconds', event.duration_micros / 1e6, self._labels(event))
+
+    def failed(self, event):
+        labels = self._labels(event)
+        observe('mongodb_command_duration_seconds', event.duration_micros / 1e6, labels)
+        inc('mongodb_command_errors_total', labels)
+
+
+if METRICS_MONGO_COMMANDS:
+    monitoring.register(MongoCommandMetrics())
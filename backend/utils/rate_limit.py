@@ -0,0 +1,352 @@
+"""
+Plan-aware API request rate limiting
+
+RateLimitMiddleware limits each caller to the request rate of its
+subscription plan (SUBSCRIPTION_PLANS[plan]['rate_limit']) using GCRA, the
+generic cell rate algorithm: a token bucket that keeps one float per key,
+the theoretical arrival time (TAT) of the next request. A request is allowed
+if it would not push the TAT more than `burst` emission intervals ahead of
+now, so a caller can burst up to `burst` requests and then gets one every
+60 / requests_per_minute seconds.
+
+Callers are keyed by user: a bearer token, X-API-Key or session cookie is
+resolved to its user and plan once and cached for RATE_LIMIT_PLAN_CACHE_SECONDS,
+so every token of a user shares one bucket and the per-request check stays
+in memory. Requests without credentials are keyed by client address with the
+anonymous limit; so are credentials seen for the first time, before they are
+looked up, so that a stream of made-up tokens cannot become a stream of
+database queries.
+
+Each worker enforces its limits alone by default. With RATE_LIMIT_SHARED,
+workers also push the capacity they used to the rate_limits collection every
+RATE_LIMIT_SYNC_SECONDS and adopt the combined TAT, so the limit holds across
+workers and hosts, give or take one sync interval of traffic.
+
+Rejected requests get 429 with Retry-After; every limited response carries
+RateLimit-Limit/-Remaining/-Reset and RateLimit-Policy.
+"""
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+from config.subscription_plans import SUBSCRIPTION_PLANS, get_rate_limit
+from utils import metrics
+from utils.auth import decode_access_token
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+RATE_LIMIT_ANONYMOUS_PER_MINUTE = int(os.getenv('RATE_LIMIT_ANONYMOUS_PER_MINUTE', 60))
+RATE_LIMIT_ANONYMOUS_BURST = int(os.getenv('RATE_LIMIT_ANONYMOUS_BURST', 30))
+RATE_LIMIT_PLAN_CACHE_SECONDS = float(os.getenv('RATE_LIMIT_PLAN_CACHE_SECONDS', 60))
+RATE_LIMIT_MAX_KEYS = int(os.getenv('RATE_LIMIT_MAX_KEYS', 100000))
+RATE_LIMIT_SHARED = os.getenv('RATE_LIMIT_SHARED', 'false').lower() == 'true'
+RATE_LIMIT_SYNC_SECONDS = float(os.getenv('RATE_LIMIT_SYNC_SECONDS', 1))
+# Prefixes never limited: scrapes, media and provider callbacks from shared addresses
+RATE_LIMIT_EXEMPT_PATHS = tuple(
+    p for p in os.getenv('RATE_LIMIT_EXEMPT_PATHS', '/metrics,/static/,/api/stripe/webhook').split(',') if p
+)
+# Cache a failed credential lookup briefly so an outage does not mean a query per request
+LOOKUP_FAILURE_CACHE_SECONDS = 5
+
+MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
+DB_NAME = os.getenv("DB_NAME", "test_database")
+client = AsyncIOMotorClient(MONGO_URL)
+db = client[DB_NAME]
+
+ANONYMOUS = 'anonymous'
+
+
+class Policy:
+    """Limits and the constant response headers for one plan"""
+    __slots__ = ('name', 'per_minute', 'burst', 'interval', 'tolerance', 'headers', 'message')
+
+    def __init__(self, name: str, per_minute: int, burst: int):
+        self.name = name
+        self.per_minute = per_minute
+        self.burst = burst
+        self.interval = 60.0 / per_minute
+        self.tolerance = self.interval * burst
+        self.headers = [
+            (b'ratelimit-limit', str(burst).encode()),
+            (b'ratelimit-policy', f'{per_minute};w=60;burst={burst}'.encode()),
+        ]
+        label = 'Anonymous clients are' if name == ANONYMOUS else f'Your {name.title()} plan is'
+        self.message = f'Too many requests. {label} limited to {per_minute} requests per minute.'
+
+
+POLICIES = {plan: Policy(plan, *get_rate_limit(plan)) for plan in SUBSCRIPTION_PLANS}
+ANONYMOUS_POLICY = Policy(ANONYMOUS, RATE_LIMIT_ANONYMOUS_PER_MINUTE, RATE_LIMIT_ANONYMOUS_BURST)
+
+
+class GCRALimiter:
+    """Per-key theoretical arrival times, optionally merged across workers"""
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS, shared: bool = RATE_LIMIT_SHARED):
+        self.max_keys = max_keys
+        self.shared = shared
+        self._tat = {}
+        # key -> seconds of capacity used since the last sync
+        self._pending = {}
+
+    def check(self, key: str, policy: Policy, now: float) -> tuple:
+        """
+        Charge one request to key if its policy allows it
+
+        Returns:
+            tuple: (allowed, remaining requests, seconds until the bucket is
+            full again, seconds until a request would be allowed)
+        """
+        tat = self._tat.get(key, now)
+        if tat < now:
+            tat = now
+        new_tat = tat + policy.interval
+        allow_at = new_tat - policy.tolerance
+        if allow_at > now:
+            return False, 0, tat - now, allow_at - now
+
+        if key not in self._tat and len(self._tat) >= self.max_keys:
+            self._prune(now)
+        self._tat[key] = new_tat
+        if self.shared:
+            self._pending[key] = self._pending.get(key, 0.0) + policy.interval
+        # The epsilon keeps float error from rounding a whole request away
+        return True, int((now - allow_at) / policy.interval + 1e-6), new_tat - now, 0.0
+
+    def refund(self, key: str, policy: Policy):
+        """Give back one request that check() allowed, e.g. because it is charged to another key"""
+        tat = self._tat.get(key)
+        if tat is not None:
+            self._tat[key] = tat - policy.interval
+        if self.shared:
+            used = self._pending.get(key, 0.0) - policy.interval
+            if abs(used) < 1e-9:
+                self._pending.pop(key, None)
+            else:
+                self._pending[key] = used
+
+    def _prune(self, now: float):
+        # A key whose TAT has passed has a full bucket, the same as no entry
+        self._tat = {key: tat for key, tat in self._tat.items() if tat > now}
+        if len(self._tat) >= self.max_keys:
+            # Still full of active keys: forget the oldest half rather than grow
+            keys = list(self._tat)
+            self._tat = {key: self._tat[key] for key in keys[len(keys) // 2:]}
+
+    async def sync(self):
+        """Push locally used capacity to Mongo and adopt the combined TATs"""
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        now = time.time()
+        try:
+            await self._push(pending, now)
+        except Exception:
+            # Keep the interval's usage for the next sync instead of dropping it
+            for key, used in pending.items():
+                self._pending[key] = self._pending.get(key, 0.0) + used
+            raise
+        async for doc in db.rate_limits.find({'_id': {'$in': list(pending)}}, {'tat': 1}):
+            if doc['tat'] > self._tat.get(doc['_id'], 0.0):
+                self._tat[doc['_id']] = doc['tat']
+
+    @staticmethod
+    async def _push(pending: dict, now: float):
+        await db.rate_limits.bulk_write([
+            UpdateOne({'_id': key}, [
+                {'$set': {'tat': {'$add': [{'$max': [{'$ifNull': ['$tat', now]}, now]}, used]}}},
+                {'$set': {'expires_at': {'$toDate': {'$multiply': ['$tat', 1000]}}}},
+            ], upsert=True)
+            for key, used in pending.items()
+        ], ordered=False)
+
+
+limiter = GCRALimiter()
+
+# credential -> (expires_at, key or None for anonymous, plan)
+_identities = {}
+_in_flight = {}
+
+
+async def ensure_indexes():
+    if RATE_LIMIT_SHARED:
+        await db.rate_limits.create_index('expires_at', expireAfterSeconds=0)
+
+
+async def _lookup_identity(token: str) -> tuple:
+    """Rate limit key and plan of the user a credential belongs to"""
+    user = None
+    # Expired sessions are rejected by utils.auth, so they get no plan limit either
+    session = await db.user_sessions.find_one(
+        {'session_token': token, 'expires_at': {'$gt': datetime.now(timezone.utc)}}, {'user_id': 1}
+    )
+    if session:
+        projection = {'id': 1, 'subscription_plan': 1}
+        user = await db.users.find_one({'id': session['user_id']}, projection)
+        if not user:
+            user = await db.users.find_one({'_id': session['user_id']}, projection)
+    else:
+        payload = decode_access_token(token)
+        if payload and payload.get('sub'):
+            user = await db.users.find_one({'email': payload['sub']}, {'id': 1, 'subscription_plan': 1})
+    if not user:
+        return None, ANONYMOUS
+    return f"user:{user.get('id') or user['_id']}", user.get('subscription_plan') or 'free'
+
+
+async def _resolve(token: str, now: float) -> tuple:
+    try:
+        key, plan = await _lookup_identity(token)
+        expires_at = now + RATE_LIMIT_PLAN_CACHE_SECONDS
+    except Exception as e:
+        logger.warning("Rate limit credential lookup failed: %s", e)
+        key, plan = None, ANONYMOUS
+        expires_at = now + LOOKUP_FAILURE_CACHE_SECONDS
+    if len(_identities) >= RATE_LIMIT_MAX_KEYS:
+        for stale in [t for t, entry in _identities.items() if entry[0] <= now] or list(_identities)[:len(_identities) // 2]:
+            del _identities[stale]
+    entry = (expires_at, key, plan)
+    _identities[token] = entry
+    return entry
+
+
+async def identity(token: str, now: float) -> tuple:
+    """Cached (expires_at, key, plan) for a credential; concurrent misses share one lookup"""
+    entry = _identities.get(token)
+    if entry is not None and entry[0] > now:
+        return entry
+    task = _in_flight.get(token)
+    if task is None:
+        task = asyncio.ensure_future(_resolve(token, now))
+        _in_flight[token] = task
+        task.add_done_callback(lambda _: _in_flight.pop(token, None))
+    return await asyncio.shield(task)
+
+
+def _credential(headers) -> Optional[str]:
+    cookie = None
+    for name, value in headers:
+        if name == b'authorization':
+            if value[:7].lower() == b'bearer ':
+                return value[7:].decode('latin-1')
+        elif name == b'x-api-key':
+            return value.decode('latin-1')
+        elif name == b'cookie':
+            cookie = value
+    if cookie is not None:
+        start = cookie.find(b'session_token=')
+        if start >= 0:
+            start += len(b'session_token=')
+            end = cookie.find(b';', start)
+            return cookie[start:end if end >= 0 else None].decode('latin-1')
+    return None
+
+
+def _limit_headers(policy: Policy, remaining: int, reset: float) -> list:
+    return policy.headers + [
+        (b'ratelimit-remaining', str(remaining).encode()),
+        (b'ratelimit-reset', str(math.ceil(reset)).encode()),
+    ]
+
+
+class RateLimitMiddleware:
+    """Plain ASGI middleware applying the caller's plan rate limit"""
+
+    def __init__(self, app, limiter: GCRALimiter = limiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] == 'OPTIONS' or scope['path'].startswith(RATE_LIMIT_EXEMPT_PATHS):
+            await self.app(scope, receive, send)
+            return
+
+        now = time.time()
+        client_address = scope.get('client')
+        address_key = f"ip:{client_address[0] if client_address else 'unknown'}"
+        token = _credential(scope['headers'])
+        decision = None
+        key, policy = address_key, ANONYMOUS_POLICY
+        if token is not None:
+            entry = _identities.get(token)
+            if entry is None or entry[0] <= now:
+                # Unknown credentials pay at the client address until looked up
+                decision = self.limiter.check(address_key, ANONYMOUS_POLICY, now)
+                if not decision[0]:
+                    await self._reject(send, ANONYMOUS_POLICY, decision)
+                    return
+                entry = await identity(token, now)
+            if entry[1] is not None:
+                key, policy = entry[1], POLICIES.get(entry[2], POLICIES['free'])
+                if decision is not None:
+                    # Charged to the user below, not to the address as well
+                    self.limiter.refund(address_key, ANONYMOUS_POLICY)
+                decision = None
+        if decision is None:
+            decision = self.limiter.check(key, policy, now)
+            if not decision[0]:
+                await self._reject(send, policy, decision)
+                return
+
+        headers = _limit_headers(policy, decision[1], decision[2])
+
+        async def send_with_headers(message):
+            if message['type'] == 'http.response.start':
+                message['headers'] = list(message.get('headers', [])) + headers
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+    @staticmethod
+    async def _reject(send, policy: Policy, decision: tuple):
+        metrics.inc('rate_limited_requests_total', {'plan': policy.name})
+        body = json.dumps({'detail': policy.message}).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': 429,
+            'headers': _limit_headers(policy, 0, decision[2]) + [
+                (b'retry-after', str(math.ceil(decision[3])).encode()),
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(body)).encode()),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+
+class SharedStateSync:
+    """Background task merging limiter state through Mongo (RATE_LIMIT_SHARED)"""
+
+    def __init__(self, limiter: GCRALimiter = limiter, interval: float = RATE_LIMIT_SYNC_SECONDS):
+        self.limiter = limiter
+        self.interval = interval
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        failing = False
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.limiter.sync()
+                failing = False
+            except Exception as e:
+                # Keep limiting per worker; say so once rather than every interval
+                if not failing:
+                    logger.warning("Rate limit state sync failed, limiting per worker: %s", e)
+                failing = True
@@ -0,0 +1,136 @@
+"""
+Coalescing of identical in-flight work
+
+Two levels:
+
+- Upstream calls. SingleFlight.do(key, fn) runs fn once for all concurrent
+  callers with the same key: the first starts it, the rest wait for the same
+  result (or exception), and each gets its own copy of the result to mutate.
+  It is per worker process and only covers calls that overlap; nothing is
+  cached once the call finishes. The call keeps running while anyone is
+  still waiting for it, and is cancelled when the last waiter gives up.
+
+- Generation jobs. A double click, client retry or second tab submits the
+  same job seconds apart. claim_job() inserts a job document carrying a
+  request_key (a hash of the user and the normalized input and options) that
+  is unique among in-flight jobs, so an identical submission on any worker
+  gets the existing job back instead of starting a second paid pipeline.
+  The key is released when the job reaches a terminal status (the
+  RELEASE_JOB_KEY $unset), and stops matching after COALESCE_WINDOW_SECONDS
+  in case the job never gets there (a killed worker).
+"""
+import asyncio
+import copy
+import hashlib
+import json
+import logging
+import os
+import unicodedata
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+COALESCE_WINDOW_SECONDS = float(os.getenv('COALESCE_WINDOW_SECONDS', 900))
+
+# $unset for the update that moves a job to a terminal status
+RELEASE_JOB_KEY = {'request_key': '', 'request_key_expires_at': ''}
+
+
+class _Call:
+    __slots__ = ('task', 'waiters')
+
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._calls = {}
+
+    def __len__(self):
+        return len(self._calls)
+
+    async def do(self, key, fn: Callable[[], Awaitable]):
+        """Result of fn(), shared with concurrent callers of the same key"""
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+            metrics.inc('single_flight_calls_total', {'group': self.name, 'role': 'leader'})
+        else:
+            metrics.inc('single_flight_calls_total', {'group': self.name, 'role': 'follower'})
+        call.waiters += 1
+        try:
+            # Shield so one caller's cancellation does not cancel the others' call
+            result = await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if call.waiters == 1 and not call.task.done():
+                # Later callers start afresh rather than join a call being cancelled
+                self._forget(key, call)
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+        return copy.deepcopy(result)
+
+    def _forget(self, key, call: _Call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+
+def normalize_text(text: str) -> str:
+    """Unicode-normalized text with runs of whitespace collapsed"""
+    return ' '.join(unicodedata.normalize('NFKC', text).split())
+
+
+def request_key(user_id, **fields) -> str:
+    """Key of a job submission: the user plus its normalized input and options"""
+    values = {name: normalize_text(value) if isinstance(value, str) else value for name, value in fields.items()}
+    return hashlib.sha256(json.dumps([str(user_id), values], sort_keys=True).encode()).hexdigest()
+
+
+async def ensure_job_indexes(collection):
+    """At most one in-flight job per request key"""
+    await collection.create_index(
+        [('request_key', ASCENDING)], unique=True,
+        partialFilterExpression={'request_key': {'$type': 'string'}}
+    )
+
+
+async def find_job(collection, key: str) -> Optional[dict]:
+    """The in-flight job submitted with this request key, if any"""
+    return await collection.find_one({'request_key': key, 'request_key_expires_at': {'$gt': datetime.utcnow()}})
+
+
+async def claim_job(collection, document: dict, key: str) -> Optional[dict]:
+    """
+    Insert document as the job for key
+
+    Returns None if it was inserted, or the in-flight job with the same key
+    that it was coalesced into.
+    """
+    document['request_key'] = key
+    document['request_key_expires_at'] = datetime.utcnow() + timedelta(seconds=COALESCE_WINDOW_SECONDS)
+    for _ in range(3):
+        try:
+            await collection.insert_one(document)
+            return None
+        except DuplicateKeyError:
+            existing = await find_job(collection, key)
+            if existing is not None:
+                return existing
+            # The holder expired (or finished) since: free its key and try again
+            await collection.update_many(
+                {'request_key': key, 'request_key_expires_at': {'$lte': datetime.utcnow()}},
+                {'$unset': RELEASE_JOB_KEY}
+            )
+    raise RuntimeError(f"Could not claim request key {key[:12]}")
@@ -0,0 +1,61 @@
+"""
+Non-blocking access to the Stripe SDK
+
+The Stripe SDK is synchronous, so every call is run on a small dedicated
+thread pool instead of the event loop. Each pool thread keeps its own
+requests.Session inside Stripe's RequestsClient, so connections are reused.
+"""
+import asyncio
+import functools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import stripe
+from dotenv import load_dotenv
+
+from utils import metrics
+
+load_dotenv()
+
+STRIPE_TIMEOUT_SECONDS = float(os.getenv('STRIPE_TIMEOUT_SECONDS', 20))
+STRIPE_MAX_NETWORK_RETRIES = int(os.getenv('STRIPE_MAX_NETWORK_RETRIES', 2))
+STRIPE_MAX_WORKERS = int(os.getenv('STRIPE_MAX_WORKERS', 8))
+STRIPE_METRICS_ENABLED = os.getenv('STRIPE_METRICS_ENABLED', 'true').lower() == 'true'
+
+stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
+stripe.max_network_retries = STRIPE_MAX_NETWORK_RETRIES
+
+_requests_client_cls = getattr(stripe, 'RequestsClient', None) or stripe.http_client.RequestsClient
+stripe.default_http_client = _requests_client_cls(timeout=STRIPE_TIMEOUT_SECONDS)
+
+_executor = ThreadPoolExecutor(max_workers=STRIPE_MAX_WORKERS, thread_name_prefix='stripe')
+
+
+async def call_stripe(operation: str, fn, *args, **kwargs):
+    """
+    Run a blocking Stripe SDK call on the Stripe thread pool
+
+    Args:
+        operation: Name used for metrics, e.g. 'checkout.session.create'
+        fn: Stripe SDK callable
+        *args, **kwargs: Passed through to fn
+    """
+    loop = asyncio.get_running_loop()
+    labels = {'operation': operation}
+    start = time.perf_counter()
+    try:
+        return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+    except Exception as e:
+        if STRIPE_METRICS_ENABLED:
+            metrics.inc('stripe_call_errors_total', {**labels, 'error': type(e).__name__})
+        raise
+    finally:
+        if STRIPE_METRICS_ENABLED:
+            metrics.inc('stripe_calls_total', labels)
+            metrics.observe('stripe_call_duration_seconds', time.perf_counter() - start, labels)
+
+
+def shutdown_stripe_executor():
+    """Stop the Stripe thread pool, letting in-flight calls finish"""
+    _executor.shutdown(wait=True)
@@ -0,0 +1,253 @@
+"""
+Distributed tracing (OpenTelemetry)
+
+TRACING_EXPORTER selects where spans go:
+    none     tracing disabled; every helper here is a cheap no-op (default)
+    otlp     OTLP/HTTP to a collector (OTEL_EXPORTER_OTLP_TRACES_ENDPOINT,
+             default http://localhost:4318/v1/traces)
+    file     one JSON span per line appended to TRACING_FILE_PATH
+    console  pretty-printed to stdout, for local debugging
+
+TRACING_SAMPLE_RATIO (0..1) samples new traces by trace id; child spans,
+including background jobs started by a sampled request, follow their
+parent's decision.
+
+Trace context crosses into background jobs through current_carrier() /
+span(..., parent=carrier), so it survives being stored in Mongo. Like
+utils.metrics, importing this module registers a pymongo command listener,
+which must happen before any Motor client is created.
+"""
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from typing import Optional
+
+from opentelemetry import context as otel_context
+from opentelemetry import propagate, trace
+from opentelemetry.trace import SpanKind, Status, StatusCode
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+TRACING_EXPORTER = os.getenv('TRACING_EXPORTER', 'none').lower()
+TRACING_SAMPLE_RATIO = float(os.getenv('TRACING_SAMPLE_RATIO', 1.0))
+TRACING_FILE_PATH = os.getenv('TRACING_FILE_PATH', 'traces.jsonl')
+TRACING_SERVICE_NAME = os.getenv('TRACING_SERVICE_NAME', 'vid-backend')
+TRACING_ENABLED = TRACING_EXPORTER != 'none'
+
+tracer = trace.get_tracer('vid')
+
+_provider = None
+
+
+def _json_file_exporter():
+    from opentelemetry.sdk.trace.export import SpanExporter, SpanExportResult
+
+    class JsonFileSpanExporter(SpanExporter):
+        """Appends finished spans to a file as JSON lines"""
+
+        def __init__(self, path: str):
+            self.path = path
+            self._lock = threading.Lock()
+
+        def export(self, spans):
+            lines = ''.join(json.dumps(json.loads(s.to_json())) + '\n' for s in spans)
+            try:
+                with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(lines)
+            except OSError as e:
+                logger.error("Failed to write spans to %s: %s", self.path, e)
+                return SpanExportResult.FAILURE
+            return SpanExportResult.SUCCESS
+
+        def shutdown(self):
+            pass
+
+    return JsonFileSpanExporter(TRACING_FILE_PATH)
+
+
+def setup_tracing():
+    """
+    Install the tracer provider and exporter for this process
+
+    Call once per worker process after it has started (the batch exporter
+    owns a background thread, which does not survive a fork).
+    """
+    global _provider
+    if not TRACING_ENABLED or _provider is not None:
+        return
+
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+    from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+    if TRACING_EXPORTER == 'otlp':
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        exporter = OTLPSpanExporter()
+    elif TRACING_EXPORTER == 'file':
+        exporter = _json_file_exporter()
+    elif TRACING_EXPORTER == 'console':
+        exporter = ConsoleSpanExporter()
+    else:
+        raise ValueError(f"Unknown TRACING_EXPORTER: {TRACING_EXPORTER}")
+
+    _provider = TracerProvider(
+        resource=Resource.create({'service.name': TRACING_SERVICE_NAME, 'process.pid': os.getpid()}),
+        sampler=ParentBased(TraceIdRatioBased(TRACING_SAMPLE_RATIO))
+    )
+    _provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(_provider)
+
+
+def shutdown_tracing():
+    """Flush buffered spans; call on process shutdown"""
+    if _provider is not None:
+        _provider.shutdown()
+
+
+def current_carrier() -> dict:
+    """
+    Serialise the current trace context (W3C traceparent) so a background
+    job can continue the trace, even from another process
+    """
+    carrier = {}
+    if TRACING_ENABLED:
+        propagate.inject(carrier)
+    return carrier
+
+
+def current_trace_id() -> Optional[str]:
+    span_context = trace.get_current_span().get_span_context()
+    return format(span_context.trace_id, '032x') if span_context.is_valid else None
+
+
+@contextmanager
+def span(name: str, attributes: dict = None, parent: dict = None, kind: SpanKind = SpanKind.INTERNAL):
+    """
+    Run the wrapped block in a new span, a child of the current span or of
+    the carrier in `parent`. Exceptions are recorded and mark the span failed.
+    """
+    if not TRACING_ENABLED:
+        yield trace.INVALID_SPAN
+        return
+
+    ctx = propagate.extract(parent) if parent else None
+    with tracer.start_as_current_span(name, context=ctx, kind=kind, attributes=attributes) as current:
+        yield current
+
+
+def record_exception(error: Exception):
+    """Mark the current span failed for an exception that is handled, not raised"""
+    current = trace.get_current_span()
+    if current.is_recording():
+        current.record_exception(error)
+        current.set_status(Status(StatusCode.ERROR, str(error)[:200]))
+
+
+class TracingMiddleware:
+    """
+    Plain ASGI middleware opening a server span per HTTP request
+
+    Continues an incoming traceparent header and returns the trace id in
+    X-Trace-Id. The span ends when the response body is complete, so
+    background tasks that run afterwards do not stretch it; they still
+    inherit its context and show up as its children.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        headers = {k.decode('latin-1'): v.decode('latin-1') for k, v in scope['headers']}
+        request_span = tracer.start_span(
+            f"{scope['method']} {scope['path']}",
+            context=propagate.extract(headers),
+            kind=SpanKind.SERVER,
+            attributes={'http.method': scope['method'], 'http.target': scope['path']}
+        )
+        token = otel_context.attach(trace.set_span_in_context(request_span))
+        trace_id = format(request_span.get_span_context().trace_id, '032x')
+        finished = False
+
+        def finish(status_code: int):
+            nonlocal finished
+            if finished:
+                return
+            finished = True
+            route = getattr(scope.get('route'), 'path', None)
+            if route:
+                request_span.update_name(f"{scope['method']} {route}")
+                request_span.set_attribute('http.route', route)
+            request_span.set_attribute('http.status_code', status_code)
+            if status_code >= 500:
+                request_span.set_status(Status(StatusCode.ERROR))
+            request_span.end()
+
+        status = {'code': 500}
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                status['code'] = message['status']
+                message['headers'] = list(message.get('headers', [])) + [(b'x-trace-id', trace_id.encode())]
+            await send(message)
+            if message['type'] == 'http.response.body' and not message.get('more_body', False):
+                finish(status['code'])
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as e:
+            request_span.record_exception(e)
+            raise
+        finally:
+            finish(status['code'])
+            otel_context.detach(token)
+
+
+class MongoCommandTracing(monitoring.CommandListener):
+    """
+    Records a client span per MongoDB command issued inside a trace
+
+    Motor runs commands on its thread pool with a copy of the caller's
+    context, so the current span here is the awaiting coroutine's span.
+    Commands outside any trace (maintenance loops) are not recorded.
+    """
+
+    def __init__(self):
+        self._spans = {}
+
+    def started(self, event):
+        if not trace.get_current_span().get_span_context().is_valid:
+            return
+        collection = event.command.get(event.command_name)
+        attributes = {
+            'db.system': 'mongodb',
+            'db.name': event.database_name,
+            'db.operation': event.command_name
+        }
+        if isinstance(collection, str):
+            attributes['db.mongodb.collection'] = collection
+        self._spans[event.request_id] = tracer.start_span(
+            f"mongodb.{event.command_name}", kind=SpanKind.CLIENT, attributes=attributes
+        )
+
+    def succeeded(self, event):
+        command_span = self._spans.pop(event.request_id, None)
+        if command_span is not None:
+            command_span.end()
+
+    def failed(self, event):
+        command_span = self._spans.pop(event.request_id, None)
+        if command_span is not None:
+            command_span.set_status(Status(StatusCode.ERROR, str(event.failure.get('errmsg', ''))[:200]))
+            command_span.end()
+
+
+if TRACING_ENABLED:
+    monitoring.register(MongoCommandTracing())
@@ -0,0 +1,66 @@
+"""
+Start-up warm-up of slow-to-import SDKs
+
+Provider SDKs are imported lazily so that importing the app stays cheap.
+warm_up() imports them during application start-up, before uvicorn accepts
+connections, so a worker only reports ready (to the launcher, or to a load
+balancer probing it) once they are loaded. Warming up on a thread after the
+worker is serving would only move the stall: an import holds the GIL for much
+of its run and holds the module import lock throughout, so requests arriving
+meanwhile are slowed, and any that import the same modules block on the lock.
+
+If the imports take longer than STARTUP_WARMUP_TIMEOUT_SECONDS (keep it below
+the launcher's WORKER_READY_TIMEOUT_SECONDS), start-up stops waiting and the
+rest finish on their thread while the worker serves, with that cost.
+
+    STARTUP_WARMUP=true
+    STARTUP_WARMUP_TIMEOUT_SECONDS=30
+"""
+import asyncio
+import importlib
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+STARTUP_WARMUP = os.getenv('STARTUP_WARMUP', 'true').lower() == 'true'
+STARTUP_WARMUP_TIMEOUT_SECONDS = float(os.getenv('STARTUP_WARMUP_TIMEOUT_SECONDS', 30))
+
+# Module, and an optional zero-argument initialiser to run after importing it
+WARMUP_TARGETS = [
+    ('services.ai_video_service', 'llm_chat_classes'),
+    ('services.video_ai_service', 'get_openai_client'),
+    ('numpy', None),
+]
+
+# Referenced so the task is not collected if start-up stops waiting for it
+_task = None
+
+
+def _warm(module_name: str, initialiser: str = None) -> float:
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    if initialiser:
+        getattr(module, initialiser)()
+    return time.perf_counter() - start
+
+
+async def _warm_all(targets: list):
+    for module_name, initialiser in targets:
+        try:
+            seconds = await asyncio.to_thread(_warm, module_name, initialiser)
+            logger.info("Warmed up %s in %.0f ms", module_name if not initialiser else f"{module_name}.{initialiser}", seconds * 1000)
+        except Exception as e:
+            logger.warning("Warm-up of %s failed: %s", module_name, e)
+
+
+async def warm_up(targets: list = None):
+    """Import each target on a worker thread, logging (not raising) failures; await before serving"""
+    global _task
+    task = _task = asyncio.ensure_future(_warm_all(targets or WARMUP_TARGETS))
+    try:
+        # Shielded so a timeout leaves the remaining imports running
+        await asyncio.wait_for(asyncio.shield(task), STARTUP_WARMUP_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        logger.warning("Warm-up not finished after %.0fs; serving while it completes", STARTUP_WARMUP_TIMEOUT_SECONDS)
@@ -2,18 +2,26 @@ module.exports = {
   apps: [
     {
       name: 'videoai-backend',
-      script: './backend/venv/bin/uvicorn',
-      args: 'server:app --host 127.0.0.1 --port 8001',
+      // launcher.py pre-forks the uvicorn workers (WEB_CONCURRENCY, default
+      // sized from CPUs and memory). Rolling reload without dropping
+      // requests: pm2 sendSignal SIGHUP videoai-backend
+      script: './backend/venv/bin/python',
+      args: '-m launcher --host 127.0.0.1 --port 8001',
+      interpreter: 'none',
       cwd: '/home/videoai/videoai-app/backend',
       env: {
         NODE_ENV: 'production',
-        PYTHONPATH: '/home/videoai/videoai-app/backend'
+        PYTHONPATH: '/home/videoai/videoai-app/backend',
+        PROMETHEUS_MULTIPROC_DIR: '/home/videoai/run/prometheus'
       },
       env_file: '/home/videoai/videoai-app/backend/.env.production',
       instances: 1,
       exec_mode: 'fork',
       watch: false,
+      // Workers are recycled individually by WORKER_MAX_RSS_MB; this caps the master
       max_memory_restart: '1G',
+      // Longer than WORKER_GRACEFUL_TIMEOUT_SECONDS so in-flight requests drain
+      kill_timeout: 35000,
       error_file: '/home/videoai/logs/backend-error.log',
       out_file: '/home/videoai/logs/backend-out.log',
       log_file: '/home/videoai/logs/backend-combined.log',
@@ -9,6 +9,19 @@ import { Sparkles, Video, Wand2, Loader2, FileText, Mic } from 'lucide-react';
 import axios from 'axios';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
+const POLL_INTERVAL_MS = 2000;
+const POLL_TIMEOUT_MS = 15 * 60 * 1000;
+const MAX_POLL_ERRORS = 5;
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+// Network errors, rate limiting and server errors while polling do not mean the job failed
+const isTransient = (err) => !err.response || err.response.status === 429 || err.response.status >= 500;
+
+const retryDelayMs = (err, fallbackMs) => {
+  const seconds = Number(err.response?.headers?.['retry-after']);
+  return Number.isFinite(seconds) && seconds > 0 ? seconds * 1000 : fallbackMs;
+};
 
 const DashboardPage = () => {
   const { user, token } = useAuth();
@@ -32,6 +45,7 @@ const DashboardPage = () => {
     setResult(null);
 
     try {
+      const headers = { Authorization: `Bearer ${token}` };
       const response = await axios.post(
         `${BACKEND_URL}/api/videos/generate-video`,
         {
@@ -40,14 +54,38 @@ const DashboardPage = () => {
           include_voiceover: includeVoiceover,
           voice
         },
-        {
-          headers: { Authorization: `Bearer ${token}` }
-        }
+        { headers }
       );
 
-      setResult(response.data);
+      // Generation runs as a background job; poll until it finishes
+      const { status_url: statusUrl, result_url: resultUrl } = response.data;
+      let status = response.data.status;
+      const deadline = Date.now() + POLL_TIMEOUT_MS;
+      let delay = POLL_INTERVAL_MS;
+      let pollErrors = 0;
+      while (status !== 'completed' && status !== 'failed') {
+        if (Date.now() > deadline) {
+          const timeout = new Error('Polling timed out');
+          timeout.userMessage = 'Your video is taking longer than usual. It will appear in My Videos when it is ready.';
+          throw timeout;
+        }
+        await sleep(delay);
+        try {
+          const statusResponse = await axios.get(`${BACKEND_URL}${statusUrl}`, { headers });
+          status = statusResponse.data.status;
+          pollErrors = 0;
+          delay = POLL_INTERVAL_MS;
+        } catch (err) {
+          pollErrors += 1;
+          if (!isTransient(err) || pollErrors > MAX_POLL_ERRORS) throw err;
+          delay = retryDelayMs(err, Math.min(POLL_INTERVAL_MS * 2 ** pollErrors, 30000));
+        }
+      }
+
+      const resultResponse = await axios.get(`${BACKEND_URL}${resultUrl}`, { headers });
+      setResult(resultResponse.data);
     } catch (err) {
-      setError(err.response?.data?.detail || 'Failed to generate video');
+      setError(err.response?.data?.detail || err.userMessage || 'Failed to generate video');
     } finally {
       setLoading(false);
     }
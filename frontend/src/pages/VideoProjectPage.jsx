@@ -155,7 +155,7 @@ const VideoProjectPage = () => {
                     <div className="aspect-video bg-gray-800 relative">
                       {scene.image_url ? (
                         <img
-                          src={scene.image_url}
+                          src={scene.preview_url || scene.image_url}
                           alt={`Scene ${scene.scene_number}`}
                           className="w-full h-full object-cover"
                         />
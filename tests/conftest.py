@@ -0,0 +1,17 @@
+"""
+Unit tests for the backend's self-contained logic
+
+Modules are imported the way the server imports them, from backend/. They
+create Motor clients at import, which connect lazily, so no MongoDB is
+needed; anything that would reach it is replaced in the test.
+
+    python -m pytest
+"""
+import os
+import sys
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend')
+sys.path.insert(0, BACKEND_DIR)
+
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'unit_tests')
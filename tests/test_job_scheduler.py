@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+
+from services.job_scheduler import JobScheduler, Ticket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_scheduler(slots: int = 1, aging_seconds: float = 1e9):
+    clock = FakeClock()
+    return JobScheduler(slots=slots, aging_seconds=aging_seconds, clock=clock), clock
+
+
+def drain(scheduler: JobScheduler, running: Ticket, count: int, clock: FakeClock = None) -> list:
+    """Finish the running job count times, returning the tickets started in turn"""
+    started = []
+    for _ in range(count):
+        if clock:
+            clock.now += 1
+        [running] = scheduler.finish(running)
+        started.append(running)
+    return started
+
+
+def test_jobs_start_at_once_while_slots_are_free():
+    scheduler, _ = make_scheduler(slots=2)
+    first, second, third = (Ticket('free', f'user{n}') for n in range(3))
+    assert scheduler.enqueue(first) == [first]
+    assert scheduler.enqueue(second) == [second]
+    assert scheduler.enqueue(third) == []
+    assert (scheduler.running, scheduler.queued) == (2, 1)
+    assert scheduler.finish(first) == [third]
+
+
+def test_busy_plans_share_slots_by_weight():
+    scheduler, _ = make_scheduler()
+    blocker = Ticket('free', 'blocker')
+    scheduler.enqueue(blocker)
+    for n in range(50):
+        scheduler.enqueue(Ticket('free', f'free{n}'))
+        scheduler.enqueue(Ticket('professional', f'pro{n}'))
+
+    plans = [ticket.plan for ticket in drain(scheduler, blocker, 50)]
+    # job_weight 4 against 1
+    assert plans.count('professional') == pytest.approx(40, abs=2)
+
+
+def test_users_of_a_plan_take_turns():
+    scheduler, _ = make_scheduler()
+    blocker = Ticket('starter', 'heavy')
+    scheduler.enqueue(blocker)
+    for n in range(3):
+        scheduler.enqueue(Ticket('starter', 'heavy', f'heavy{n}'))
+    scheduler.enqueue(Ticket('starter', 'light', 'light0'))
+
+    started = drain(scheduler, blocker, 4)
+    assert [ticket.job_id for ticket in started] == ['light0', 'heavy0', 'heavy1', 'heavy2']
+
+
+def free_start_position(aging_seconds: float) -> int:
+    """Enterprise jobs started before a free job queued behind a burst of them"""
+    scheduler, clock = make_scheduler(aging_seconds=aging_seconds)
+    # The free plan was just busy on its own, so its pass is ahead
+    for _ in range(20):
+        ticket = Ticket('free', 'regular', now=clock.now)
+        scheduler.enqueue(ticket)
+        clock.now += 1
+        scheduler.finish(ticket)
+    blocker = Ticket('enterprise', 'big', now=clock.now)
+    scheduler.enqueue(blocker)
+    for n in range(100):
+        scheduler.enqueue(Ticket('enterprise', f'big{n}', now=clock.now))
+    scheduler.enqueue(Ticket('free', 'waiting', now=clock.now))
+
+    started = drain(scheduler, blocker, 20, clock)
+    return [ticket.plan for ticket in started].index('free')
+
+
+def test_aging_moves_a_waiting_plan_ahead():
+    assert free_start_position(aging_seconds=2) < free_start_position(aging_seconds=10) < free_start_position(aging_seconds=1e9)
+
+
+def test_cancelled_job_leaves_the_queue():
+    scheduler, _ = make_scheduler()
+    running, queued = Ticket('free', 'a'), Ticket('free', 'b')
+    scheduler.enqueue(running)
+    scheduler.enqueue(queued)
+    scheduler.cancel(queued)
+    assert scheduler.queued == 0
+    assert scheduler.finish(running) == []
+    assert scheduler.running == 0
+
+
+def test_slot_releases_on_cancellation_while_queued():
+    scheduler, _ = make_scheduler()
+
+    async def main():
+        async with scheduler.slot('free', 'a', 'job-a'):
+            waiting = asyncio.ensure_future(scheduler.slot('free', 'b', 'job-b').__aenter__())
+            await asyncio.sleep(0)
+            assert scheduler.queued == 1
+            waiting.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiting
+            assert scheduler.queued == 0
+        assert scheduler.running == 0
+
+    asyncio.run(main())
@@ -0,0 +1,39 @@
+from services.keywords import MAX_PHRASE_WORDS, _phrases, extract_keywords, extract_queries
+
+
+def test_phrases_split_at_stop_words_and_punctuation():
+    phrases = _phrases('The ancient Roman aqueducts, built of stone, carried fresh mountain water into the city.')
+    assert phrases[0] == ('ancient', 'roman', 'aqueducts')
+    assert ('built',) in phrases and ('stone',) in phrases and ('city',) in phrases
+    assert all(len(phrase) <= MAX_PHRASE_WORDS for phrase in phrases)
+
+
+def test_words_repeated_across_scenes_rank_below_specific_ones():
+    queries = extract_queries(['Honeybees swarm; golden pollen.', 'Honeybees rest; quiet hive.', 'Honeybees fly; morning sun.'])
+    assert [scene[0] for scene in queries] == ['golden pollen', 'quiet hive', 'morning sun']
+
+
+def test_queries_per_scene_are_capped_and_distinct():
+    queries = extract_queries(['Storm clouds gather over the meadow while thunder rolls across distant hills'], max_queries=2)
+    assert len(queries[0]) == 2
+    assert len(set(queries[0])) == 2
+
+
+def test_single_word_phrases_are_extended_to_min_terms():
+    queries = extract_queries(['Meadow.', 'Storm clouds gather over the meadow'], min_terms=2)
+    # A one-word scene has nothing to extend with
+    assert queries[0] == ['meadow']
+    assert all(len(query.split()) >= 2 for query in queries[1])
+
+
+def test_scenes_without_content_words_get_no_queries():
+    queries = extract_queries(['and then it was so', 'Volcanic eruptions light the night sky'])
+    assert queries[0] == []
+    assert queries[1] and all(queries[1])
+    assert extract_queries([]) == []
+    assert extract_keywords('it is what it is') == ''
+
+
+def test_extract_keywords_is_the_best_query():
+    assert extract_keywords('Sunset over the desert dunes') == extract_queries(['Sunset over the desert dunes'])[0][0]
+
@@ -0,0 +1,28 @@
+from utils import metrics
+
+
+def test_counters_add_up_per_label_set():
+    metrics.inc('test_metrics_events_total', {'kind': 'a'})
+    metrics.inc('test_metrics_events_total', {'kind': 'a'}, 2)
+    metrics.inc('test_metrics_events_total', {'kind': 'b'})
+
+    values = {tuple(c['labels'].items()): c['value'] for c in metrics.snapshot('test_metrics_events')['counters']}
+    assert values == {(('kind', 'a'),): 3, (('kind', 'b'),): 1}
+
+
+def test_observe_keeps_count_average_and_max():
+    for seconds in (0.1, 0.3, 0.2):
+        metrics.observe('test_metrics_duration_seconds', seconds)
+
+    [timing] = metrics.snapshot('test_metrics_duration')['timings']
+    assert timing['count'] == 3
+    assert abs(timing['avg_seconds'] - 0.2) < 1e-9
+    assert timing['max_seconds'] == 0.3
+
+
+def test_snapshot_filters_by_prefix():
+    metrics.set_gauge('test_metrics_prefix_gauge', 7)
+
+    snapshot = metrics.snapshot('test_metrics_prefix')
+    assert [g['value'] for g in snapshot['gauges']] == [7]
+    assert not snapshot['counters'] and not snapshot['timings']
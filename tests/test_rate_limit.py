@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+from utils.rate_limit import GCRALimiter, Policy
+
+NOW = 1000.0
+
+
+@pytest.fixture
+def policy():
+    # One request a second, bursts of five
+    return Policy('test', per_minute=60, burst=5)
+
+
+def test_burst_is_allowed_then_denied(policy):
+    limiter = GCRALimiter(shared=False)
+    results = [limiter.check('user:1', policy, NOW) for _ in range(policy.burst)]
+    assert all(allowed for allowed, *_ in results)
+    assert [remaining for _, remaining, _, _ in results] == [4, 3, 2, 1, 0]
+
+    allowed, remaining, reset_after, retry_after = limiter.check('user:1', policy, NOW)
+    assert not allowed
+    assert remaining == 0
+    assert retry_after == pytest.approx(policy.interval)
+    assert reset_after == pytest.approx(policy.burst * policy.interval)
+
+
+def test_capacity_returns_at_the_emission_interval(policy):
+    limiter = GCRALimiter(shared=False)
+    for _ in range(policy.burst):
+        limiter.check('user:1', policy, NOW)
+
+    assert not limiter.check('user:1', policy, NOW + policy.interval * 0.9)[0]
+    assert limiter.check('user:1', policy, NOW + policy.interval)[0]
+    assert not limiter.check('user:1', policy, NOW + policy.interval)[0]
+    # A full bucket again once the TAT has passed
+    later = NOW + 60
+    assert [limiter.check('user:1', policy, later)[0] for _ in range(policy.burst + 1)] == [True] * policy.burst + [False]
+
+
+def test_keys_have_separate_buckets(policy):
+    limiter = GCRALimiter(shared=False)
+    for _ in range(policy.burst):
+        limiter.check('user:1', policy, NOW)
+    assert limiter.check('user:2', policy, NOW)[0]
+
+
+def test_refund_gives_back_one_request(policy):
+    limiter = GCRALimiter(shared=True)
+    for _ in range(policy.burst):
+        limiter.check('address:10.0.0.1', policy, NOW)
+    limiter.refund('address:10.0.0.1', policy)
+
+    assert limiter._pending['address:10.0.0.1'] == pytest.approx((policy.burst - 1) * policy.interval)
+    assert limiter.check('address:10.0.0.1', policy, NOW)[0]
+
+
+def test_refund_of_the_only_request_clears_pending_usage(policy):
+    limiter = GCRALimiter(shared=True)
+    limiter.check('address:10.0.0.1', policy, NOW)
+    limiter.refund('address:10.0.0.1', policy)
+    assert 'address:10.0.0.1' not in limiter._pending
+
+
+def test_failed_sync_keeps_usage_for_the_next_one(policy, monkeypatch):
+    limiter = GCRALimiter(shared=True)
+    limiter.check('user:1', policy, NOW)
+    limiter.check('user:1', policy, NOW)
+
+    async def unreachable(pending, now):
+        limiter.check('user:1', policy, NOW)
+        raise ConnectionError('mongo down')
+
+    monkeypatch.setattr(GCRALimiter, '_push', staticmethod(unreachable))
+    with pytest.raises(ConnectionError):
+        asyncio.run(limiter.sync())
+    # The two pushed requests are merged with the one charged meanwhile
+    assert limiter._pending['user:1'] == pytest.approx(3 * policy.interval)
+
+
+def test_key_table_is_pruned_when_full(policy):
+    limiter = GCRALimiter(max_keys=4, shared=False)
+    for n in range(4):
+        limiter.check(f'user:{n}', policy, NOW)
+    # Every earlier key's TAT has passed by now, so pruning frees them all
+    limiter.check('user:new', policy, NOW + 60)
+    assert list(limiter._tat) == ['user:new']
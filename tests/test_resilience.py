@@ -0,0 +1,182 @@
+import asyncio
+
+import pytest
+
+from services import resilience
+from services.resilience import (
+    CIRCUIT_CLOSED, CIRCUIT_HALF_OPEN, CIRCUIT_OPEN, CircuitBreaker, CircuitOpenError, ProviderError,
+    ProviderResilience, RetryBudget
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(resilience.time, 'monotonic', clock)
+    return clock
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(resilience, 'backoff_delay', lambda attempt: 0)
+
+
+def open_breaker(breaker: CircuitBreaker):
+    for _ in range(breaker.failure_threshold):
+        assert breaker.allow() is not None
+        breaker.record_failure()
+    assert breaker.state == CIRCUIT_OPEN
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_seconds=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CIRCUIT_CLOSED
+    assert breaker.allow() == 0
+
+    breaker.record_failure()
+    assert breaker.state == CIRCUIT_OPEN
+    assert breaker.allow() is None
+    assert not breaker.available()
+
+
+def test_breaker_half_opens_for_a_single_probe_then_closes(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=30)
+    open_breaker(breaker)
+
+    clock.now += 29
+    assert breaker.allow() is None
+    clock.now += 1
+    assert breaker.available()
+    probe = breaker.allow()
+    assert probe
+    assert breaker.state == CIRCUIT_HALF_OPEN
+    # Only one probe at a time
+    assert breaker.allow() is None
+    assert not breaker.available()
+
+    breaker.record_success()
+    breaker.release(probe)
+    assert breaker.state == CIRCUIT_CLOSED
+    assert breaker.allow() == 0
+
+
+def test_failed_probe_opens_the_breaker_again(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=30)
+    open_breaker(breaker)
+    clock.now += 30
+
+    probe = breaker.allow()
+    breaker.record_failure()
+    breaker.release(probe)
+    assert breaker.state == CIRCUIT_OPEN
+    clock.now += 29
+    assert breaker.allow() is None
+
+
+def test_probe_without_outcome_frees_the_half_open_slot(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=30)
+    open_breaker(breaker)
+    clock.now += 30
+
+    first = breaker.allow()
+    breaker.release(first)
+    second = breaker.allow()
+    assert second and second != first
+    # A stale token cannot free the current probe's slot
+    breaker.release(first)
+    assert breaker.allow() is None
+
+
+def test_retry_budget_is_a_fraction_of_requests(clock):
+    budget = RetryBudget(ratio=0.25, min_per_second=0, capacity=2)
+    assert budget.try_withdraw()
+    assert budget.try_withdraw()
+    assert not budget.try_withdraw()
+
+    for _ in range(3):
+        budget.record_request()
+    assert not budget.try_withdraw()
+    budget.record_request()
+    assert budget.try_withdraw()
+
+
+def test_retry_budget_refills_slowly_over_time(clock):
+    budget = RetryBudget(ratio=0, min_per_second=0.5, capacity=2)
+    budget.tokens = 0
+    clock.now += 1
+    assert not budget.try_withdraw()
+    clock.now += 1
+    assert budget.try_withdraw()
+
+
+def test_call_retries_retryable_errors(no_backoff):
+    provider = ProviderResilience('test_retry')
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ProviderError('HTTP 503', retryable=True, status_code=503)
+        return 'ok'
+
+    assert asyncio.run(provider.call(flaky)) == 'ok'
+    assert len(attempts) == 3
+    assert provider.breaker.state == CIRCUIT_CLOSED
+
+
+def test_call_does_not_retry_bad_requests(no_backoff):
+    provider = ProviderResilience('test_bad_request')
+    attempts = []
+
+    async def bad_request():
+        attempts.append(1)
+        raise ProviderError('HTTP 400', retryable=False, status_code=400)
+
+    with pytest.raises(ProviderError):
+        asyncio.run(provider.call(bad_request))
+    assert len(attempts) == 1
+    assert provider.breaker.consecutive_failures == 0
+
+
+def test_call_is_rejected_while_the_breaker_is_open(clock):
+    provider = ProviderResilience('test_open')
+    open_breaker(provider.breaker)
+    called = []
+
+    async def never():
+        called.append(1)
+
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(provider.call(never))
+    assert not called
+
+
+def test_cancelled_probe_does_not_wedge_the_breaker(clock):
+    provider = ProviderResilience('test_cancel')
+    open_breaker(provider.breaker)
+    clock.now += provider.breaker.reset_seconds
+
+    async def main():
+        task = asyncio.ensure_future(provider.call(lambda: asyncio.sleep(3600)))
+        await asyncio.sleep(0)
+        assert not provider.available()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert provider.breaker.state == CIRCUIT_HALF_OPEN
+    assert provider.available()
@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+
+from utils.single_flight import SingleFlight, normalize_text, request_key
+
+
+def test_concurrent_calls_with_one_key_run_once():
+    group = SingleFlight('test')
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {'scenes': [1, 2]}
+
+    async def main():
+        return await asyncio.gather(*(group.do('prompt', fetch) for _ in range(5)))
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert all(result == {'scenes': [1, 2]} for result in results)
+    # Each caller gets its own copy to mutate
+    results[0]['scenes'].append(3)
+    assert results[1]['scenes'] == [1, 2]
+    assert len(group) == 0
+
+
+def test_different_keys_and_later_calls_run_separately():
+    group = SingleFlight('test')
+    calls = []
+
+    async def fetch(key):
+        calls.append(key)
+        await asyncio.sleep(0)
+        return key
+
+    async def main():
+        await asyncio.gather(group.do('a', lambda: fetch('a')), group.do('b', lambda: fetch('b')))
+        # Nothing is cached once the call finished
+        await group.do('a', lambda: fetch('a'))
+
+    asyncio.run(main())
+    assert sorted(calls) == ['a', 'a', 'b']
+
+
+def test_errors_reach_every_waiter():
+    group = SingleFlight('test')
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise RuntimeError('upstream 500')
+
+    async def main():
+        return await asyncio.gather(*(group.do('k', failing) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert len(group) == 0
+
+
+def test_one_waiter_cancelling_leaves_the_call_running():
+    group = SingleFlight('test')
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return 'done'
+
+    async def main():
+        first = asyncio.ensure_future(group.do('k', fetch))
+        second = asyncio.ensure_future(group.do('k', fetch))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(main()) == 'done'
+    assert len(calls) == 1
+
+
+def test_last_waiter_cancelling_cancels_the_call():
+    group = SingleFlight('test')
+
+    async def main():
+        upstream_cancelled = asyncio.Event()
+
+        async def fetch():
+            try:
+                await asyncio.sleep(3600)
+            except asyncio.CancelledError:
+                upstream_cancelled.set()
+                raise
+
+        waiter = asyncio.ensure_future(group.do('k', fetch))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        await asyncio.wait_for(upstream_cancelled.wait(), 1)
+        # A new caller starts afresh rather than joining the cancelled call
+        assert len(group) == 0
+        return await group.do('k', lambda: asyncio.sleep(0, 'fresh'))
+
+    assert asyncio.run(main()) == 'fresh'
+
+
+def test_normalize_text_collapses_whitespace_and_unicode_forms():
+    assert normalize_text('  A short\n\thistory  ') == 'A short history'
+    assert normalize_text('ｆｕｌｌ width') == 'full width'
+
+
+def test_request_key_ignores_formatting_but_not_content():
+    key = request_key('user-1', prompt='Elephants in the  savannah', voice='alloy', include_voiceover=True)
+    assert key == request_key('user-1', include_voiceover=True, voice='alloy', prompt=' Elephants in the savannah\n')
+    assert key != request_key('user-2', prompt='Elephants in the savannah', voice='alloy', include_voiceover=True)
+    assert key != request_key('user-1', prompt='Elephants in the savannah', voice='nova', include_voiceover=True)
+    assert key != request_key('user-1', prompt='elephants in the savannah', voice='alloy', include_voiceover=True)
@@ -0,0 +1,36 @@
+import asyncio
+import threading
+
+import pytest
+
+from utils import metrics, stripe_client
+
+
+def _counter(name: str, **labels) -> float:
+    for counter in metrics.snapshot(name)['counters']:
+        if counter['name'] == name and counter['labels'] == labels:
+            return counter['value']
+    return 0
+
+
+def test_call_runs_on_the_stripe_pool_with_arguments():
+    def sdk_call(amount, currency=None):
+        return threading.current_thread().name, amount, currency
+
+    thread_name, amount, currency = asyncio.run(stripe_client.call_stripe('test.create', sdk_call, 500, currency='usd'))
+
+    assert thread_name.startswith('stripe')
+    assert (amount, currency) == (500, 'usd')
+
+
+def test_call_counts_calls_errors_and_duration():
+    def declined():
+        raise ValueError('card declined')
+
+    with pytest.raises(ValueError):
+        asyncio.run(stripe_client.call_stripe('test.declined', declined))
+
+    assert _counter('stripe_calls_total', operation='test.declined') == 1
+    assert _counter('stripe_call_errors_total', operation='test.declined', error='ValueError') == 1
+    timings = [t for t in metrics.snapshot('stripe_call_duration')['timings'] if t['labels'] == {'operation': 'test.declined'}]
+    assert timings[0]['count'] == 1